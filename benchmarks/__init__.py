@@ -0,0 +1,17 @@
+import os
+import sys
+from pathlib import Path
+
+# Add the src directory to the Python path, the same way tests do
+src_path = Path(__file__).parent.parent / "src"
+if str(src_path) not in sys.path:
+    sys.path.insert(0, str(src_path))
+
+# Benchmarks never talk to real services
+os.environ.setdefault("STORAGE_DB", "sqlite-memory")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("TEACHER_TELEGRAM_ID", "1")
+os.environ.setdefault("AGENT_ENDPOINT", "http://agent.local")
+os.environ.setdefault("USERS_GROUPS_MCP_ENDPOINT", "http://users-groups.local")
+os.environ.setdefault("LOOP_MONITOR_ENABLED", "0")
+os.environ.setdefault("TOKEN_PURGE_INTERVAL", "0")
@@ -0,0 +1,90 @@
+"""Broadcast throughput against the fake Bot API server.
+
+The fake server answers `429` like Telegram when more than 30 messages per
+second are sent (see `fake_bot_api.py`). Run from the repository root:
+
+    python -m benchmarks.bench_broadcast --recipients 5000
+    python -m benchmarks.bench_broadcast --recipients 1000 --rate 40 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+
+from telegram import Bot
+
+import envs
+import storage
+from benchmarks.fake_bot_api import FakeBotApi, serve
+from broadcast.fanout import Fanout
+from broadcast.models import Broadcast
+
+logger = logging.getLogger(__name__)
+
+
+async def run_broadcast(
+    recipients: int, rate: float, concurrency: int, latency: float = 0.0
+) -> dict:
+    storage.init_db(storage.engine)
+    with storage.SessionLocal() as session:
+        broadcast_id = Broadcast.create(
+            "Benchmark", "all", range(100_000, 100_000 + recipients), session
+        ).id
+
+    # telegram limits: ~1 message per second to a chat, ~30 per second overall
+    api = FakeBotApi(chat_rate=1.0, global_rate=30.0)
+    server, port = await serve(api)
+
+    try:
+        bot = Bot(envs.TELEGRAM_BOT_TOKEN, base_url=f"http://127.0.0.1:{port}/bot")
+        async with bot:
+
+            async def send(chat_id: int, text: str) -> None:
+                if latency:
+                    await asyncio.sleep(latency)
+                await bot.send_message(chat_id=chat_id, text=text)
+
+            fanout = Fanout(send, concurrency=concurrency, rate=rate)
+            report = await fanout.run(broadcast_id)
+    finally:
+        server.stop()
+        await api.webhook_client.aclose()
+
+    return {
+        "recipients": recipients,
+        "rate": rate,
+        "concurrency": concurrency,
+        "seconds": report.seconds,
+        "messages_per_s": report.messages_per_s,
+        "sent": report.sent,
+        "failed": report.failed,
+        "rate_limited_429": api.rate_limited,
+        "retries": report.retries,
+        "estimated_minutes_for_5000": round(5000 / report.messages_per_s / 60, 1)
+        if report.messages_per_s
+        else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=envs.BROADCAST_RATE)
+    parser.add_argument("--concurrency", type=int, default=envs.BROADCAST_CONCURRENCY)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="extra latency of every send"
+    )
+    parser.add_argument("--output", help="save results as JSON into the file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = asyncio.run(
+        run_broadcast(args.recipients, args.rate, args.concurrency, args.latency)
+    )
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,249 @@
+"""In-process benchmarks of the bot handlers.
+
+The application is built exactly as `run_bot` builds it, but the Bot API,
+the agent and the users-groups MCP server are replaced by local fakes.
+Every scenario reports throughput, latency percentiles and SQL queries.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_handlers --output bench.json
+    python -m benchmarks.bench_handlers --compare bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from fastmcp import Client
+from sqlalchemy import event
+from telegram import Update
+from telegram.ext import Application
+
+import envs
+import main
+import storage
+import upstreams
+from benchmarks.fakes import (
+    FakeBotRequest,
+    UpdateFactory,
+    agent_transport,
+    users_groups_server,
+)
+from loop_monitor import percentile
+from token_auth_db.models import AuthToken
+
+logger = logging.getLogger(__name__)
+
+# every scenario gets its own range of telegram user ids
+USER_ID_BASE = {"chat": 1_000_000, "token": 2_000_000, "registration": 3_000_000}
+
+
+class QueryCounter:
+    """Counts SQL statements executed by the storage engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args, **kwargs) -> None:
+        self.count += 1
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def chat_scenario(factory: UpdateFactory, n: int) -> List[List[Update]]:
+    """Every operation is a text message that goes to the agent"""
+    base = USER_ID_BASE["chat"]
+    return [[factory.message(base + i % 100, f"message {i}")] for i in range(n)]
+
+
+def token_scenario(factory: UpdateFactory, n: int) -> List[List[Update]]:
+    """Every operation binds a new issued token to a new user"""
+    base = USER_ID_BASE["token"]
+
+    with storage.SessionLocal() as session:
+        session.add_all([AuthToken(id=f"bench-token-{base + i}") for i in range(n)])
+        session.commit()
+
+    return [
+        [factory.message(base + i, f"/token bench-token-{base + i}")] for i in range(n)
+    ]
+
+
+def registration_scenario(factory: UpdateFactory, n: int) -> List[List[Update]]:
+    """Every operation is a full registration: /start, language, name, surname"""
+    base = USER_ID_BASE["registration"]
+    return [
+        [
+            factory.message(base + i, "/start"),
+            factory.callback(base + i, "lang_en"),
+            factory.message(base + i, "Alice"),
+            factory.message(base + i, "Smith"),
+        ]
+        for i in range(n)
+    ]
+
+
+SCENARIOS: Dict[str, Callable[[UpdateFactory, int], List[List[Update]]]] = {
+    "chat": chat_scenario,
+    "token": token_scenario,
+    "registration": registration_scenario,
+}
+
+
+async def run_scenario(
+    application: Application, operations: List[List[Update]], errors: list
+) -> dict:
+    latencies = []
+    errors.clear()
+
+    with QueryCounter(storage.engine) as queries:
+        started = time.perf_counter()
+        for updates in operations:
+            op_started = time.perf_counter()
+            for update in updates:
+                await application.process_update(update)
+            latencies.append(time.perf_counter() - op_started)
+        elapsed = time.perf_counter() - started
+
+    ops = len(operations)
+    return {
+        "operations": ops,
+        "seconds": round(elapsed, 4),
+        "throughput_ops": round(ops / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "sql_queries": queries.count,
+        "sql_per_op": round(queries.count / ops, 2) if ops else 0.0,
+        "errors": len(errors),
+    }
+
+
+async def run_benchmarks(
+    iterations: int = 200,
+    agent_latency: float = 0.0,
+    scenarios: Optional[List[str]] = None,
+) -> dict:
+    storage.init_db(storage.engine)
+
+    request = FakeBotRequest()
+    builder = (
+        Application.builder()
+        .token(envs.TELEGRAM_BOT_TOKEN)
+        .request(request)
+        .get_updates_request(FakeBotRequest())
+    )
+    application = main.build_application(builder)
+
+    errors = []
+
+    async def on_error(update, context) -> None:
+        errors.append(context.error)
+
+    application.add_error_handler(on_error)
+
+    mcp_server = users_groups_server()
+    users_groups_client = upstreams.users_groups_client
+    upstreams.set_agent_client(
+        httpx.AsyncClient(transport=agent_transport(agent_latency))
+    )
+    upstreams.users_groups_client = lambda: Client(mcp_server)
+
+    results = {}
+    try:
+        async with application:
+            factory = UpdateFactory(application.bot)
+            for name in scenarios or SCENARIOS:
+                operations = SCENARIOS[name](factory, iterations)
+                request.calls.clear()
+                results[name] = await run_scenario(application, operations, errors)
+                results[name]["bot_api_calls"] = dict(request.calls)
+                logger.info(f"{name}: {results[name]}")
+    finally:
+        upstreams.users_groups_client = users_groups_client
+        await upstreams.close()
+
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "timestamp": int(time.time()),
+        "iterations": iterations,
+        "agent_latency": agent_latency,
+        "scenarios": results,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict) -> str:
+    """Returns a table with relative changes of the current run to the baseline"""
+    metrics = ("throughput_ops", "p50_ms", "p95_ms", "p99_ms", "sql_per_op")
+    lines = [
+        f"baseline={baseline.get('commit')} current={current.get('commit')}",
+        f"{'scenario':<14}" + "".join(f"{metric:>16}" for metric in metrics),
+    ]
+
+    for name, result in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if not base:
+            continue
+
+        row = f"{name:<14}"
+        for metric in metrics:
+            if base[metric]:
+                change = (result[metric] - base[metric]) / base[metric]
+                row += f"{change:>+16.1%}"
+            else:
+                row += f"{'n/a':>16}"
+        lines.append(row)
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument(
+        "--agent-latency", type=float, default=0.0, help="agent reply delay, seconds"
+    )
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS))
+    parser.add_argument("--output", help="save results as JSON into the file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = asyncio.run(
+        run_benchmarks(args.iterations, args.agent_latency, args.scenario)
+    )
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print(compare(json.load(f), results))
@@ -0,0 +1,127 @@
+"""Rolling restart of the bot under load.
+
+Two bot processes share a sqlite file database. The second one starts
+while the first one processes messages, then the first one gets SIGTERM,
+like on a deploy. Every message must get one reply and one agent call.
+Run from the repository root:
+
+    python -m benchmarks.bench_restart --count 200 --rate 10 --agent-latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import subprocess
+import tempfile
+import time
+
+from benchmarks.fake_bot_api import FakeBotApi, serve
+from benchmarks.load_replay import start_bot, synthetic_updates
+
+logger = logging.getLogger(__name__)
+
+
+async def _stop(bot: subprocess.Popen, kill_after: float = 60.0) -> float:
+    """Sends SIGTERM and SIGKILL after `kill_after` seconds like an orchestrator,
+    returns seconds the bot took to exit"""
+    started = time.perf_counter()
+    bot.send_signal(signal.SIGTERM)
+    try:
+        await asyncio.to_thread(bot.wait, kill_after)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"Bot is not stopped in {kill_after}s, kill it")
+        bot.kill()
+    return round(time.perf_counter() - started, 3)
+
+
+async def run_restart(
+    count: int,
+    rate: float,
+    agent_latency: float,
+    drain_timeout: float = 25.0,
+    kill_after: float = 30.0,
+    grace: float = 30.0,
+) -> dict:
+    api = FakeBotApi(chat_rate=0, global_rate=0, agent_latency=agent_latency)
+    server, port = await serve(api)
+    workdir = tempfile.TemporaryDirectory()
+    env = dict(STORAGE_DB="sqlite", DRAIN_TIMEOUT=str(drain_timeout))
+
+    old = start_bot("polling", port, cwd=workdir.name, **env)
+    new = None
+    try:
+        await asyncio.wait_for(api.ready.wait(), timeout=60)
+
+        old_stopped = None
+        started = time.perf_counter()
+        for sent, update in enumerate(synthetic_updates(count, count), start=1):
+            delay = started + (sent - 1) / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            api.push_update(update)
+
+            if sent == count // 2:
+                # deploy: the new instance starts, the old one is stopped
+                new = start_bot("polling", port, cwd=workdir.name, **env)
+                await asyncio.sleep(1.0)
+                old_stopped = asyncio.create_task(_stop(old, kill_after))
+
+        deadline = time.perf_counter() + grace
+        while api.unanswered and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        old_stop_seconds = await old_stopped
+    finally:
+        for bot in (old, new):
+            if bot and bot.poll() is None:
+                await _stop(bot)
+        api.new_updates.set()
+        await asyncio.sleep(0.1)
+        server.stop()
+        await api.webhook_client.aclose()
+        workdir.cleanup()
+
+    latencies = api.latencies
+    return {
+        "sent": sent,
+        "answered": len(latencies),
+        "lost": api.unanswered,
+        "extra_replies": api.calls["sendMessage"] - len(latencies),
+        "agent_calls": sum(api.agent_calls.values()),
+        "duplicate_agent_calls": sum(
+            calls - 1 for calls in api.agent_calls.values() if calls > 1
+        ),
+        "old_instance_stop_seconds": old_stop_seconds,
+        "max_latency_ms": round(max(latencies, default=0.0) * 1000, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200, help="number of messages")
+    parser.add_argument("--rate", type=float, default=10.0, help="messages per second")
+    parser.add_argument("--agent-latency", type=float, default=0.2)
+    parser.add_argument("--drain-timeout", type=float, default=25.0)
+    parser.add_argument(
+        "--kill-after", type=float, default=30.0, help="SIGKILL after SIGTERM, seconds"
+    )
+    parser.add_argument("--output", help="save results as JSON into the file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = asyncio.run(
+        run_restart(
+            args.count,
+            args.rate,
+            args.agent_latency,
+            args.drain_timeout,
+            args.kill_after,
+        )
+    )
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
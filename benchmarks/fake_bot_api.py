@@ -0,0 +1,282 @@
+"""Local stand-in of the Telegram Bot API server (and of the agent endpoint).
+
+Implements the methods the bot uses: getMe, getUpdates, setWebhook,
+deleteWebhook, sendMessage, editMessageText, answerCallbackQuery.
+Outgoing messages are rate limited like Telegram does (per chat and
+global), the limit is answered with `429 Too Many Requests`.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, defaultdict, deque
+from typing import Dict, List, Optional
+
+import httpx
+import tornado.netutil
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from benchmarks.fakes import BOT_ID, _message
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows `rate` events per second with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token, returns 0 on success or seconds to wait for the next one"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotApi:
+    """State of the fake Bot API: pending updates, webhook and reply tracking"""
+
+    def __init__(
+        self,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        global_rate: float = 30.0,
+        agent_latency: float = 0.0,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = (
+            TokenBucket(global_rate, global_rate) if global_rate else None
+        )
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.agent_latency = agent_latency
+
+        self.pending: deque = deque()
+        self.new_updates = asyncio.Event()
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self.webhook_client: Optional[httpx.AsyncClient] = None
+
+        self.calls: Counter = Counter()
+        # message -> number of agent calls with it
+        self.agent_calls: Counter = Counter()
+        self.rate_limited = 0
+        self.webhook_errors = 0
+        self.ready = asyncio.Event()
+
+        # update id -> time it was delivered to the bot
+        self.sent_at: Dict[int, float] = {}
+        # chat id -> update ids waiting for a reply
+        self.waiting: Dict[int, deque] = defaultdict(deque)
+        # latencies (seconds) of the first reply to every update
+        self.latencies: List[float] = []
+        self._message_id = 0
+
+    def push_update(self, update: dict) -> None:
+        """Hands an update to the bot either by webhook or by getUpdates"""
+        update_id = update["update_id"]
+        chat_id = _chat_id(update)
+
+        self.sent_at[update_id] = time.perf_counter()
+        if chat_id is not None:
+            self.waiting[chat_id].append(update_id)
+
+        if self.webhook_url:
+            asyncio.get_running_loop().create_task(self._post_webhook(update))
+        else:
+            self.pending.append(update)
+            self.new_updates.set()
+
+    async def _post_webhook(self, update: dict) -> None:
+        headers = {}
+        if self.webhook_secret:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+        try:
+            response = await self.webhook_client.post(
+                self.webhook_url, json=update, headers=headers
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.webhook_errors += 1
+            logger.warning(f"Webhook delivery of {update['update_id']} failed: {e}")
+
+    async def get_updates(self, offset: int, limit: int, timeout: float) -> list:
+        # the offset confirms all updates before it
+        while self.pending and self.pending[0]["update_id"] < offset:
+            self.pending.popleft()
+
+        if not self.pending and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return [update for _, update in zip(range(limit), self.pending)]
+
+    def reply(self, chat_id: Optional[int], update_id: Optional[int] = None) -> None:
+        """Tracks latency of the first reply to an update"""
+        if update_id is None and chat_id is not None and self.waiting[chat_id]:
+            update_id = self.waiting[chat_id].popleft()
+        elif update_id is not None and chat_id is not None:
+            try:
+                self.waiting[chat_id].remove(update_id)
+            except ValueError:
+                return  # already replied
+
+        sent_at = self.sent_at.pop(update_id, None)
+        if sent_at is not None:
+            self.latencies.append(time.perf_counter() - sent_at)
+
+    def throttle(self, chat_id: Optional[int]) -> float:
+        """Returns seconds to retry after or 0 if the message can be sent"""
+        if chat_id is not None and self.chat_rate:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self.chat_buckets[chat_id] = bucket
+            retry_after = bucket.take()
+            if retry_after:
+                return retry_after
+
+        if self.global_bucket:
+            return self.global_bucket.take()
+        return 0.0
+
+    def next_message(self, chat_id: int, text: str) -> dict:
+        self._message_id += 1
+        return _message(chat_id, text, self._message_id)
+
+    @property
+    def unanswered(self) -> int:
+        return len(self.sent_at)
+
+
+def _chat_id(update: dict) -> Optional[int]:
+    if "message" in update:
+        return update["message"]["chat"]["id"]
+    if "callback_query" in update:
+        return update["callback_query"]["from"]["id"]
+    return None
+
+
+class BotMethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api: FakeBotApi):
+        self.api = api
+
+    def _params(self) -> dict:
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(self.request.body or b"{}")
+        return {
+            name: self.get_body_argument(name) for name in self.request.body_arguments
+        }
+
+    def _ok(self, result) -> None:
+        self.write({"ok": True, "result": result})
+
+    async def post(self, token: str, method: str) -> None:
+        api = self.api
+        params = self._params()
+        api.calls[method] += 1
+
+        if method == "getMe":
+            self._ok(
+                {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": "bot"}
+            )
+        elif method == "getUpdates":
+            api.ready.set()
+            updates = await api.get_updates(
+                int(params.get("offset", 0)),
+                int(params.get("limit", 100)),
+                float(params.get("timeout", 0)),
+            )
+            self._ok(updates)
+        elif method == "setWebhook":
+            api.webhook_url = params.get("url")
+            api.webhook_secret = params.get("secret_token")
+            api.ready.set()
+            self._ok(True)
+        elif method == "deleteWebhook":
+            api.webhook_url = None
+            self._ok(True)
+        elif method in ("sendMessage", "editMessageText", "answerCallbackQuery"):
+            chat_id = params.get("chat_id")
+            chat_id = int(chat_id) if chat_id is not None else None
+
+            retry_after = api.throttle(chat_id)
+            if retry_after:
+                api.rate_limited += 1
+                retry_after = max(1, round(retry_after))
+                self.set_status(429)
+                self.write(
+                    {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": f"Too Many Requests: retry after {retry_after}",
+                        "parameters": {"retry_after": retry_after},
+                    }
+                )
+                return
+
+            if method == "answerCallbackQuery":
+                # callback query ids are update ids of the fake updates
+                query_id = int(params["callback_query_id"])
+                api.reply(_callback_chat(api, query_id), query_id)
+                self._ok(True)
+            else:
+                api.reply(chat_id)
+                self._ok(api.next_message(chat_id, params.get("text", "")))
+        else:
+            self._ok(True)
+
+
+def _callback_chat(api: FakeBotApi, update_id: int) -> Optional[int]:
+    for chat_id, update_ids in api.waiting.items():
+        if update_id in update_ids:
+            return chat_id
+    return None
+
+
+class AgentHandler(tornado.web.RequestHandler):
+    """Fake agent: answers with the echo of the message"""
+
+    def initialize(self, api: FakeBotApi):
+        self.api = api
+
+    async def post(self) -> None:
+        if self.api.agent_latency:
+            await asyncio.sleep(self.api.agent_latency)
+        payload = json.loads(self.request.body)
+        self.api.agent_calls[payload["message"]] += 1
+        self.write({"message": f"echo: {payload['message']}"})
+
+
+async def serve(api: FakeBotApi, port: int = 0) -> tuple[HTTPServer, int]:
+    """Starts the fake server, returns the server and its port.
+
+    Bot API base url is `http://127.0.0.1:<port>/bot`,
+    agent endpoint is `http://127.0.0.1:<port>/agent`.
+    """
+    app = tornado.web.Application(
+        [
+            (r"/bot([^/]+)/(\w+)", BotMethodHandler, {"api": api}),
+            (r"/agent/message", AgentHandler, {"api": api}),
+        ]
+    )
+    api.webhook_client = httpx.AsyncClient(timeout=30.0)
+
+    server = HTTPServer(app)
+    sockets = tornado.netutil.bind_sockets(port, "127.0.0.1")
+    server.add_sockets(sockets)
+    return server, sockets[0].getsockname()[1]
@@ -0,0 +1,167 @@
+"""Local stand-ins of Telegram Bot API, the agent and the users-groups MCP server"""
+
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Optional
+
+import httpx
+from fastmcp import FastMCP
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+BOT_ID = 123456
+
+
+def _message(chat_id: int, text: str, message_id: int = 1) -> dict:
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"},
+        "text": text,
+    }
+
+
+class FakeBotRequest(BaseRequest):
+    """Answers Bot API calls locally instead of sending them to Telegram.
+
+    Every call is counted by its method name, so a benchmark can check
+    how many requests to Telegram a handler makes.
+    """
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self._message_id = 0
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> tuple[int, bytes]:
+        bot_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[bot_method] += 1
+
+        if bot_method == "getMe":
+            result = {
+                "id": BOT_ID,
+                "is_bot": True,
+                "first_name": "Bot",
+                "username": "benchmark_bot",
+            }
+        elif bot_method in ("sendMessage", "editMessageText", "sendDocument"):
+            self._message_id += 1
+            result = _message(
+                int(params.get("chat_id", 0)),
+                str(params.get("text", "")),
+                self._message_id,
+            )
+        elif bot_method == "getUpdates":
+            result = []
+        else:
+            # answerCallbackQuery, deleteWebhook, setWebhook, ...
+            result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class UpdateFactory:
+    """Builds synthetic updates as Telegram sends them"""
+
+    def __init__(self, bot=None):
+        self.bot = bot
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"User{user_id}",
+            "username": f"user{user_id}",
+        }
+
+    def message_data(self, user_id: int, text: str) -> dict:
+        """Raw (JSON) text message update, commands get the command entity"""
+        update_id = self._next_id()
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split(" ", 1)[0]
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(command)}
+            ]
+        return {"update_id": update_id, "message": message}
+
+    def callback_data(self, user_id: int, data: str) -> dict:
+        """Raw (JSON) update of a pressed inline keyboard button"""
+        update_id = self._next_id()
+        callback_query = {
+            "id": str(update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": _message(user_id, "keyboard", update_id),
+        }
+        return {"update_id": update_id, "callback_query": callback_query}
+
+    def message(self, user_id: int, text: str) -> Update:
+        return Update.de_json(self.message_data(user_id, text), self.bot)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        return Update.de_json(self.callback_data(user_id, data), self.bot)
+
+
+def agent_transport(latency: float = 0.0) -> httpx.MockTransport:
+    """Transport of the agent endpoint that answers after `latency` seconds"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        payload = json.loads(request.content)
+        return httpx.Response(200, json={"message": f"echo: {payload['message']}"})
+
+    return httpx.MockTransport(handler)
+
+
+def users_groups_server() -> FastMCP:
+    """In-memory users-groups MCP server with the tools the bot calls"""
+    server = FastMCP("users-groups")
+    users = set()
+
+    @server.tool
+    def create_user(
+        telegram_id: int, username: str, first_name: str, last_name: str
+    ) -> str:
+        if telegram_id in users:
+            return f"User {telegram_id} already exists"
+        users.add(telegram_id)
+        return f"User {telegram_id} created"
+
+    return server
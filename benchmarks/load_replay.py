@@ -0,0 +1,215 @@
+"""Load generator that replays update streams against `run_bot`.
+
+The bot (`src/main.py`) runs in a subprocess and talks to the local fake
+Bot API server (see `fake_bot_api.py`), which also plays the agent.
+Updates are synthetic chat messages or a recorded stream (NDJSON with one
+update per line), replayed at a fixed rate. Run from the repository root:
+
+    python -m benchmarks.load_replay --mode polling --rate 50 --users 500 --count 2000
+    python -m benchmarks.load_replay --mode webhook --replay updates.ndjson
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+from benchmarks.fake_bot_api import FakeBotApi, serve
+from benchmarks.fakes import UpdateFactory
+from loop_monitor import percentile
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).parent.parent
+
+
+def synthetic_updates(users: int, count: int) -> Iterator[dict]:
+    """Chat messages from `users` distinct users"""
+    factory = UpdateFactory()
+    for i in range(count):
+        yield factory.message_data(100_000 + i % users, f"message {i}")
+
+
+def replay_updates(
+    path: str, users: Optional[int], count: Optional[int]
+) -> Iterator[dict]:
+    """Recorded updates, update ids are renumbered to keep them growing.
+
+    When `users` is set user / chat ids are folded to that cardinality.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        lines = (line for line in f if line.strip())
+        for update_id, line in enumerate(itertools.islice(lines, count), start=1):
+            update = json.loads(line)
+            update["update_id"] = update_id
+            if users:
+                _fold_user(update, users)
+            yield update
+
+
+def _fold_user(update: dict, users: int) -> None:
+    for kind in ("message", "callback_query"):
+        if kind in update:
+            user = update[kind]["from"]
+            user["id"] = 100_000 + user["id"] % users
+            if kind == "message":
+                update[kind]["chat"]["id"] = user["id"]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_bot(
+    mode: str, api_port: int, cwd: Optional[str] = None, **overrides: str
+) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN="123456:load",
+        TELEGRAM_API_BASE_URL=f"http://127.0.0.1:{api_port}/bot",
+        AGENT_ENDPOINT=f"http://127.0.0.1:{api_port}/agent",
+        COMMUNICATION_MODE=mode,
+        STORAGE_DB="sqlite-memory",
+    )
+    env.update(overrides)
+
+    if mode == "webhook":
+        webhook_port = _free_port()
+        env.update(
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=str(webhook_port),
+            WEBHOOK_URL=f"http://127.0.0.1:{webhook_port}",
+        )
+
+    return subprocess.Popen(
+        [sys.executable, str(ROOT / "src" / "main.py")],
+        env=env,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=None if logger.isEnabledFor(logging.DEBUG) else subprocess.DEVNULL,
+    )
+
+
+async def run_load(
+    updates: Iterator[dict],
+    mode: str = "polling",
+    rate: float = 20.0,
+    agent_latency: float = 0.0,
+    grace: float = 10.0,
+    rate_limits: bool = True,
+) -> dict:
+    if rate_limits:
+        api = FakeBotApi(agent_latency=agent_latency)
+    else:
+        api = FakeBotApi(chat_rate=0, global_rate=0, agent_latency=agent_latency)
+
+    server, port = await serve(api)
+    bot = start_bot(mode, port)
+
+    try:
+        await asyncio.wait_for(api.ready.wait(), timeout=60)
+        # webhook server of the bot starts right after setWebhook
+        await asyncio.sleep(1 if mode == "webhook" else 0)
+
+        sent = 0
+        started = time.perf_counter()
+        for sent, update in enumerate(updates, start=1):
+            # keep the schedule, do not burst to catch up after a slow push
+            delay = started + (sent - 1) / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            api.push_update(update)
+        feeding = time.perf_counter() - started
+
+        deadline = time.perf_counter() + grace
+        while api.unanswered and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        try:
+            # the bot talks to the fake server while it stops, keep serving it
+            await asyncio.to_thread(bot.wait, 30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        # release pending long polling requests before the server is stopped
+        api.new_updates.set()
+        await asyncio.sleep(0.1)
+        server.stop()
+        await api.webhook_client.aclose()
+
+    latencies = api.latencies
+    answered = len(latencies)
+    return {
+        "mode": mode,
+        "target_rate": rate,
+        "sent": sent,
+        "answered": answered,
+        "offered_updates_per_s": round(sent / feeding, 2) if feeding else 0.0,
+        "sustained_updates_per_s": round(answered / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies, default=0.0) * 1000, 2),
+        },
+        "errors": {
+            "unanswered": api.unanswered,
+            "unanswered_rate": round(api.unanswered / sent, 4) if sent else 0.0,
+            "rate_limited_429": api.rate_limited,
+            "webhook_failures": api.webhook_errors,
+        },
+        "bot_api_calls": dict(api.calls),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--rate", type=float, default=20.0, help="updates per second")
+    parser.add_argument("--users", type=int, default=100, help="distinct users")
+    parser.add_argument("--count", type=int, default=500, help="number of updates")
+    parser.add_argument("--replay", help="NDJSON file with recorded updates")
+    parser.add_argument("--agent-latency", type=float, default=0.0)
+    parser.add_argument("--grace", type=float, default=10.0)
+    parser.add_argument(
+        "--no-rate-limits",
+        action="store_true",
+        help="do not emulate Telegram flood limits (429)",
+    )
+    parser.add_argument("--output", help="save results as JSON into the file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.replay:
+        stream = replay_updates(args.replay, args.users, args.count)
+    else:
+        stream = synthetic_updates(args.users, args.count)
+
+    results = asyncio.run(
+        run_load(
+            stream,
+            mode=args.mode,
+            rate=args.rate,
+            agent_latency=args.agent_latency,
+            grace=args.grace,
+            rate_limits=not args.no_rate_limits,
+        )
+    )
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,107 @@
+"""Bots served by the process.
+
+A process serves the single bot configured by `TELEGRAM_BOT_TOKEN`,
+`TEACHER_TELEGRAM_ID` and `AGENT_ENDPOINT`, or many bots listed in the
+`BOTS_CONFIG` JSON file. Strings of the file support `${VAR}` expansion,
+so tokens can stay in the environment:
+
+    {
+      "bots": {
+        "math": {
+          "token": "${MATH_BOT_TOKEN}",
+          "teacher_id": 1001,
+          "agent_endpoint": "http://math-agent:8000"
+        }
+      }
+    }
+
+Bots share the database pool and clients of the upstreams, every bot has
+its own application: handlers state, update claims, broadcasts and their
+rate limits.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+import envs
+
+
+@dataclass(frozen=True)
+class BotConfig:
+    name: str
+    token: str
+    teacher_id: int = 0
+    agent_endpoint: Optional[str] = None
+    # webhook mode, every bot of the process needs its own port
+    webhook_url: Optional[str] = None
+    webhook_port: Optional[int] = None
+
+    @property
+    def bot_id(self) -> int:
+        """Telegram id of the bot, the first part of the token"""
+        bot_id = self.token.split(":")[0]
+        return int(bot_id) if bot_id.isdigit() else 0
+
+    @property
+    def lease_name(self) -> str:
+        return f"bot:{self.bot_id}"
+
+
+def from_envs() -> BotConfig:
+    """The single bot configured by envs"""
+    return BotConfig(
+        name="default",
+        token=envs.TELEGRAM_BOT_TOKEN or "",
+        teacher_id=envs.TEACHER_TELEGRAM_ID,
+        agent_endpoint=envs.AGENT_ENDPOINT,
+        webhook_url=envs.WEBHOOK_URL,
+        webhook_port=int(envs.WEBHOOK_PORT) if envs.WEBHOOK_PORT else None,
+    )
+
+
+def _expand(value):
+    if isinstance(value, str):
+        return os.path.expandvars(value)
+    return value
+
+
+def load(path: str) -> List[BotConfig]:
+    """Reads bots from the JSON file, raises `ValueError` on invalid config"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    configs = []
+    for name, options in data.get("bots", {}).items():
+        options = {key: _expand(value) for key, value in options.items()}
+        if not options.get("token"):
+            raise ValueError(f"Bot '{name}' has no token")
+        for key in ("teacher_id", "webhook_port"):
+            if options.get(key):
+                options[key] = int(options[key])
+        try:
+            configs.append(BotConfig(name=name, **options))
+        except TypeError as e:
+            raise ValueError(f"Bot '{name}' has invalid options: {e}") from None
+
+    if not configs:
+        raise ValueError(f"No bots in '{path}'")
+    for field in ("bot_id", "webhook_port"):
+        values = [getattr(config, field) for config in configs]
+        values = [value for value in values if value]
+        if len(values) != len(set(values)):
+            raise ValueError(f"Bots in '{path}' have the same {field}")
+    return configs
+
+
+def configured() -> List[BotConfig]:
+    """Bots to serve: from `BOTS_CONFIG` or the single bot of envs"""
+    if envs.BOTS_CONFIG:
+        return load(envs.BOTS_CONFIG)
+    return [from_envs()]
+
+
+def config(context) -> BotConfig:
+    """Config of the bot that handles the update"""
+    return context.bot_data.get("config") or from_envs()
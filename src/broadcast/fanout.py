@@ -0,0 +1,344 @@
+"""Concurrent, rate limited delivery of broadcasts.
+
+Recipients are read from the database page by page and sent by
+`concurrency` workers. All sends go through one `RateLimiter`, a
+`RetryAfter` (429) answer pauses all workers for the time Telegram asks.
+Delivery results are checkpointed to the database in bulk, so a broadcast
+interrupted by a restart continues with recipients not reached yet.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+)
+
+from broadcast.models import Broadcast, BroadcastStatus, DeliveryStatus
+from storage import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# telegram allows about 30 messages per second to different chats
+DEFAULT_RATE = 25.0
+
+
+@dataclass
+class BroadcastReport:
+    broadcast_id: int
+    status: str = BroadcastStatus.RUNNING.value
+    total: int = 0
+    # counters of this run, a resumed broadcast counts only the rest
+    sent: int = 0
+    failed: int = 0
+    rate_limited: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+    # error description -> number of recipients
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def messages_per_s(self) -> float:
+        return (
+            round((self.sent + self.failed) / self.seconds, 2) if self.seconds else 0.0
+        )
+
+    def summary(self) -> str:
+        lines = [
+            f"Broadcast #{self.broadcast_id}: {self.status}",
+            f"sent {self.sent}, failed {self.failed} of {self.total}",
+            f"{self.seconds:.1f}s, {self.messages_per_s} messages/s",
+            f"rate limited {self.rate_limited} times, {self.retries} retries",
+        ]
+        for error, count in sorted(self.errors.items(), key=lambda e: -e[1])[:5]:
+            lines.append(f"{count} x {error}")
+        return "\n".join(lines)
+
+
+class RateLimiter:
+    """Spaces sends out to `rate` per second, `pause` holds all of them"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # reserve the next slot before sleeping, so waiters do not collide
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+def _seconds(retry_after) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class Fanout:
+    """Delivers a broadcast stored in the database.
+
+    `send(chat_id, text)` sends a message, eg `bot.send_message`.
+    Database work runs in worker threads, the loop is not blocked.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[int, str], Awaitable],
+        concurrency: int = 20,
+        rate: float = DEFAULT_RATE,
+        max_attempts: int = 3,
+        page_size: int = 500,
+        checkpoint_size: int = 100,
+        checkpoint_interval: float = 2.0,
+        session_factory=SessionLocal,
+    ):
+        self.send = send
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.max_attempts = max_attempts
+        self.page_size = page_size
+        self.checkpoint_size = checkpoint_size
+        self.checkpoint_interval = checkpoint_interval
+        self.session_factory = session_factory
+        # paging and checkpoints of the broadcasts take turns, so they
+        # do not share a connection at the same time on sqlite
+        self._db_lock = asyncio.Lock()
+
+    def _db(self, method: Callable, *args):
+        with self.session_factory() as session:
+            return method(*args, session)
+
+    async def call_db(self, method: Callable, *args):
+        """Runs `method(*args, session)` in a worker thread"""
+        async with self._db_lock:
+            return await asyncio.to_thread(self._db, method, *args)
+
+    async def run(
+        self, broadcast_id: int, cancelled: Optional[asyncio.Event] = None
+    ) -> BroadcastReport:
+        """Sends the broadcast to recipients not reached yet"""
+        cancelled = cancelled or asyncio.Event()
+        broadcast = await self.call_db(Broadcast.find_by_id, broadcast_id)
+        report = BroadcastReport(broadcast_id, total=broadcast.total)
+        await self.call_db(Broadcast.set_status, broadcast_id, BroadcastStatus.RUNNING)
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: List[Tuple[int, DeliveryStatus, int, Optional[str]]] = []
+        flush_lock = asyncio.Lock()
+        last_flush = time.perf_counter()
+        started = time.perf_counter()
+
+        async def flush(force: bool = False) -> None:
+            nonlocal results, last_flush
+            due = time.perf_counter() - last_flush >= self.checkpoint_interval
+            if not results or not (
+                force or due or len(results) >= self.checkpoint_size
+            ):
+                return
+            async with flush_lock:
+                batch, results = results, []
+                last_flush = time.perf_counter()
+                try:
+                    await self.call_db(Broadcast.checkpoint, broadcast_id, batch)
+                except BaseException:
+                    # the batch goes with the next checkpoint
+                    results = batch + results
+                    raise
+
+        async def produce() -> None:
+            after = None
+            while not cancelled.is_set():
+                chat_ids = await self.call_db(
+                    Broadcast.pending_recipients,
+                    broadcast_id,
+                    after,
+                    self.page_size,
+                )
+                for chat_id in chat_ids:
+                    await queue.put(chat_id)
+                if len(chat_ids) < self.page_size:
+                    break
+                after = chat_ids[-1]
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def work() -> None:
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    if cancelled.is_set():
+                        # drain the queue, so the producer is not blocked
+                        continue
+                    try:
+                        status, attempts, error = await self._deliver(
+                            chat_id, broadcast.text, report
+                        )
+                    except Exception as e:
+                        logger.exception(
+                            f"Broadcast #{broadcast_id} to chat_id={chat_id} failed"
+                        )
+                        status, attempts, error = (
+                            DeliveryStatus.FAILED,
+                            1,
+                            type(e).__name__,
+                        )
+                    results.append((chat_id, status, attempts, error))
+                    if status is DeliveryStatus.SENT:
+                        report.sent += 1
+                    else:
+                        report.failed += 1
+                        report.errors[error] = report.errors.get(error, 0) + 1
+                    try:
+                        await flush()
+                    except Exception:
+                        # results are kept for the next checkpoint
+                        logger.exception(f"Checkpoint of broadcast #{broadcast_id}")
+                finally:
+                    queue.task_done()
+
+        # a failed worker or producer stops the others, the producer is
+        # not left blocked on the full queue
+        tasks = [asyncio.create_task(produce(), name=f"Fanout:{broadcast_id}:pages")]
+        tasks += [
+            asyncio.create_task(work(), name=f"Fanout:{broadcast_id}:{i}")
+            for i in range(self.concurrency)
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception():
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # results of finished sends are stored even if the run is interrupted
+            await asyncio.shield(flush(force=True))
+
+        status = (
+            BroadcastStatus.CANCELLED if cancelled.is_set() else BroadcastStatus.DONE
+        )
+        await self.call_db(Broadcast.set_status, broadcast_id, status)
+
+        report.status = status.value
+        report.seconds = round(time.perf_counter() - started, 3)
+        logger.info(f"Broadcast #{broadcast_id} finished: {report}")
+        return report
+
+    async def _deliver(
+        self, chat_id: int, text: str, report: BroadcastReport
+    ) -> Tuple[DeliveryStatus, int, Optional[str]]:
+        """Sends the message, returns status, number of attempts and error"""
+        attempts = 0
+        while True:
+            await self.limiter.wait()
+            attempts += 1
+            try:
+                await self.send(chat_id, text)
+                return DeliveryStatus.SENT, attempts, None
+            except RetryAfter as e:
+                # flood control is not a failure of the recipient
+                report.rate_limited += 1
+                attempts -= 1
+                pause = _seconds(e.retry_after)
+                self.limiter.pause(pause)
+                logger.warning(f"Broadcast is rate limited for {pause}s")
+            except (Forbidden, BadRequest, ChatMigrated) as e:
+                # the user blocked the bot, the chat does not exist, etc.
+                return DeliveryStatus.FAILED, attempts, e.message
+            except NetworkError as e:
+                if attempts >= self.max_attempts:
+                    return DeliveryStatus.FAILED, attempts, e.message
+                report.retries += 1
+                await asyncio.sleep(0.5 * 2**attempts)
+            except TelegramError as e:
+                return DeliveryStatus.FAILED, attempts, e.message
+
+
+class BroadcastControl:
+    """Runs broadcasts in the background of the bot event loop.
+
+    `deliver(report)` is called when a broadcast finishes. With `bot_id`
+    only broadcasts of the bot are resumed.
+    """
+
+    def __init__(
+        self,
+        fanout: Fanout,
+        deliver: Callable[[BroadcastReport], Awaitable],
+        bot_id: Optional[int] = None,
+    ):
+        self.fanout = fanout
+        self.deliver = deliver
+        self.bot_id = bot_id
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled: Dict[int, asyncio.Event] = {}
+
+    def start(self, broadcast_id: int) -> asyncio.Task:
+        cancelled = asyncio.Event()
+        task = asyncio.create_task(
+            self._run(broadcast_id, cancelled), name=f"Broadcast:{broadcast_id}"
+        )
+        self.tasks[broadcast_id] = task
+        self._cancelled[broadcast_id] = cancelled
+        return task
+
+    async def _run(self, broadcast_id: int, cancelled: asyncio.Event) -> None:
+        try:
+            report = await self.fanout.run(broadcast_id, cancelled)
+            await self.deliver(report)
+        except asyncio.CancelledError:
+            # the bot stops, the broadcast is resumed on the next start
+            logger.info(f"Broadcast #{broadcast_id} is interrupted")
+            raise
+        except Exception:
+            logger.exception(f"Broadcast #{broadcast_id} failed")
+        finally:
+            self.tasks.pop(broadcast_id, None)
+            self._cancelled.pop(broadcast_id, None)
+
+    async def resume(self) -> List[int]:
+        """Starts broadcasts that were not finished before the restart"""
+        broadcasts = await self.fanout.call_db(
+            functools.partial(Broadcast.unfinished, bot_id=self.bot_id)
+        )
+        for broadcast in broadcasts:
+            logger.info(f"Resume broadcast #{broadcast.id}")
+            self.start(broadcast.id)
+        return [broadcast.id for broadcast in broadcasts]
+
+    def cancel(self, broadcast_id: Optional[int] = None) -> List[int]:
+        """Cancels the broadcast or all active broadcasts"""
+        ids = [broadcast_id] if broadcast_id is not None else list(self._cancelled)
+        cancelled = []
+        for id in ids:
+            if id in self._cancelled:
+                self._cancelled[id].set()
+                cancelled.append(id)
+        return cancelled
+
+    async def stop(self) -> None:
+        """Interrupts active broadcasts, their progress is kept"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,62 @@
+"""Schema migrations of the `broadcast` tables, see `token_auth_db.migrations`"""
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    text,
+)
+
+import bots
+import storage
+
+
+@storage.migration(5)
+def broadcast_tables(engine) -> None:
+    """Adds `broadcast` and `broadcast_recipient`"""
+    # tables as they are in the version 5, later migrations change them further
+    metadata = MetaData()
+    Table(
+        "broadcast",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("text", Text, nullable=False),
+        Column("audience", String, nullable=False),
+        Column("status", String, nullable=False),
+        Column("total", Integer, nullable=False),
+        Column("sent", Integer, nullable=False),
+        Column("failed", Integer, nullable=False),
+        Column("created_at", DateTime(timezone=True)),
+        Column("finished_at", DateTime(timezone=True)),
+    )
+    Table(
+        "broadcast_recipient",
+        metadata,
+        Column("broadcast_id", Integer, ForeignKey("broadcast.id"), primary_key=True),
+        Column("chat_id", BigInteger, primary_key=True),
+        Column("status", String, nullable=False),
+        Column("attempts", Integer, nullable=False),
+        Column("error", String),
+        Column("updated_at", DateTime(timezone=True)),
+        Index("ix_broadcast_recipient_status", "broadcast_id", "status", "chat_id"),
+    )
+    metadata.create_all(engine)
+
+
+@storage.migration(9)
+def broadcast_bot_id(engine) -> None:
+    """Adds `broadcast.bot_id`, broadcasts created before belong to the bot of
+    `TELEGRAM_BOT_TOKEN`"""
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE broadcast ADD COLUMN bot_id BIGINT"))
+        conn.execute(
+            text("UPDATE broadcast SET bot_id = :bot_id"),
+            {"bot_id": bots.from_envs().bot_id},
+        )
@@ -0,0 +1,196 @@
+import enum
+import logging
+from typing import Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    insert,
+    select,
+    update,
+)
+
+from storage import Base
+from token_auth_db.models import utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastStatus(enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+
+
+class DeliveryStatus(enum.Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+class Broadcast(Base):
+    """Defines the `Broadcast` table.
+
+    A message of the teacher to many users, delivery progress of every
+    recipient is kept in the `BroadcastRecipient` table, so a broadcast
+    interrupted by a restart continues with recipients not reached yet.
+    """
+
+    __tablename__ = "broadcast"
+
+    id = Column(Integer, primary_key=True)
+
+    text = Column(Text, nullable=False)
+
+    # `all` (registered users) or `group:<name>`
+    audience = Column(String, nullable=False)
+
+    status = Column(String, nullable=False, default=BroadcastStatus.PENDING.value)
+
+    # counters are updated by checkpoints
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    finished_at = Column(DateTime(timezone=True))
+
+    # the bot that sends it, see `bots.BotConfig.bot_id`
+    bot_id = Column(BigInteger)
+
+    @staticmethod
+    def create(
+        text: str,
+        audience: str,
+        chat_ids: Iterable[int],
+        session,
+        batch_size=1000,
+        bot_id: Optional[int] = None,
+    ) -> "Broadcast":
+        chat_ids = list(dict.fromkeys(chat_ids))
+        logger.info(f"Create a broadcast to '{audience}', {len(chat_ids)} recipients")
+
+        broadcast = Broadcast(
+            text=text, audience=audience, total=len(chat_ids), bot_id=bot_id
+        )
+        session.add(broadcast)
+        session.flush()
+
+        for start in range(0, len(chat_ids), batch_size):
+            session.execute(
+                insert(BroadcastRecipient),
+                [
+                    {"broadcast_id": broadcast.id, "chat_id": chat_id}
+                    for chat_id in chat_ids[start : start + batch_size]
+                ],
+            )
+        session.commit()
+        return broadcast
+
+    @staticmethod
+    def find_by_id(broadcast_id: int, session) -> Union["Broadcast", None]:
+        return session.get(Broadcast, broadcast_id)
+
+    @staticmethod
+    def unfinished(session, bot_id: Optional[int] = None) -> List["Broadcast"]:
+        """Broadcasts that were not finished, eg because of a restart"""
+        statuses = (BroadcastStatus.PENDING.value, BroadcastStatus.RUNNING.value)
+        query = session.query(Broadcast).filter(Broadcast.status.in_(statuses))
+        if bot_id is not None:
+            query = query.filter(Broadcast.bot_id == bot_id)
+        return query.order_by(Broadcast.id).all()
+
+    @staticmethod
+    def pending_recipients(
+        broadcast_id: int, after: Optional[int], limit: int, session
+    ) -> List[int]:
+        """Chat ids not reached yet, ordered and paged by the chat id"""
+        query = (
+            select(BroadcastRecipient.chat_id)
+            .where(
+                BroadcastRecipient.broadcast_id == broadcast_id,
+                BroadcastRecipient.status == DeliveryStatus.PENDING.value,
+            )
+            .order_by(BroadcastRecipient.chat_id)
+            .limit(limit)
+        )
+        if after is not None:
+            query = query.where(BroadcastRecipient.chat_id > after)
+        return list(session.execute(query).scalars())
+
+    @staticmethod
+    def checkpoint(
+        broadcast_id: int,
+        results: List[Tuple[int, DeliveryStatus, int, Optional[str]]],
+        session,
+    ) -> None:
+        """Stores delivery results `(chat_id, status, attempts, error)` in bulk"""
+        if not results:
+            return
+
+        now = utcnow()
+        session.execute(
+            update(BroadcastRecipient),
+            [
+                {
+                    "broadcast_id": broadcast_id,
+                    "chat_id": chat_id,
+                    "status": status.value,
+                    "attempts": attempts,
+                    "error": error,
+                    "updated_at": now,
+                }
+                for chat_id, status, attempts, error in results
+            ],
+        )
+        sent = sum(1 for _, status, _, _ in results if status is DeliveryStatus.SENT)
+        session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id)
+            .values(
+                sent=Broadcast.sent + sent,
+                failed=Broadcast.failed + len(results) - sent,
+            )
+        )
+        session.commit()
+
+    @staticmethod
+    def set_status(broadcast_id: int, status: BroadcastStatus, session) -> None:
+        values = {"status": status.value}
+        if status in (BroadcastStatus.DONE, BroadcastStatus.CANCELLED):
+            values["finished_at"] = utcnow()
+        session.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id).values(**values)
+        )
+        session.commit()
+
+
+class BroadcastRecipient(Base):
+    """Defines the `BroadcastRecipient` table, delivery state of a recipient"""
+
+    __tablename__ = "broadcast_recipient"
+
+    broadcast_id = Column(Integer, ForeignKey("broadcast.id"), primary_key=True)
+
+    # telegram chat id, it is the user id for private chats
+    chat_id = Column(BigInteger, primary_key=True)
+
+    status = Column(String, nullable=False, default=DeliveryStatus.PENDING.value)
+
+    attempts = Column(Integer, nullable=False, default=0)
+
+    # description of the last error for failed deliveries
+    error = Column(String)
+
+    updated_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_broadcast_recipient_status", "broadcast_id", "status", "chat_id"),
+    )
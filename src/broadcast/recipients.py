@@ -0,0 +1,67 @@
+"""Resolves recipients of a broadcast to telegram chat ids"""
+
+import asyncio
+import logging
+from typing import List
+
+from sqlalchemy import select
+
+import envs
+import storage
+import upstreams
+from token_auth_db.models import AuthUser
+
+logger = logging.getLogger(__name__)
+
+ALL = "all"
+GROUP_PREFIX = "group:"
+
+
+def registered_users() -> List[int]:
+    """Ids of all users that bound a token (read on a replica)"""
+    return storage.run_read(
+        lambda session: list(
+            session.execute(select(AuthUser.id).order_by(AuthUser.id)).scalars()
+        )
+    )
+
+
+def _telegram_ids(data) -> List[int]:
+    """Telegram ids from the result of the group tool.
+
+    It can be a list of ids or of users (`{"telegram_id": ...}`),
+    possibly wrapped into `{"users": [...]}` / `{"members": [...]}`.
+    """
+    if isinstance(data, dict):
+        data = data.get("users", data.get("members", []))
+
+    ids = []
+    for item in data or []:
+        if isinstance(item, dict):
+            item = item.get("telegram_id")
+        if item is not None:
+            ids.append(int(item))
+    return ids
+
+
+async def group_members(group: str) -> List[int]:
+    """Telegram ids of the group members from the users-groups MCP server"""
+    client = upstreams.users_groups_client()
+    async with client:
+        result = await client.call_tool(
+            envs.BROADCAST_GROUP_TOOL, {"group_name": group}
+        )
+    ids = _telegram_ids(
+        result.data if result.data is not None else result.structured_content
+    )
+    logger.info(f"Group '{group}' has {len(ids)} members")
+    return ids
+
+
+async def resolve(audience: str) -> List[int]:
+    """Chat ids of `all` (registered users) or `group:<name>`"""
+    if audience == ALL:
+        return await asyncio.to_thread(registered_users)
+    if audience.startswith(GROUP_PREFIX):
+        return await group_members(audience[len(GROUP_PREFIX) :])
+    raise ValueError(f"Unknown audience '{audience}'")
@@ -1,6 +1,10 @@
 import json
 import os
-from typing import Dict, Any
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 
 def load_constants() -> Dict[str, Any]:
@@ -15,11 +19,65 @@ CONSTANTS = load_constants()
 
 # Extract commonly used constants
 STATES = CONSTANTS["states"]
-LANGUAGES = CONSTANTS["languages"]
-MESSAGES = CONSTANTS["messages"]
-LANGUAGE_BUTTONS = CONSTANTS["language_buttons"]
 
 # State constants for easier access
 CHOOSING_LANGUAGE = STATES["CHOOSING_LANGUAGE"]
 ENTERING_NAME = STATES["ENTERING_NAME"]
 ENTERING_SURNAME = STATES["ENTERING_SURNAME"]
+
+DEFAULT_LANGUAGE = "en"
+
+
+@dataclass(frozen=True)
+class Locale:
+    """Messages of a language, compiled once on import.
+
+    Messages missing in the language fall back to the default language,
+    then to the messages shared by all languages (`messages` of the JSON).
+    """
+
+    code: str
+    texts: Mapping[str, str]
+
+    def __getitem__(self, key: str) -> str:
+        return self.texts[key]
+
+
+def compile_locales(constants: Dict[str, Any]) -> Mapping[str, Locale]:
+    languages = constants["languages"]
+    shared = {**constants["messages"], **languages[DEFAULT_LANGUAGE]}
+    return MappingProxyType(
+        {
+            code: Locale(code, MappingProxyType({**shared, **texts}))
+            for code, texts in languages.items()
+        }
+    )
+
+
+def language_keyboard(constants: Dict[str, Any]) -> InlineKeyboardMarkup:
+    """Keyboard for language selection, `lang_<code>` callback data"""
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(title, callback_data=f"lang_{code}")
+                for code, title in constants["language_buttons"].items()
+            ]
+        ]
+    )
+
+
+LOCALES = compile_locales(CONSTANTS)
+DEFAULT_LOCALE = LOCALES[DEFAULT_LANGUAGE]
+# telegram markups are immutable, the one keyboard is sent on every /start
+LANGUAGE_KEYBOARD = language_keyboard(CONSTANTS)
+
+
+def locale(code: Optional[str]) -> Locale:
+    """Locale of the language code, eg `ru` or `es-MX` of a telegram client.
+
+    Unknown languages get the default locale.
+    """
+    found = LOCALES.get(code)
+    if found is None and isinstance(code, str):
+        found = LOCALES.get(code.split("-")[0].lower())
+    return found or DEFAULT_LOCALE
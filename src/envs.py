@@ -8,6 +8,10 @@ TEACHER_TELEGRAM_ID = int(os.environ.get("TEACHER_TELEGRAM_ID", "0"))
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 
+# Bot API server, eg local Bot API server or a fake one for load tests
+# the token is appended to it, default is `https://api.telegram.org/bot`
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL")
+
 # tests set 1 by default in conftest.py
 # it add more output, for example SQL queries to db
 DEBUG_MODE = bool(int(os.environ.get("DEBUG_MODE", "0")))
@@ -17,6 +21,10 @@ STORAGE_DB = os.environ.get("STORAGE_DB", "sqlite-memory")
 # endpoint where the agentic-worker lives
 AGENT_ENDPOINT = os.environ.get("AGENT_ENDPOINT")
 
+# JSON file with bots served by the process, see `bots.py`,
+# the single bot configured by the envs above is used without it
+BOTS_CONFIG = os.environ.get("BOTS_CONFIG")
+
 ############
 # postgres #
 ############
@@ -25,6 +33,17 @@ PG_PASSWORD = os.environ.get("PG_PASSWORD")
 PG_HOST = os.environ.get("PG_HOST")
 PG_PORT = os.environ.get("PG_PORT")
 
+# read replicas used for read-only queries, comma separated `host[:port]`,
+# credentials and database are the same as on the primary
+PG_READ_REPLICAS = [
+    replica.strip()
+    for replica in os.environ.get("PG_READ_REPLICAS", "").split(",")
+    if replica.strip()
+]
+
+# a replica that failed is not used for this number of seconds
+PG_REPLICA_COOLDOWN = float(os.environ.get("PG_REPLICA_COOLDOWN", "30"))
+
 # how to get events: 'polling' or 'webhook'
 COMMUNICATION_MODE = os.environ.get("COMMUNICATION_MODE", "polling")
 
@@ -50,3 +69,126 @@ SSL_KEY_PATH = os.environ.get("SSL_KEY_PATH")
 # path to the cert.pem
 # can be optional if set on a proxy
 SSL_CERT_PATH = os.environ.get("SSL_CERT_PATH")
+
+#################
+# loop monitor  #
+#################
+
+# enables the event loop lag monitor and stall detector
+LOOP_MONITOR_ENABLED = bool(int(os.environ.get("LOOP_MONITOR_ENABLED", "1")))
+
+# how often (seconds) the loop lag is measured
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", "0.1"))
+
+# the loop blocked longer (seconds) is reported with a stack dump
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", "0.5"))
+
+# how often (seconds) lag percentiles are written to the log
+LOOP_LAG_REPORT_INTERVAL = float(os.environ.get("LOOP_LAG_REPORT_INTERVAL", "60"))
+
+#############
+# profiling #
+#############
+
+# default and max duration (seconds) of a profiling session
+PROFILE_DEFAULT_SECONDS = float(os.environ.get("PROFILE_DEFAULT_SECONDS", "30"))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "300"))
+
+# how many functions are in the profiling summary
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "20"))
+
+# signal that toggles profiling, empty value disables it
+PROFILE_SIGNAL = os.environ.get("PROFILE_SIGNAL", "SIGUSR1")
+
+###############
+# token purge #
+###############
+
+# how often (seconds) expired tokens are purged, 0 disables the purge
+TOKEN_PURGE_INTERVAL = float(os.environ.get("TOKEN_PURGE_INTERVAL", "3600"))
+
+# rows deleted in one transaction
+TOKEN_PURGE_BATCH_SIZE = int(os.environ.get("TOKEN_PURGE_BATCH_SIZE", "1000"))
+
+#############
+# broadcast #
+#############
+
+# number of messages sent at the same time
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+
+# messages per second, telegram allows about 30 to different chats
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+
+# attempts to deliver a message on network errors
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get("BROADCAST_MAX_ATTEMPTS", "3"))
+
+# tool of the users-groups MCP server that returns members of a group
+BROADCAST_GROUP_TOOL = os.environ.get("BROADCAST_GROUP_TOOL", "get_group_users")
+
+################
+# usage ledger #
+################
+
+# records usage of the agent (messages, latency, sizes, errors) per user
+USAGE_LEDGER_ENABLED = bool(int(os.environ.get("USAGE_LEDGER_ENABLED", "1")))
+
+# records are written in bulk when so many are collected or every interval seconds
+USAGE_FLUSH_SIZE = int(os.environ.get("USAGE_FLUSH_SIZE", "500"))
+USAGE_FLUSH_INTERVAL = float(os.environ.get("USAGE_FLUSH_INTERVAL", "5"))
+
+# records kept in memory while the database falls behind
+USAGE_MAX_PENDING = int(os.environ.get("USAGE_MAX_PENDING", "10000"))
+
+#############
+# languages #
+#############
+
+# languages of so many recently active users are cached per bot
+LANGUAGE_CACHE_SIZE = int(os.environ.get("LANGUAGE_CACHE_SIZE", "10000"))
+
+###########
+# logging #
+###########
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# 'json' lines or 'text' for reading in a terminal
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+
+# share of records below WARNING that are written, per logger and its children,
+# comma separated `logger=rate`, eg `httpx=0.1,telegram.ext=0.5`
+LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "httpx=0.1")
+
+# records logged from one line of code per period (seconds), 0 disables the limit
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", "50"))
+LOG_RATE_PERIOD = float(os.environ.get("LOG_RATE_PERIOD", "10"))
+
+# how user messages and agent responses are logged: 'drop' (only the length),
+# 'truncate' to LOG_BODY_LIMIT characters or 'full'
+LOG_BODIES = os.environ.get("LOG_BODIES", "drop")
+LOG_BODY_LIMIT = int(os.environ.get("LOG_BODY_LIMIT", "100"))
+
+# longer log messages are cut
+LOG_MAX_LENGTH = int(os.environ.get("LOG_MAX_LENGTH", "4000"))
+
+####################
+# graceful restart #
+####################
+
+# seconds the stopping bot processes updates it already got,
+# updates not processed in time are processed by the next instance
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "25"))
+
+# updates are claimed in the database, so a redelivered update is processed once
+UPDATE_CLAIMS_ENABLED = bool(int(os.environ.get("UPDATE_CLAIMS_ENABLED", "1")))
+
+# processed updates are remembered for so many seconds
+UPDATE_CLAIM_RETENTION = float(os.environ.get("UPDATE_CLAIM_RETENTION", "3600"))
+
+# how often (seconds) conversations and user data are written to the database
+STATE_PERSIST_INTERVAL = float(os.environ.get("STATE_PERSIST_INTERVAL", "10"))
+
+# the lease of a crashed instance expires after so many seconds,
+# a new instance waits for it before it gets updates
+INSTANCE_LEASE_TTL = float(os.environ.get("INSTANCE_LEASE_TTL", "30"))
@@ -0,0 +1,62 @@
+"""Languages users chose, read through a cache.
+
+Handlers need the language of the user for every reply, so the languages
+of recently active users are kept in an LRU cache and a message costs no
+query once its user is cached. Users without a chosen language are cached
+too. Only the instance that holds the lease of the bot (`updates.lease`)
+changes languages of the bot, so cached values do not go stale.
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from languages.models import UserLanguage
+from storage import SessionLocal
+
+_UNKNOWN = object()
+
+
+class UserLanguages:
+    def __init__(
+        self, bot_id: int = 0, size: int = 10000, session_factory=SessionLocal
+    ):
+        self.bot_id = bot_id
+        self.size = size
+        self.session_factory = session_factory
+        # user id -> language, `None` for users without a chosen language
+        self._cache: OrderedDict[int, Optional[str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self, method: Callable, *args):
+        with self.session_factory() as session:
+            return method(*args, session)
+
+    def _remember(self, user_id: int, language: Optional[str]) -> None:
+        self._cache[user_id] = language
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+
+    async def get(self, user_id: int) -> Optional[str]:
+        language = self._cache.get(user_id, _UNKNOWN)
+        if language is not _UNKNOWN:
+            self.hits += 1
+            self._cache.move_to_end(user_id)
+            return language
+
+        self.misses += 1
+        language = await asyncio.to_thread(
+            self._db, UserLanguage.get, self.bot_id, user_id
+        )
+        # the language could be set while the query ran
+        if user_id not in self._cache:
+            self._remember(user_id, language)
+        return self._cache[user_id]
+
+    async def set(self, user_id: int, language: str) -> None:
+        await asyncio.to_thread(
+            self._db, UserLanguage.set, self.bot_id, user_id, language
+        )
+        self._remember(user_id, language)
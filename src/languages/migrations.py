@@ -0,0 +1,21 @@
+"""Schema migrations of the `user_language` table, see `token_auth_db.migrations`"""
+
+from sqlalchemy import BigInteger, Column, DateTime, MetaData, String, Table
+
+import storage
+
+
+@storage.migration(10)
+def user_language_table(engine) -> None:
+    """Adds `user_language`"""
+    # table as it is in the version 10, later migrations change it further
+    metadata = MetaData()
+    Table(
+        "user_language",
+        metadata,
+        Column("bot_id", BigInteger, primary_key=True, autoincrement=False),
+        Column("user_id", BigInteger, primary_key=True, autoincrement=False),
+        Column("language", String(16), nullable=False),
+        Column("updated_at", DateTime(timezone=True)),
+    )
+    metadata.create_all(engine)
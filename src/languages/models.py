@@ -0,0 +1,38 @@
+from typing import Optional
+
+from sqlalchemy import BigInteger, Column, DateTime, String, select
+
+from storage import Base
+from token_auth_db.models import utcnow
+
+
+class UserLanguage(Base):
+    """Defines the `UserLanguage` table.
+
+    The language a user chose on registration, replies and agent requests
+    of the bot use it. Users choose the language in every bot separately.
+    """
+
+    __tablename__ = "user_language"
+
+    bot_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    # telegram user id
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+
+    # code of the language, eg `ru`, see `constants.LOCALES`
+    language = Column(String(16), nullable=False)
+
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+
+    @staticmethod
+    def get(bot_id: int, user_id: int, session) -> Optional[str]:
+        return session.execute(
+            select(UserLanguage.language).where(
+                UserLanguage.bot_id == bot_id, UserLanguage.user_id == user_id
+            )
+        ).scalar()
+
+    @staticmethod
+    def set(bot_id: int, user_id: int, language: str, session) -> None:
+        session.merge(UserLanguage(bot_id=bot_id, user_id=user_id, language=language))
+        session.commit()
@@ -0,0 +1,93 @@
+"""Start of the bot: connections warm up and time-to-ready.
+
+Import this module first, the time-to-ready is counted from its import.
+"""
+
+import time
+
+STARTED_AT = time.perf_counter()
+
+import asyncio  # noqa: E402
+import importlib  # noqa: E402
+import logging  # noqa: E402
+from typing import Iterable, Optional  # noqa: E402
+
+from sqlalchemy import text  # noqa: E402
+
+import envs  # noqa: E402
+import storage  # noqa: E402
+import upstreams  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def _init_db() -> None:
+    storage.init_db(storage.engine)
+
+    # open the first pool connection
+    with storage.engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def warm_up_db() -> None:
+    await asyncio.to_thread(_init_db)
+
+
+async def warm_up_agent(endpoint: Optional[str]) -> None:
+    if not endpoint:
+        return
+
+    import httpx
+
+    try:
+        # any answer means the connection is in the pool
+        await upstreams.agent_client().get(endpoint, timeout=5.0)
+    except httpx.HTTPError as e:
+        logger.warning(f"Agent is not available on start: {e!r}")
+
+
+async def warm_up_mcp() -> None:
+    # the import is slow, run it in a thread together with other warm ups
+    await asyncio.to_thread(importlib.import_module, "fastmcp")
+
+    if not envs.USERS_GROUPS_MCP_ENDPOINT:
+        return
+
+    try:
+        async with upstreams.users_groups_client() as client:
+            await client.ping()
+    except Exception as e:
+        logger.warning(f"Users-groups MCP server is not available on start: {e!r}")
+
+
+async def _timed(name: str, coroutine, timings: dict) -> None:
+    started = time.perf_counter()
+    try:
+        await coroutine
+    finally:
+        timings[name] = round(time.perf_counter() - started, 3)
+
+
+async def warm_up(agent_endpoints: Iterable[Optional[str]] = ()) -> dict:
+    """Initializes the database and connects to the upstreams in parallel.
+
+    Only a database failure stops the start, the upstreams can be
+    unavailable for a while. Returns seconds spent on every warm up.
+    """
+    timings = {}
+    agents = [
+        _timed(f"agent:{endpoint}", warm_up_agent(endpoint), timings)
+        for endpoint in dict.fromkeys(agent_endpoints)
+        if endpoint
+    ]
+    await asyncio.gather(
+        _timed("db", warm_up_db(), timings),
+        _timed("mcp", warm_up_mcp(), timings),
+        *agents,
+    )
+    return timings
+
+
+def time_to_ready() -> float:
+    """Seconds since the start of the bot (import of this module)"""
+    return time.perf_counter() - STARTED_AT
@@ -0,0 +1,205 @@
+"""Structured logging that keeps the event loop cheap.
+
+Handlers only put records into a queue, a listener thread formats them
+as JSON lines and writes them. Cheap filters run before the queue:
+records of noisy loggers are sampled and a line logged again and again
+from the same place is rate limited. Warnings and errors are never
+sampled.
+
+Message texts and agent responses are user data, they are logged with
+`body()`, which drops them by default.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import envs
+
+# attributes every record has, the rest are fields passed with `extra`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+}
+
+
+def body(
+    text: Optional[str], mode: Optional[str] = None, limit: Optional[int] = None
+) -> str:
+    """Text of a message for the log: dropped, truncated or full (`LOG_BODIES`)"""
+    mode = mode or envs.LOG_BODIES
+    limit = envs.LOG_BODY_LIMIT if limit is None else limit
+    if text is None:
+        return "<none>"
+    if mode == "full" or (mode == "truncate" and len(text) <= limit):
+        return text
+    if mode == "truncate":
+        return f"{text[:limit]}...<{len(text)} chars>"
+    return f"<{len(text)} chars>"
+
+
+def parse_sampling(value: str) -> Dict[str, float]:
+    """Parses `logger=rate,...`, eg `httpx=0.1,telegram.ext=0.5`"""
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.strip().partition("=")
+        if name and rate:
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Passes only a share of records below WARNING of the configured loggers.
+
+    A rate is applied to the logger and its children, the most specific
+    configured name wins.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, float] = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            parts = name.split(".")
+            for i in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:i])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RateLimitFilter(logging.Filter):
+    """Passes at most `burst` records per `period` seconds from one line of code.
+
+    The first record after a limited period tells how many were suppressed.
+    """
+
+    def __init__(self, burst: int, period: float):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        # (logger, file, line) -> (period start, records in the period, suppressed)
+        self._sites: Dict[Tuple[str, str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.period:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, long messages are cut to `max_length`"""
+
+    def __init__(self, max_length: int = 4000):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            message = f"{message[: self.max_length]}...<{len(message)} chars>"
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": message,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Puts records into the queue without formatting them.
+
+    The standard handler formats the message and the traceback on the
+    calling thread, here only the message arguments are merged and the
+    rest is left to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class Listener(logging.handlers.QueueListener):
+    """Queue listener that can be stopped more than once"""
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            super().stop()
+
+
+def build_formatter() -> logging.Formatter:
+    if envs.LOG_FORMAT == "text":
+        return logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    return JsonFormatter(envs.LOG_MAX_LENGTH)
+
+
+def setup_logging(stream=None) -> Listener:
+    """Replaces handlers of the root logger with the queue handler.
+
+    Returns the started listener, it is stopped at exit and writes
+    records left in the queue.
+    """
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(build_formatter())
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(SamplingFilter(parse_sampling(envs.LOG_SAMPLING)))
+    handler.addFilter(RateLimitFilter(envs.LOG_RATE_LIMIT, envs.LOG_RATE_PERIOD))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(envs.LOG_LEVEL)
+
+    listener = Listener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: Iterable[float], q: float) -> float:
+    """Returns the `q` percentile (0..100) of values using the nearest-rank method"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def find_handler(frame) -> Tuple[Optional[str], Optional[int]]:
+    """Walks the stack of a (blocked) frame and finds the handler that runs it.
+
+    The handler is the innermost frame that has a local `update` variable
+    with an `update_id`, this is how all our handlers and PTB internals
+    name the processed update.
+    Returns handler name and update id, or `(None, None)` if nothing found.
+    """
+    while frame is not None:
+        update = frame.f_locals.get("update")
+        update_id = getattr(update, "update_id", None)
+        if update_id is not None:
+            code = frame.f_code
+            return f"{frame.f_globals.get('__name__')}.{code.co_name}", update_id
+        frame = frame.f_back
+    return None, None
+
+
+@dataclass
+class Stall:
+    """Describes one detected blocking of the event loop"""
+
+    blocked_for: float
+    handler: Optional[str]
+    update_id: Optional[int]
+    stack: str
+
+
+class LoopMonitor:
+    """Measures the event loop scheduling delay (lag) and detects stalls.
+
+    A heartbeat coroutine sleeps for `interval` seconds and measures how late
+    the loop wakes it up. A watchdog thread checks the time of the last
+    heartbeat, if the loop does not come back for longer than
+    `stall_threshold` the stack of the loop thread is dumped to the log
+    together with the handler and update id that block it.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        stall_threshold: float = 0.5,
+        report_interval: float = 60.0,
+        window: int = 4096,
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.report_interval = report_interval
+
+        self.lags: deque = deque(maxlen=window)
+        self.stalls: deque = deque(maxlen=100)
+
+        self._last_beat = time.perf_counter()
+        self._stall_reported = False
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def start(self) -> None:
+        """Starts monitoring of the currently running loop"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stopped.clear()
+
+        self._heartbeat_task = asyncio.create_task(
+            self._heartbeat(), name="LoopMonitor:heartbeat"
+        )
+        self._watchdog = threading.Thread(
+            target=self._watch, name="LoopMonitor:watchdog", daemon=True
+        )
+        self._watchdog.start()
+        logger.info(
+            f"Loop monitor started, interval={self.interval}s, stall_threshold={self.stall_threshold}s"
+        )
+
+    async def stop(self) -> None:
+        self._stopped.set()
+
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+
+        if self._watchdog:
+            self._watchdog.join(timeout=self.interval * 2)
+            self._watchdog = None
+
+        logger.info(f"Loop monitor stopped, lag: {self.snapshot()}")
+
+    async def _heartbeat(self) -> None:
+        last_report = time.perf_counter()
+
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+
+            now = time.perf_counter()
+            self.lags.append(max(0.0, now - expected))
+            self._last_beat = now
+            self._stall_reported = False
+
+            if self.report_interval and now - last_report >= self.report_interval:
+                last_report = now
+                logger.info(f"Event loop lag: {self.snapshot()}")
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            blocked_for = time.perf_counter() - self._last_beat - self.interval
+
+            # report every stall only once, heartbeat resets the flag
+            if blocked_for > self.stall_threshold and not self._stall_reported:
+                self._stall_reported = True
+                self._report_stall(blocked_for)
+
+    def _report_stall(self, blocked_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+
+        handler, update_id = find_handler(frame)
+        stack = "".join(traceback.format_stack(frame))
+
+        self.stalls.append(Stall(blocked_for, handler, update_id, stack))
+        logger.warning(
+            f"Event loop is blocked for {blocked_for:.3f}s "
+            f"by handler={handler} update_id={update_id}, stack:\n{stack}"
+        )
+
+    def snapshot(self) -> dict:
+        """Returns lag percentiles in milliseconds and number of stalls"""
+        lags = list(self.lags)
+        return {
+            "p50_ms": round(percentile(lags, 50) * 1000, 3),
+            "p95_ms": round(percentile(lags, 95) * 1000, 3),
+            "p99_ms": round(percentile(lags, 99) * 1000, 3),
+            "max_ms": round(max(lags, default=0.0) * 1000, 3),
+            "samples": len(lags),
+            "stalls": len(self.stalls),
+        }
@@ -1,17 +1,36 @@
+# the first import, it starts the time-to-ready clock
+import lifecycle
+
+import asyncio
 import logging
+import math
+import signal
+import time
 import uuid
-from typing import Dict
+from typing import List, Optional
 
+import bots
 import envs
-from storage import SessionLocal
-from token_auth_db.models import AuthToken, AuthUser
-
-import httpx
-from fastmcp import Client
-
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import log_setup
+import profiler
+import upstreams
+from broadcast import recipients
+from broadcast.fanout import BroadcastControl, BroadcastReport, Fanout
+from broadcast.models import Broadcast
+from languages.cache import UserLanguages
+from loop_monitor import LoopMonitor
+from storage import SessionLocal, engine
+from token_auth_db.models import AuthToken, BindStatus
+from token_auth_db.purge import PurgeJob
+from updates.lease import Lease
+from updates.persistence import DbPersistence
+from updates.processor import ClaimingUpdateProcessor
+from usage.ledger import UsageLedger
+
+from telegram import Update
 from telegram.ext import (
     Application,
+    ApplicationBuilder,
     CommandHandler,
     ContextTypes,
     MessageHandler,
@@ -25,33 +44,21 @@ from constants import (
     CHOOSING_LANGUAGE,
     ENTERING_NAME,
     ENTERING_SURNAME,
-    LANGUAGES,
-    MESSAGES,
-    LANGUAGE_BUTTONS,
+    LANGUAGE_KEYBOARD,
+    Locale,
+    locale,
 )
 
-# Teacher Telegram ID (imported from envs)
-from envs import TEACHER_TELEGRAM_ID
-
-# Dictionary to store user states
-user_states: Dict[int, Dict] = {}
-
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 
-def get_language_keyboard():
-    """Creates keyboard for language selection"""
-    keyboard = [
-        [
-            InlineKeyboardButton(LANGUAGE_BUTTONS["ru"], callback_data="lang_ru"),
-            InlineKeyboardButton(LANGUAGE_BUTTONS["en"], callback_data="lang_en"),
-            InlineKeyboardButton(LANGUAGE_BUTTONS["es"], callback_data="lang_es"),
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+async def user_locale(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Locale:
+    """Locale of the language the user chose, before the choice the language
+    of the telegram client"""
+    user = update.effective_user
+    languages = context.bot_data.get("languages")
+    language = await languages.get(user.id) if languages else None
+    return locale(language or user.language_code)
 
 
 async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -60,43 +67,47 @@ async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
 
     user_id = update.effective_user.id
-    language = query.data.split("_")[1]  # lang_ru -> ru
+    texts = locale(query.data.split("_")[1])  # lang_ru -> ru
 
-    # Save selected language
-    if user_id not in user_states:
-        user_states[user_id] = {}
-    user_states[user_id]["language"] = language
+    # Save selected language, registration data is kept by the persistence
+    registration = context.user_data.setdefault("registration", {})
+    registration["language"] = texts.code
+    # the language of all later replies and agent requests
+    languages = context.bot_data.get("languages")
+    if languages:
+        await languages.set(user_id, texts.code)
 
-    if user_id == TEACHER_TELEGRAM_ID:
+    if user_id == bots.config(context).teacher_id:
         # For teacher show available tools
-        await query.edit_message_text(LANGUAGES[language]["teacher_tools"])
+        await query.edit_message_text(texts["teacher_tools"])
         return ConversationHandler.END
     else:
         # For student ask for name
         await query.answer()  # Answer the callback query
-        await query.message.reply_text(LANGUAGES[language]["enter_name"])
+        await query.message.reply_text(texts["enter_name"])
         return ENTERING_NAME
 
 
 async def handle_name_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Name input handler"""
-    user_id = update.effective_user.id
     first_name = update.message.text
 
-    if user_id not in user_states:
-        await update.message.reply_text(MESSAGES["error_occurred"])
+    registration = context.user_data.get("registration")
+    if registration is None:
+        texts = await user_locale(update, context)
+        await update.message.reply_text(texts["error_occurred"])
         return ConversationHandler.END
 
+    texts = locale(registration["language"])
+
     # Validate input - only allow letters, spaces, and hyphens
     if not first_name.replace(" ", "").replace("-", "").isalpha():
-        language = user_states[user_id]["language"]
-        await update.message.reply_text(LANGUAGES[language]["invalid_name"])
+        await update.message.reply_text(texts["invalid_name"])
         return ENTERING_NAME
 
-    user_states[user_id]["first_name"] = first_name
-    language = user_states[user_id]["language"]
+    registration["first_name"] = first_name
 
-    await update.message.reply_text(LANGUAGES[language]["enter_surname"])
+    await update.message.reply_text(texts["enter_surname"])
     return ENTERING_SURNAME
 
 
@@ -107,25 +118,27 @@ async def handle_surname_input(
     user_id = update.effective_user.id
     last_name = update.message.text
 
-    if user_id not in user_states:
-        await update.message.reply_text(MESSAGES["error_occurred"])
+    registration = context.user_data.get("registration")
+    if registration is None:
+        texts = await user_locale(update, context)
+        await update.message.reply_text(texts["error_occurred"])
         return ConversationHandler.END
 
+    texts = locale(registration["language"])
+
     # Validate input - only allow letters, spaces, and hyphens
     if not last_name.replace(" ", "").replace("-", "").isalpha():
-        language = user_states[user_id]["language"]
-        await update.message.reply_text(LANGUAGES[language]["invalid_surname"])
+        await update.message.reply_text(texts["invalid_surname"])
         return ENTERING_SURNAME
 
-    user_states[user_id]["last_name"] = last_name
-    language = user_states[user_id]["language"]
+    registration["last_name"] = last_name
 
     # Get username from Telegram
     username = update.effective_user.username
 
     try:
         # Create user via FastMCP Client
-        client = Client(f"{envs.USERS_GROUPS_MCP_ENDPOINT}/mcp")
+        client = upstreams.users_groups_client()
 
         async with client:
             result = await client.call_tool(
@@ -133,26 +146,25 @@ async def handle_surname_input(
                 {
                     "telegram_id": user_id,
                     "username": username,
-                    "first_name": user_states[user_id]["first_name"],
-                    "last_name": user_states[user_id]["last_name"],
+                    "first_name": registration["first_name"],
+                    "last_name": registration["last_name"],
                 },
             )
 
             if "already exists" in result.data:
                 # User already exists
-                await update.message.reply_text(MESSAGES["user_exists"])
+                await update.message.reply_text(texts["user_exists"])
                 logger.info(f"User {user_id} already exists in database")
             else:
-                await update.message.reply_text(LANGUAGES[language]["user_created"])
+                await update.message.reply_text(texts["user_created"])
                 logger.info(f"User {user_id} created successfully via FastMCP Client")
 
     except Exception as e:
         logger.error(f"Error creating user {user_id}: {e}")
-        await update.message.reply_text(LANGUAGES[language]["error"])
+        await update.message.reply_text(texts["error"])
 
     # Clear user state
-    if user_id in user_states:
-        del user_states[user_id]
+    context.user_data.pop("registration", None)
 
     return ConversationHandler.END
 
@@ -161,17 +173,17 @@ async def block_text_during_language_selection(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> int:
     """Block text input during language selection"""
-    await update.message.reply_text(MESSAGES["block_text_selection"])
+    texts = await user_locale(update, context)
+    await update.message.reply_text(texts["block_text_selection"])
     return CHOOSING_LANGUAGE
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel registration"""
-    user_id = update.effective_user.id
-    if user_id in user_states:
-        del user_states[user_id]
+    context.user_data.pop("registration", None)
 
-    await update.message.reply_text(MESSAGES["registration_cancelled"])
+    texts = await user_locale(update, context)
+    await update.message.reply_text(texts["registration_cancelled"])
     return ConversationHandler.END
 
 
@@ -184,17 +196,28 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info(f"User {user_id} started bot")
 
     # Check if username exists (required field)
+    texts = await user_locale(update, context)
     if not username:
-        await update.message.reply_text(LANGUAGES["en"]["no_username"])
+        await update.message.reply_text(texts["no_username"])
         return
 
-    await update.message.reply_text(
-        MESSAGES["welcome"], reply_markup=get_language_keyboard()
-    )
+    await update.message.reply_text(texts["welcome"], reply_markup=LANGUAGE_KEYBOARD)
 
     return CHOOSING_LANGUAGE
 
 
+def bind_token(token: str, user_id: int, username: str) -> BindStatus:
+    # a bound token is never bound again, so repeated binds and tokens of
+    # other users are answered from a replica without a write on the primary,
+    # the rest (eg a token not replicated yet) is bound on the primary
+    owner_id = AuthToken.owner(token)
+    if owner_id is not None:
+        return BindStatus.ALREADY_BOUND if owner_id == user_id else BindStatus.FOREIGN
+
+    with SessionLocal() as db_session:
+        return AuthToken.bind(token, user_id, username, db_session)
+
+
 async def token_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """User pass an issued token to us.
     It allows to connect issued token with an user id.
@@ -207,52 +230,28 @@ async def token_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if context.args:
         passed_token = context.args[0]
 
-        with SessionLocal() as db_session:
-            token = AuthToken.find_by_id(passed_token, db_session)
-
-            if not token:
-                logger.warning(
-                    f"user='{user_id}' passed token='{passed_token}', and I can not find active token in storage"
-                )
-                await update.message.reply_text(
-                    "Passed token is not valid, please check that it is correct"
-                )
-                return
-
-            if not token.user:
-                logger.info(
-                    "token has no user: either a new user or new token not assigned to the user"
-                )
-
-                user = AuthUser.find_by_id(user_id, db_session)
-
-                if not user:
-                    logger.info("New user case")
-                    token.user = AuthUser.create(user_id, username, db_session)
-                else:
-                    if passed_token not in {t.id for t in user.tokens}:
-                        logger.info("Add token to a user tokens")
-                        user.tokens.append(token)
-                    else:
-                        logger.info("Nothing to do, token already registered")
-            else:
-                logger.info("Token already has an user, try to check")
-
-                if token.user_id == user_id:
-                    logger.info("Token belongs to the same user, everything is Ok")
-                else:
-                    logger.warning(
-                        f"Command executed by '{user_id}', however token belongs to '{token.user_id}'"
-                    )
-                    await update.message.reply_text(
-                        "Passed token is not valid, please check that it is correct"
-                    )
-                    return
+        status = await asyncio.to_thread(bind_token, passed_token, user_id, username)
+
+        if status is BindStatus.NOT_FOUND:
+            logger.warning(
+                f"user='{user_id}' passed token='{passed_token}', and I can not find active token in storage"
+            )
+        elif status is BindStatus.FOREIGN:
+            logger.warning(
+                f"Command executed by '{user_id}', however token belongs to another user"
+            )
+        elif status is BindStatus.ALREADY_BOUND:
+            logger.info("Nothing to do, token already registered")
+        else:
+            logger.info("Token is bound to the user")
+
+        if status in (BindStatus.NOT_FOUND, BindStatus.FOREIGN):
+            texts = await user_locale(update, context)
+            await update.message.reply_text(texts["token_invalid"])
     else:
         logger.warning(f"No parameters passed to the token command by user='{user_id}'")
-        await update.message.reply_text(
-            "No parameters passed to the command, however expected one"
-        )
+        texts = await user_locale(update, context)
+        await update.message.reply_text(texts["token_missing"])
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -260,52 +259,366 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
     message_text = update.message.text
 
-    logger.info(f"User {user_id} sent message: {message_text}")
+    logger.info(f"User {user_id} sent message: {log_setup.body(message_text)}")
+
+    texts = await user_locale(update, context)
 
     # Check if user is in registration process
-    if user_id in user_states:
+    if "registration" in context.user_data:
+        await update.message.reply_text(texts["complete_registration"])
+        return
+
+    started = time.perf_counter()
+    response_size = 0
+    error = None
+    try:
+        url = f"{bots.config(context).agent_endpoint}/message"
+        payload = {
+            "message": message_text,
+            "user_id": f"{user_id}",
+            "language": texts.code,
+        }
+        response = await upstreams.agent_client().post(url, json=payload)
+
+        if response.status_code == 200:
+            response_data = response.json()
+            logger.info(f"Worker response: {log_setup.body(response_data['message'])}")
+            response_size = len(response_data["message"])
+            await update.message.reply_text(response_data["message"])
+        else:
+            error = f"http_{response.status_code}"
+            logger.error(
+                f"Worker error: {response.status_code} {log_setup.body(response.text)}"
+            )
+            await update.message.reply_text(texts["agent_error"])
+            return
+    except Exception as e:
+        error = type(e).__name__
+        logger.exception(f"Error processing message: {e}")
+        await update.message.reply_text(texts["agent_error"])
+    finally:
+        ledger = context.bot_data.get("usage_ledger")
+        if ledger:
+            await ledger.record(
+                user_id,
+                time.perf_counter() - started,
+                request_size=len(message_text or ""),
+                response_size=response_size,
+                error=error,
+            )
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Teacher (admin) only command to profile the running bot.
+
+    Usage: `/profile [seconds] [sample|cprofile]` or `/profile stop`
+    """
+    user_id = update.effective_user.id
+
+    if user_id != bots.config(context).teacher_id:
+        logger.warning(f"user='{user_id}' tries to run the profile command")
+        return
+
+    control = context.bot_data["profiler"]
+    args = context.args or []
+
+    if args and args[0] == "stop":
+        if not await control.stop():
+            await update.message.reply_text("No active profiling session")
+        return
+
+    try:
+        seconds = float(args[0]) if args else envs.PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = None
+    # `nan` and `inf` are floats too
+    if seconds is None or not math.isfinite(seconds) or seconds <= 0:
         await update.message.reply_text(
-            "Please complete your registration first. Use /cancel to cancel registration."
+            "Usage: /profile [seconds] [sample|cprofile] or /profile stop, "
+            "seconds is a positive number"
         )
         return
 
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            url = f"{envs.AGENT_ENDPOINT}/message"
-            payload = {
-                "message": message_text,
-                "user_id": f"{user_id}",
-            }
-            response = await client.post(url, json=payload)
-
-            if response.status_code == 200:
-                response_data = response.json()
-                logger.info(f"Worker response: {response_data}")
-                await update.message.reply_text(response_data["message"])
-            else:
-                logger.error(f"Worker error: {response.status_code} {response.text}")
-                await update.message.reply_text(
-                    "Sorry, there was an error processing your message."
-                )
-                return
+        mode = args[1] if len(args) > 1 else profiler.SAMPLE
+        seconds = min(seconds, envs.PROFILE_MAX_SECONDS)
+        control.start(seconds, mode, deliver=deliver_profile(context.application))
+    except (ValueError, RuntimeError) as e:
+        await update.message.reply_text(f"Can not start profiling: {e}")
+        return
+
+    await update.message.reply_text(f"Profiling ({mode}) started for {seconds}s")
+
+
+def deliver_profile(application: Application):
+    """Profiling results are sent to the teacher (admin) chat of the bot"""
+    teacher_id = bots.config(application).teacher_id
+
+    async def deliver(result: profiler.ProfileResult) -> None:
+        if not teacher_id:
+            return
+
+        await application.bot.send_document(
+            chat_id=teacher_id,
+            document=result.collapsed.encode("utf-8"),
+            filename=f"profile-{result.mode}-{int(time.time())}.collapsed",
+            # telegram limits caption length
+            caption=result.summary[:1024],
+        )
+
+    return deliver
+
+
+def build_profiler_control(application: Application) -> profiler.ProfilerControl:
+    """The profiler is shared by bots of the process, sessions started by the
+    signal deliver results to the teacher of `application`"""
+    return profiler.ProfilerControl(
+        deliver_profile(application),
+        handlers=tuple(handler.__name__ for handler in PROFILED_HANDLERS),
+        top=envs.PROFILE_TOP_N,
+    )
+
+
+def create_broadcast(text: str, audience: str, chat_ids, bot_id: int) -> int:
+    with SessionLocal() as db_session:
+        return Broadcast.create(text, audience, chat_ids, db_session, bot_id=bot_id).id
+
+
+BROADCAST_USAGE = "Usage: /broadcast [group=<name>] <text> or /broadcast cancel [id]"
+
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Teacher (admin) only command to send a message to many users.
+
+    Usage: `/broadcast [group=<name>] <text>` (all registered users by default),
+    `/broadcast cancel [id]`
+    """
+    user_id = update.effective_user.id
+    config = bots.config(context)
+
+    if user_id != config.teacher_id:
+        logger.warning(f"user='{user_id}' tries to run the broadcast command")
+        return
+
+    control = context.bot_data["broadcast"]
+    args = context.args or []
+
+    if args and args[0] == "cancel":
+        if len(args) > 1 and not args[1].isdigit():
+            await update.message.reply_text(BROADCAST_USAGE)
+            return
+        broadcast_id = int(args[1]) if len(args) > 1 else None
+        cancelled = control.cancel(broadcast_id)
+        await update.message.reply_text(
+            f"Cancelled broadcasts: {cancelled}"
+            if cancelled
+            else "No active broadcasts"
+        )
+        return
+
+    # keep line breaks of the message, `context.args` splits them
+    parts = update.message.text.split(maxsplit=1)
+    text = parts[1] if len(parts) > 1 else ""
+    audience = recipients.ALL
+    if args and args[0].startswith("group="):
+        audience = recipients.GROUP_PREFIX + args[0][len("group=") :]
+        text = text[len(args[0]) :].strip()
+
+    if not text:
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+
+    try:
+        chat_ids = await recipients.resolve(audience)
     except Exception as e:
-        logger.error(f"Error processing message: {e}")
-        import traceback
+        logger.error(f"Can not resolve recipients of '{audience}': {e}")
+        await update.message.reply_text(f"Can not get recipients: {e}")
+        return
 
-        traceback.print_exc()
-        error_message = "Sorry, there was an error processing your message."
-        await update.message.reply_text(error_message)
+    if not chat_ids:
+        await update.message.reply_text("No recipients found")
+        return
 
+    broadcast_id = await asyncio.to_thread(
+        create_broadcast, text, audience, chat_ids, config.bot_id
+    )
+    control.start(broadcast_id)
+    await update.message.reply_text(
+        f"Broadcast #{broadcast_id} to {len(chat_ids)} recipients started"
+    )
+
+
+def build_broadcast_control(application: Application) -> BroadcastControl:
+    """Broadcast reports are sent to the teacher (admin) chat of the bot"""
+    config = bots.config(application)
+
+    async def send(chat_id: int, text: str) -> None:
+        await application.bot.send_message(chat_id=chat_id, text=text)
+
+    async def deliver(report: BroadcastReport) -> None:
+        if config.teacher_id:
+            await application.bot.send_message(
+                chat_id=config.teacher_id, text=report.summary()
+            )
+
+    fanout = Fanout(
+        send,
+        concurrency=envs.BROADCAST_CONCURRENCY,
+        rate=envs.BROADCAST_RATE,
+        max_attempts=envs.BROADCAST_MAX_ATTEMPTS,
+    )
+    # every bot has its own rate limit, telegram limits every bot separately
+    return BroadcastControl(fanout, deliver, bot_id=config.bot_id)
+
+
+async def start_shared(applications: List[Application]) -> dict:
+    """Starts what the bots of the process share and passes it to their
+    `bot_data`. Returns started objects for `stop_shared`."""
+    timings = await lifecycle.warm_up(
+        bots.config(application).agent_endpoint for application in applications
+    )
+    shared = {}
+
+    if envs.LOOP_MONITOR_ENABLED:
+        monitor = LoopMonitor(
+            interval=envs.LOOP_MONITOR_INTERVAL,
+            stall_threshold=envs.LOOP_STALL_THRESHOLD,
+            report_interval=envs.LOOP_LAG_REPORT_INTERVAL,
+        )
+        await monitor.start()
+        shared["loop_monitor"] = monitor
+
+    if envs.TOKEN_PURGE_INTERVAL:
+        purge = PurgeJob(
+            engine,
+            interval=envs.TOKEN_PURGE_INTERVAL,
+            batch_size=envs.TOKEN_PURGE_BATCH_SIZE,
+        )
+        await purge.start()
+        shared["token_purge"] = purge
+
+    control = build_profiler_control(applications[0])
+    shared["profiler"] = control
+    if envs.PROFILE_SIGNAL:
+        # `kill -USR1 <pid>` starts profiling, second signal stops it earlier
+        asyncio.get_running_loop().add_signal_handler(
+            signal.Signals[envs.PROFILE_SIGNAL],
+            control.toggle,
+            envs.PROFILE_DEFAULT_SECONDS,
+        )
+
+    if envs.USAGE_LEDGER_ENABLED:
+        ledger = UsageLedger(
+            flush_size=envs.USAGE_FLUSH_SIZE,
+            flush_interval=envs.USAGE_FLUSH_INTERVAL,
+            max_pending=envs.USAGE_MAX_PENDING,
+        )
+        await ledger.start()
+        shared["usage_ledger"] = ledger
+
+    for application in applications:
+        for key in ("profiler", "usage_ledger"):
+            if key in shared:
+                application.bot_data[key] = shared[key]
+
+    logger.info(f"Warm up of {len(applications)} bots: {timings}")
+    return shared
+
+
+async def stop_shared(shared: dict) -> None:
+    """Runs after all bots are stopped"""
+    monitor = shared.pop("loop_monitor", None)
+    if monitor:
+        await monitor.stop()
+
+    control = shared.pop("profiler", None)
+    if control:
+        await control.stop()
+
+    purge = shared.pop("token_purge", None)
+    if purge:
+        await purge.stop()
+
+    # the last records are written before the bot exits
+    ledger = shared.pop("usage_ledger", None)
+    if ledger:
+        await ledger.stop()
+
+    await upstreams.close()
+
+
+async def on_startup(application: Application) -> None:
+    """Runs in the bot event loop before it starts to accept updates"""
+    broadcasts = build_broadcast_control(application)
+    application.bot_data["broadcast"] = broadcasts
+    # broadcasts interrupted by the previous stop
+    await broadcasts.resume()
+
+    time_to_ready = lifecycle.time_to_ready()
+    application.bot_data["time_to_ready"] = time_to_ready
+    logger.info(
+        f"Bot '{bots.config(application).name}' is ready in {time_to_ready:.3f}s"
+    )
+
+
+async def on_stop(application: Application) -> None:
+    """Runs when the bot stops to get updates, it still can send messages"""
+    broadcasts = application.bot_data.pop("broadcast", None)
+    if broadcasts:
+        await broadcasts.stop()
+
+
+# handlers which time is aggregated in cProfile sessions
+PROFILED_HANDLERS = (
+    start,
+    language_callback,
+    handle_name_input,
+    handle_surname_input,
+    block_text_during_language_selection,
+    cancel,
+    token_command,
+    handle_message,
+    broadcast_command,
+)
 
-def run_bot():
-    """Starts the bot."""
-    # Initialize database
-    from storage import init_db, engine
 
-    init_db(engine)
-    logger.info("Database initialized successfully")
+def build_application(
+    builder: Optional[ApplicationBuilder] = None,
+    config: Optional[bots.BotConfig] = None,
+) -> Application:
+    """Builds the bot application with all handlers.
 
-    application = Application.builder().token(envs.TELEGRAM_BOT_TOKEN).build()
+    The `builder` allows to pass a preconfigured builder (eg with another
+    request object for benchmarks), by default the token of `config` is used.
+    The bot configured by envs is built without `config`.
+    """
+    config = config or bots.from_envs()
+    if builder is None:
+        builder = Application.builder().token(config.token)
+        if envs.TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(envs.TELEGRAM_API_BASE_URL)
+
+    application = (
+        builder.post_init(on_startup)
+        .post_stop(on_stop)
+        .concurrent_updates(
+            ClaimingUpdateProcessor(
+                bot_id=config.bot_id,
+                claims=envs.UPDATE_CLAIMS_ENABLED,
+                retention=envs.UPDATE_CLAIM_RETENTION,
+            )
+        )
+        .persistence(
+            DbPersistence(
+                bot_id=config.bot_id, update_interval=envs.STATE_PERSIST_INTERVAL
+            )
+        )
+        .build()
+    )
+    application.bot_data["config"] = config
+    application.bot_data["languages"] = UserLanguages(
+        bot_id=config.bot_id, size=envs.LANGUAGE_CACHE_SIZE
+    )
 
     # Create ConversationHandler for registration
     conv_handler = ConversationHandler(
@@ -327,20 +640,28 @@ def run_bot():
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        # unfinished registrations survive a restart
+        name="registration",
+        persistent=True,
     )
 
     # Add handlers
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("token", token_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
     application.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
     )
     # application.add_handler(CommandHandler("add_token", add_token_command))
 
-    # Run the bot
+    return application
+
+
+async def start_updater(application: Application) -> None:
     if envs.COMMUNICATION_MODE == "polling":
         logger.info("Using polling mechanism to get new events")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
     elif envs.COMMUNICATION_MODE == "webhook":
         logger.info("Using webhook mechanism to get new events")
 
@@ -350,11 +671,12 @@ def run_bot():
         if envs.SSL_CERT_PATH:
             ext_params["cert"] = envs.SSL_CERT_PATH
 
-        application.run_webhook(
+        config = bots.config(application)
+        await application.updater.start_webhook(
             listen=envs.WEBHOOK_LISTEN,
             secret_token=uuid.uuid4().hex,
-            port=envs.WEBHOOK_PORT,
-            webhook_url=envs.WEBHOOK_URL,
+            port=config.webhook_port,
+            webhook_url=config.webhook_url,
             **ext_params,
         )
     else:
@@ -363,5 +685,109 @@ def run_bot():
         )
 
 
+async def drain(application: Application, timeout: float) -> None:
+    """Stops the bot without losing updates.
+
+    The updater stops first, so no new updates come and the polling
+    offset is committed. Updates already received are processed until
+    the deadline, the rest are kept in the database for the next instance.
+    Stopping the application flushes conversations and user data.
+    """
+    await application.updater.stop()
+
+    stopping = asyncio.create_task(application.stop())
+    done, _ = await asyncio.wait({stopping}, timeout=timeout)
+    if not done:
+        interrupted = application.update_processor.interrupt()
+        logger.warning(
+            f"Updates are not processed in {timeout}s, interrupt updates {interrupted}"
+        )
+    await stopping
+
+    if application.post_stop:
+        await application.post_stop(application)
+
+
+async def serve_bot(application: Application, stop: asyncio.Event) -> None:
+    """Runs the bot until `stop` is set.
+
+    The bot waits for the previous instance to release the lease before it
+    loads the persisted state and starts to get updates, so two instances
+    never process updates at the same time during a rolling restart.
+    """
+    config = bots.config(application)
+    lease = Lease(config.lease_name, ttl=envs.INSTANCE_LEASE_TTL)
+    acquire = asyncio.create_task(lease.acquire())
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait({acquire, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    if not acquire.done():
+        acquire.cancel()
+        logger.info(f"Bot '{config.name}' is stopped before it got the lease")
+        return
+
+    try:
+        # raises if the lease could not be taken
+        acquire.result()
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.update_processor.replay(application)
+
+        await start_updater(application)
+        await application.start()
+
+        await stopped
+        logger.info(
+            f"Stop the bot '{config.name}', "
+            f"drain updates for up to {envs.DRAIN_TIMEOUT}s"
+        )
+        await drain(application, envs.DRAIN_TIMEOUT)
+    finally:
+        stopped.cancel()
+        await application.shutdown()
+        await lease.release()
+        logger.info(
+            f"Bot '{config.name}' is stopped: {application.update_processor.stats}"
+        )
+
+
+async def serve(applications: List[Application]) -> None:
+    """Runs the bots until SIGINT or SIGTERM.
+
+    Bots share the database, the agent client and background jobs, a bot
+    that fails does not stop the others.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def run(application: Application) -> bool:
+        try:
+            await serve_bot(application, stop)
+            return True
+        except Exception:
+            logger.exception(f"Bot '{bots.config(application).name}' failed")
+            return False
+
+    shared = await start_shared(applications)
+    try:
+        results = await asyncio.gather(
+            *(run(application) for application in applications)
+        )
+    finally:
+        await stop_shared(shared)
+
+    if not any(results):
+        raise RuntimeError("All bots failed")
+
+
+def run_bot():
+    """Starts the bots."""
+    log_setup.setup_logging()
+    applications = [build_application(config=config) for config in bots.configured()]
+    asyncio.run(serve(applications))
+
+
 if __name__ == "__main__":
     run_bot()
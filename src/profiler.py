@@ -0,0 +1,251 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from loop_monitor import find_handler
+
+logger = logging.getLogger(__name__)
+
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+
+
+@dataclass
+class ProfileResult:
+    """Result of a finished profiling session"""
+
+    mode: str
+    duration: float
+    # flamegraph-compatible collapsed stacks ("frame;frame;frame count" per line)
+    collapsed: str = ""
+    # human readable top-N summary
+    summary: str = ""
+    # handler name -> samples (sampling) or cumulative seconds (cProfile)
+    per_handler: dict = field(default_factory=dict)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__')}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """Samples the stack of the event loop thread from a separate thread.
+
+    Stacks are grouped by the handler found on the stack, so the collapsed
+    output has the handler name as a root frame.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.per_handler: Counter = Counter()
+        self.samples = 0
+
+        self._thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="SamplingProfiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            handler, _ = find_handler(frame)
+            handler = handler or "<idle>"
+
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            names.append(handler)
+
+            self.stacks[";".join(reversed(names))] += 1
+            self.per_handler[handler] += 1
+            self.samples += 1
+
+    def result(self, duration: float, top: int) -> ProfileResult:
+        collapsed = "\n".join(
+            f"{stack} {count}" for stack, count in self.stacks.items()
+        )
+
+        lines = [f"Sampling profile: {self.samples} samples in {duration:.1f}s"]
+        for handler, count in self.per_handler.most_common(top):
+            lines.append(f"{count / max(self.samples, 1):7.1%}  {handler}")
+
+        return ProfileResult(
+            mode=SAMPLE,
+            duration=duration,
+            collapsed=collapsed,
+            summary="\n".join(lines),
+            per_handler=dict(self.per_handler),
+        )
+
+
+class CProfiler:
+    """Deterministic profiler (`cProfile`) of the event loop thread.
+
+    It has to be started from the loop thread, because `cProfile`
+    profiles only the thread where it is enabled.
+    """
+
+    def __init__(self, handlers: tuple = ()):
+        self.handlers = set(handlers)
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+
+    def result(self, duration: float, top: int) -> ProfileResult:
+        stats = pstats.Stats(self.profile)
+
+        per_handler = {}
+        collapsed = []
+        for (filename, lineno, name), row in stats.stats.items():
+            ct, callers = row[3], row[4]
+            func = f"{filename}:{name}:{lineno}"
+            if name in self.handlers:
+                per_handler[name] = per_handler.get(name, 0.0) + ct
+            # one level of callers is all cProfile knows,
+            # values are in microseconds of own time
+            for caller in callers:
+                caller_func = f"{caller[0]}:{caller[2]}:{caller[1]}"
+                collapsed.append(
+                    f"{caller_func};{func} {int(callers[caller][2] * 1_000_000)}"
+                )
+
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+        lines = [f"cProfile: {duration:.1f}s"]
+        for name, ct in sorted(per_handler.items(), key=lambda item: -item[1]):
+            lines.append(f"{ct:8.3f}s  {name}")
+        lines.append(out.getvalue())
+
+        return ProfileResult(
+            mode=CPROFILE,
+            duration=duration,
+            collapsed="\n".join(collapsed),
+            summary="\n".join(lines),
+            per_handler=per_handler,
+        )
+
+
+class ProfilerControl:
+    """Starts and stops on-demand profiling sessions of the running bot.
+
+    Only one session can be active. The session stops itself after the
+    requested number of seconds and passes the result to `deliver`.
+    When no session is active nothing is installed, so there is no overhead.
+    """
+
+    def __init__(
+        self,
+        deliver: Callable[[ProfileResult], Awaitable[None]],
+        handlers: tuple = (),
+        top: int = 20,
+    ):
+        self.deliver = deliver
+        self.handlers = handlers
+        self.top = top
+
+        self._profiler = None
+        # `deliver` passed to `start` for the active session
+        self._session_deliver = None
+        self._started_at = 0.0
+        self._timer: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        return self._profiler is not None
+
+    def start(
+        self,
+        seconds: float,
+        mode: str = SAMPLE,
+        deliver: Optional[Callable[[ProfileResult], Awaitable[None]]] = None,
+    ) -> None:
+        """Starts a session, must be called from the event loop thread.
+
+        The result goes to `deliver` if it is passed, eg to the bot that
+        asked for the session.
+        """
+        if self.active:
+            raise RuntimeError("Profiling session is already running")
+
+        if mode == SAMPLE:
+            self._profiler = SamplingProfiler()
+        elif mode == CPROFILE:
+            self._profiler = CProfiler(self.handlers)
+        else:
+            raise ValueError(f"Unsupported profiling mode '{mode}'")
+
+        logger.info(f"Start '{mode}' profiling for {seconds}s")
+        self._session_deliver = deliver
+        self._started_at = time.perf_counter()
+        self._profiler.start()
+        self._timer = asyncio.create_task(self._stop_later(seconds))
+
+    async def _stop_later(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+        self._timer = None
+        await self.stop()
+
+    async def stop(self) -> Optional[ProfileResult]:
+        """Stops the active session and delivers its result"""
+        if not self.active:
+            return None
+
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        profiler, self._profiler = self._profiler, None
+        profiler.stop()
+        deliver = self._session_deliver or self.deliver
+        self._session_deliver = None
+
+        duration = time.perf_counter() - self._started_at
+        result = profiler.result(duration, self.top)
+        logger.info(f"Profiling finished:\n{result.summary}")
+
+        try:
+            await deliver(result)
+        except Exception as e:
+            logger.error(f"Can not deliver profiling result: {e}")
+
+        return result
+
+    def toggle(self, seconds: float, mode: str = SAMPLE) -> None:
+        """Signal handler friendly start / stop switch"""
+        if self.active:
+            asyncio.get_running_loop().create_task(self.stop())
+        else:
+            self.start(seconds, mode)
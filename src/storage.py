@@ -1,9 +1,27 @@
 import envs
+import itertools
 import logging
-from typing import Callable, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy import (
+    Column,
+    Integer,
+    Table,
+    create_engine,
+    delete,
+    event,
+    func,
+    inspect,
+    insert,
+    select,
+    text,
+)
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
+from sqlalchemy.pool import StaticPool
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +30,33 @@ class Base(DeclarativeBase):
     pass
 
 
+# Version of the database schema, increase it with every new migration
+SCHEMA_VERSION = 10
+
+schema_version = Table(
+    "schema_version",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+)
+
+# schema version -> function that migrates the schema from the previous version
+MIGRATIONS: Dict[int, Callable] = {}
+
+
+def migration(version: int) -> Callable:
+    """Registers a function that migrates the schema to `version`.
+
+    The function gets the engine and manages transactions itself,
+    so long data migrations can be done in batches.
+    """
+
+    def decorator(migrate: Callable) -> Callable:
+        MIGRATIONS[version] = migrate
+        return migrate
+
+    return decorator
+
+
 def build_database_url() -> str:
     if envs.STORAGE_DB.startswith("sqlite"):
         if not envs.DEBUG_MODE:
@@ -30,20 +75,120 @@ def build_database_url() -> str:
         raise ValueError("The `STORAGE_DB` env variable is not correct")
 
 
+def build_replica_urls() -> List[str]:
+    """URLs of the read replicas, replicas are supported only for postgres"""
+    if not envs.PG_READ_REPLICAS:
+        return []
+    if envs.STORAGE_DB != "postgres":
+        logger.warning("`PG_READ_REPLICAS` is ignored, the storage db is not postgres")
+        return []
+
+    urls = []
+    for replica in envs.PG_READ_REPLICAS:
+        host, _, port = replica.partition(":")
+        urls.append(
+            f"postgresql+psycopg2://{envs.PG_USER}:{envs.PG_PASSWORD}@{host}:{port or envs.PG_PORT}/telegram_bot"
+        )
+    return urls
+
+
 def get_engine_and_sessionmaker() -> Tuple[object, sessionmaker]:
     database_url = build_database_url()
     connect_args = {}
+    engine_args = {}
     if database_url.startswith("sqlite"):
         connect_args = {"check_same_thread": False}
-    engine = create_engine(database_url, echo=False, connect_args=connect_args)
+    if database_url == "sqlite:///:memory:":
+        # share one connection between threads,
+        # otherwise every thread gets its own empty database
+        engine_args["poolclass"] = StaticPool
+    engine = create_engine(
+        database_url, echo=False, connect_args=connect_args, **engine_args
+    )
     SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
     return engine, SessionLocal
 
 
+def get_schema_version(engine) -> Optional[int]:
+    """Returns version of the schema or `None` if it is not versioned yet"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_version.c.version))).scalar()
+    except (OperationalError, ProgrammingError):
+        # only a missing table means a new database, errors of an unreachable
+        # or locked database are raised, so they are not taken for an empty one
+        if inspect(engine).has_table(schema_version.name):
+            raise
+        return None
+
+
+def set_schema_version(engine, version: int) -> None:
+    with engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+        conn.execute(delete(schema_version))
+        conn.execute(insert(schema_version).values(version=version))
+
+
+@contextmanager
+def _migration_lock(engine):
+    """Only one process migrates a postgres database, others wait for it"""
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(hashtext('schema_version'))"))
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(hashtext('schema_version'))"))
+            conn.commit()
+
+
 def init_db(engine) -> None:
+    """Creates the schema or migrates it to `SCHEMA_VERSION`.
+
+    It is idempotent, an up to date schema costs a single query,
+    so it is safe to call on every start.
+    """
     from token_auth_db.models import AuthUser, AuthToken, AuthAction  # noqa: F401 - import to register models
+    from broadcast.models import Broadcast, BroadcastRecipient  # noqa: F401 - import to register models
+    from usage.models import UsageRecord  # noqa: F401 - import to register models
+    from updates.models import UpdateClaim, PersistedState, BotLease  # noqa: F401 - import to register models
+    from languages.models import UserLanguage  # noqa: F401 - import to register models
+    import token_auth_db.migrations  # noqa: F401 - import to register migrations
+    import broadcast.migrations  # noqa: F401 - import to register migrations
+    import usage.migrations  # noqa: F401 - import to register migrations
+    import updates.migrations  # noqa: F401 - import to register migrations
+    import languages.migrations  # noqa: F401 - import to register migrations
+
+    if get_schema_version(engine) == SCHEMA_VERSION:
+        return
 
-    Base.metadata.create_all(bind=engine)
+    with _migration_lock(engine):
+        # another process could migrate the schema while we waited for the lock
+        version = get_schema_version(engine)
+        if version == SCHEMA_VERSION:
+            return
+
+        if version is None:
+            if not inspect(engine).has_table("auth_user"):
+                logger.info(f"Create the database schema version={SCHEMA_VERSION}")
+                Base.metadata.create_all(bind=engine)
+                set_schema_version(engine, SCHEMA_VERSION)
+                return
+            # tables were created before the schema got versions
+            version = 1
+
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Database schema version={version} is newer than supported {SCHEMA_VERSION}"
+            )
+
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            logger.info(f"Migrate the database schema to version={target}")
+            MIGRATIONS[target](engine)
+            set_schema_version(engine, target)
 
 
 def get_db_session(SessionLocal: sessionmaker) -> Callable:
@@ -57,6 +202,91 @@ def get_db_session(SessionLocal: sessionmaker) -> Callable:
     return _get_db
 
 
+class ReplicaRouter:
+    """Routes read-only sessions to read replicas.
+
+    Replicas are used round-robin. A replica that fails (the `handle_error`
+    event of its engine) is skipped for `cooldown` seconds. Without healthy
+    replicas the primary is used.
+    """
+
+    def __init__(self, primary, replicas: List, cooldown: float = 30.0):
+        self.primary = primary
+        self.replicas = replicas
+        self.cooldown = cooldown
+
+        # replica engine -> time it can be used again
+        self._down_until: Dict[object, float] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+        for replica in replicas:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def _on_error(self, context) -> None:
+        if context.is_disconnect or isinstance(
+            context.sqlalchemy_exception, OperationalError
+        ):
+            self.mark_down(context.engine)
+
+    def mark_down(self, replica) -> None:
+        with self._lock:
+            if replica not in self._down_until:
+                logger.warning(
+                    f"Read replica {replica.url.host} is down for {self.cooldown}s"
+                )
+            self._down_until[replica] = time.monotonic() + self.cooldown
+
+    def is_healthy(self, replica) -> bool:
+        with self._lock:
+            down_until = self._down_until.get(replica)
+            if down_until is None:
+                return True
+            if down_until <= time.monotonic():
+                del self._down_until[replica]
+                return True
+            return False
+
+    def engines(self) -> List:
+        """Healthy replicas starting from the next one in turn, then the primary"""
+        if not self.replicas:
+            return [self.primary]
+
+        start = next(self._counter) % len(self.replicas)
+        ordered = self.replicas[start:] + self.replicas[:start]
+        return [r for r in ordered if self.is_healthy(r)] + [self.primary]
+
+
+def build_read_router(primary) -> ReplicaRouter:
+    replicas = [create_engine(url, pool_pre_ping=True) for url in build_replica_urls()]
+    return ReplicaRouter(primary, replicas, cooldown=envs.PG_REPLICA_COOLDOWN)
+
+
+def ReadSessionLocal() -> Session:
+    """Read-only session on a replica (or on the primary without replicas).
+
+    Replicas lag behind the primary, data written a moment ago
+    (read-your-writes) has to be read with `SessionLocal`.
+    """
+    return SessionLocal(bind=read_router.engines()[0])
+
+
+def run_read(query: Callable[[Session], object]):
+    """Runs `query(session)` on a replica, fails over to the next replica
+    and finally to the primary if a replica is not available."""
+    for read_engine in read_router.engines():
+        with SessionLocal(bind=read_engine) as session:
+            try:
+                return query(session)
+            except OperationalError:
+                if read_engine is read_router.primary:
+                    raise
+                read_router.mark_down(read_engine)
+                logger.warning(f"Read from {read_engine.url.host} failed, fail over")
+
+
+# creating the engine does not connect to the database,
+# the schema is created / checked by `init_db` on the bot start
 engine, SessionLocal = get_engine_and_sessionmaker()
-init_db(engine)
 get_db = get_db_session(SessionLocal)
+read_router = build_read_router(engine)
@@ -0,0 +1,213 @@
+"""Streaming export of users with their tokens and granted actions.
+
+Rows are fetched in batches with a server-side cursor (`yield_per`),
+tokens and actions of a batch are loaded by `selectinload`, so memory
+does not depend on the table sizes and there are no per-user queries.
+
+Run from the repository root:
+
+    PYTHONPATH=src python -m token_auth_db.export --format csv --output auth.csv
+    PYTHONPATH=src python -m token_auth_db.export --watermark-file export.watermark
+
+With `--watermark-file` only rows changed since the previous run are exported.
+Deleted rows (revoked or purged tokens) are not reported by incremental exports.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import IO, Iterator, Optional
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import selectinload
+
+import storage
+from token_auth_db.models import AuthToken, AuthUser, token_action, utcnow
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "csv")
+
+CSV_COLUMNS = (
+    "user_id",
+    "user_name",
+    "user_updated_at",
+    "token_id",
+    "token_expires_at",
+    "token_updated_at",
+    "action",
+)
+
+# the watermark is moved back by it, so rows committed on the primary
+# but not yet replicated when the export started are exported next time
+WATERMARK_OVERLAP = timedelta(minutes=1)
+
+
+@dataclass
+class ExportResult:
+    records: int
+    # pass it as `since` to the next incremental export
+    watermark: datetime
+
+
+def _changed_tokens(since: datetime):
+    granted = select(token_action.c.token_hash).where(token_action.c.updated_at > since)
+    return or_(AuthToken.updated_at > since, AuthToken.id.in_(granted))
+
+
+def iter_users(
+    session, since: Optional[datetime] = None, batch_size: int = 500
+) -> Iterator[AuthUser]:
+    """Users with loaded tokens and actions, ordered by id"""
+    query = (
+        select(AuthUser)
+        .options(selectinload(AuthUser.tokens).selectinload(AuthToken.actions))
+        .order_by(AuthUser.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if since:
+        query = query.where(
+            or_(
+                AuthUser.updated_at > since, AuthUser.tokens.any(_changed_tokens(since))
+            )
+        )
+    yield from session.execute(query).scalars()
+
+
+def iter_unbound_tokens(
+    session, since: Optional[datetime] = None, batch_size: int = 500
+) -> Iterator[AuthToken]:
+    """Issued tokens that are not bound to users yet"""
+    query = (
+        select(AuthToken)
+        .where(AuthToken.user_id.is_(None))
+        .options(selectinload(AuthToken.actions))
+        .order_by(AuthToken.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if since:
+        query = query.where(_changed_tokens(since))
+    yield from session.execute(query).scalars()
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _token_record(token: AuthToken) -> dict:
+    return {
+        "id": token.id,
+        "expires_at": _isoformat(token.expires_at),
+        "updated_at": _isoformat(token.updated_at),
+        "actions": sorted(action.name for action in token.actions),
+    }
+
+
+def iter_records(
+    session, since: Optional[datetime] = None, batch_size: int = 500
+) -> Iterator[dict]:
+    """A record per user, then a record per unbound token (with `id` None)"""
+    for user in iter_users(session, since, batch_size):
+        yield {
+            "id": user.id,
+            "name": user.name,
+            "updated_at": _isoformat(user.updated_at),
+            "tokens": [_token_record(token) for token in user.tokens],
+        }
+
+    for token in iter_unbound_tokens(session, since, batch_size):
+        yield {
+            "id": None,
+            "name": None,
+            "updated_at": None,
+            "tokens": [_token_record(token)],
+        }
+
+
+def write_ndjson(records: Iterator[dict], out: IO) -> int:
+    count = 0
+    for count, record in enumerate(records, start=1):
+        out.write(json.dumps(record, ensure_ascii=False))
+        out.write("\n")
+    return count
+
+
+def write_csv(records: Iterator[dict], out: IO) -> int:
+    """A row per granted action, tokens without actions and
+    users without tokens get a row with empty columns"""
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+
+    count = 0
+    for count, record in enumerate(records, start=1):
+        user = (record["id"], record["name"], record["updated_at"])
+        for token in record["tokens"] or [None]:
+            if token is None:
+                writer.writerow(user + (None,) * 4)
+                continue
+            token_columns = (token["id"], token["expires_at"], token["updated_at"])
+            for action in token["actions"] or [None]:
+                writer.writerow(user + token_columns + (action,))
+    return count
+
+
+def export(
+    out: IO,
+    format: str = "ndjson",
+    since: Optional[datetime] = None,
+    batch_size: int = 500,
+    session=None,
+) -> ExportResult:
+    """Writes users changed since `since` (all users by default) into `out`.
+
+    Without `session` the export is read from a read replica.
+    """
+    writer = {"ndjson": write_ndjson, "csv": write_csv}[format]
+    started = utcnow()
+
+    if session is not None:
+        records = writer(iter_records(session, since, batch_size), out)
+    else:
+        with storage.ReadSessionLocal() as session:
+            records = writer(iter_records(session, since, batch_size), out)
+
+    return ExportResult(records=records, watermark=started - WATERMARK_OVERLAP)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--output", help="file to write, stdout by default")
+    parser.add_argument("--since", help="export rows changed after it (ISO time)")
+    parser.add_argument(
+        "--watermark-file",
+        help="keeps the time of the last export, only changes are exported",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    since = datetime.fromisoformat(args.since) if args.since else None
+    watermark_file = Path(args.watermark_file) if args.watermark_file else None
+    if since is None and watermark_file and watermark_file.exists():
+        since = datetime.fromisoformat(watermark_file.read_text().strip())
+
+    storage.init_db(storage.engine)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            result = export(out, args.format, since, args.batch_size)
+    else:
+        result = export(sys.stdout, args.format, since, args.batch_size)
+
+    if watermark_file:
+        watermark_file.write_text(result.watermark.isoformat())
+    logger.info(
+        f"Exported {result.records} records since {since}, watermark {result.watermark.isoformat()}"
+    )
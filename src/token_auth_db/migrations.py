@@ -0,0 +1,289 @@
+"""Schema migrations of the `token_auth_db` tables.
+
+Every migration is registered with `storage.migration` and is applied
+by `storage.init_db` to databases created by an older version.
+"""
+
+import logging
+from typing import Optional
+
+from sqlalchemy import inspect, text
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# rows updated / copied in one transaction
+BATCH_SIZE = 5000
+
+
+def _pg_backfill(engine, table: str, source: str, target: str, batch_size: int) -> int:
+    """Copies `source` into the new bigint `target` column in short transactions"""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            updated = conn.execute(
+                text(
+                    f"UPDATE {table} SET {target} = CAST({source} AS BIGINT) "
+                    f"WHERE ctid IN ("
+                    f"  SELECT ctid FROM {table}"
+                    f"  WHERE {target} IS NULL AND {source} IS NOT NULL"
+                    f"  LIMIT :batch_size FOR UPDATE SKIP LOCKED)"
+                ),
+                {"batch_size": batch_size},
+            ).rowcount
+        total += updated
+        if not updated:
+            logger.info(f"{table}.{target}: {total} rows backfilled")
+            return total
+
+
+def _migrate_postgres(engine, batch_size: int) -> None:
+    """Online migration: new columns are backfilled in batches and indexed
+    concurrently, tables are locked only to swap the columns."""
+    with engine.begin() as conn:
+        conn.execute(
+            text("ALTER TABLE auth_user ADD COLUMN IF NOT EXISTS id_new BIGINT")
+        )
+        conn.execute(
+            text("ALTER TABLE auth_token ADD COLUMN IF NOT EXISTS user_id_new BIGINT")
+        )
+
+    _pg_backfill(engine, "auth_user", "id", "id_new", batch_size)
+    _pg_backfill(engine, "auth_token", "user_id", "user_id_new", batch_size)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(
+            text(
+                "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS auth_user_id_new_key "
+                "ON auth_user (id_new)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_auth_token_user_id_new "
+                "ON auth_token (user_id_new)"
+            )
+        )
+
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        pk_name = inspector.get_pk_constraint("auth_user")["name"]
+        fk_names = [
+            fk["name"]
+            for fk in inspector.get_foreign_keys("auth_token")
+            if fk["referred_table"] == "auth_user"
+        ]
+
+        conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+        conn.execute(text("LOCK TABLE auth_user, auth_token IN ACCESS EXCLUSIVE MODE"))
+
+        # rows written by old instances while the backfill was running
+        conn.execute(
+            text(
+                "UPDATE auth_user SET id_new = CAST(id AS BIGINT) WHERE id_new IS NULL"
+            )
+        )
+        conn.execute(
+            text(
+                "UPDATE auth_token SET user_id_new = CAST(user_id AS BIGINT) "
+                "WHERE user_id_new IS NULL AND user_id IS NOT NULL"
+            )
+        )
+
+        for fk_name in fk_names:
+            conn.execute(text(f'ALTER TABLE auth_token DROP CONSTRAINT "{fk_name}"'))
+        conn.execute(text(f'ALTER TABLE auth_user DROP CONSTRAINT "{pk_name}"'))
+
+        # dropping the old columns drops their indexes too
+        conn.execute(text("ALTER TABLE auth_user DROP COLUMN id"))
+        conn.execute(text("ALTER TABLE auth_user RENAME COLUMN id_new TO id"))
+        conn.execute(
+            text(
+                "ALTER TABLE auth_user ADD CONSTRAINT auth_user_pkey "
+                "PRIMARY KEY USING INDEX auth_user_id_new_key"
+            )
+        )
+
+        conn.execute(text("ALTER TABLE auth_token DROP COLUMN user_id"))
+        conn.execute(
+            text("ALTER TABLE auth_token RENAME COLUMN user_id_new TO user_id")
+        )
+        conn.execute(
+            text(
+                "ALTER INDEX ix_auth_token_user_id_new RENAME TO ix_auth_token_user_id"
+            )
+        )
+        conn.execute(
+            text(
+                "ALTER TABLE auth_token ADD CONSTRAINT auth_token_user_id_fkey "
+                "FOREIGN KEY (user_id) REFERENCES auth_user (id) NOT VALID"
+            )
+        )
+
+    # validation does not block writes
+    with engine.begin() as conn:
+        conn.execute(
+            text("ALTER TABLE auth_token VALIDATE CONSTRAINT auth_token_user_id_fkey")
+        )
+
+
+def _sqlite_copy(engine, source: str, target: str, columns: str, batch_size: int):
+    last_rowid = 0
+    while True:
+        with engine.begin() as conn:
+            batch = f"SELECT rowid FROM {source} WHERE rowid > :last ORDER BY rowid LIMIT :size"
+            params = {"last": last_rowid, "size": batch_size}
+
+            upper = conn.execute(
+                text(f"SELECT max(rowid) FROM ({batch})"), params
+            ).scalar()
+            if upper is None:
+                return
+
+            conn.execute(
+                text(
+                    f"INSERT INTO {target} SELECT {columns} FROM {source} "
+                    f"WHERE rowid > :last AND rowid <= :upper"
+                ),
+                {"last": last_rowid, "upper": upper},
+            )
+            last_rowid = upper
+
+
+def _migrate_sqlite(engine, batch_size: int) -> None:
+    """SQLite can not change column types, the tables are rebuilt"""
+    with engine.connect() as conn:
+        # CAST of a non numeric text gives 0 in sqlite, check ids first
+        wrong_ids = conn.execute(
+            text(
+                "SELECT count(*) FROM auth_user "
+                "WHERE CAST(CAST(id AS INTEGER) AS TEXT) != CAST(id AS TEXT)"
+            )
+        ).scalar()
+    if wrong_ids:
+        raise RuntimeError(f"auth_user has {wrong_ids} not numeric telegram ids")
+
+    with engine.begin() as conn:
+        # keeps `token_action` referencing `auth_token` after the rename
+        conn.exec_driver_sql("PRAGMA legacy_alter_table = ON")
+        for index in ("ix_auth_user_id", "ix_auth_token_id", "ix_auth_token_user_id"):
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index}")
+        conn.exec_driver_sql("ALTER TABLE auth_user RENAME TO auth_user_v1")
+        conn.exec_driver_sql("ALTER TABLE auth_token RENAME TO auth_token_v1")
+        conn.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
+
+        # tables as they are in the version 2,
+        # later migrations change them further
+        conn.exec_driver_sql(
+            "CREATE TABLE auth_user ("
+            "id BIGINT NOT NULL, name VARCHAR NOT NULL, PRIMARY KEY (id))"
+        )
+        conn.exec_driver_sql(
+            "CREATE TABLE auth_token ("
+            "id VARCHAR NOT NULL, user_id BIGINT, PRIMARY KEY (id), "
+            "FOREIGN KEY(user_id) REFERENCES auth_user (id))"
+        )
+        conn.exec_driver_sql(
+            "CREATE INDEX ix_auth_token_user_id ON auth_token (user_id)"
+        )
+        conn.exec_driver_sql("CREATE UNIQUE INDEX ix_auth_token_id ON auth_token (id)")
+
+    _sqlite_copy(
+        engine,
+        "auth_user_v1",
+        "auth_user (id, name)",
+        "CAST(id AS INTEGER), name",
+        batch_size,
+    )
+    _sqlite_copy(
+        engine,
+        "auth_token_v1",
+        "auth_token (id, user_id)",
+        "id, CAST(user_id AS INTEGER)",
+        batch_size,
+    )
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE auth_token_v1")
+        conn.exec_driver_sql("DROP TABLE auth_user_v1")
+
+
+@storage.migration(2)
+def telegram_ids_to_bigint(engine, batch_size: Optional[int] = None) -> None:
+    """`auth_user.id` and `auth_token.user_id` become BIGINT telegram ids.
+
+    Before they were a text primary key and an integer foreign key to it.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    if engine.dialect.name == "postgresql":
+        _migrate_postgres(engine, batch_size)
+    elif engine.dialect.name == "sqlite":
+        _migrate_sqlite(engine, batch_size)
+    else:
+        raise NotImplementedError(f"No migration for '{engine.dialect.name}'")
+
+
+@storage.migration(3)
+def token_expiry(engine) -> None:
+    """Adds the optional `auth_token.expires_at` with an index"""
+    if engine.dialect.name == "postgresql":
+        # a nullable column without default does not rewrite the table
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "ALTER TABLE auth_token "
+                    "ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE"
+                )
+            )
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(
+                text(
+                    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_auth_token_expires_at "
+                    "ON auth_token (expires_at)"
+                )
+            )
+    else:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "ALTER TABLE auth_token ADD COLUMN expires_at DATETIME"
+            )
+            conn.exec_driver_sql(
+                "CREATE INDEX ix_auth_token_expires_at ON auth_token (expires_at)"
+            )
+
+
+@storage.migration(4)
+def updated_at_columns(engine) -> None:
+    """Adds `updated_at` to `auth_user`, `auth_token` and `token_action`.
+
+    Existing rows keep `NULL`, they are exported only by full exports.
+    """
+    tables = ("auth_user", "auth_token", "token_action")
+
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            for table in tables:
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table} "
+                        f"ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE"
+                    )
+                )
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table in tables:
+                conn.execute(
+                    text(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_updated_at "
+                        f"ON {table} (updated_at)"
+                    )
+                )
+    else:
+        with engine.begin() as conn:
+            for table in tables:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME"
+                )
+                conn.exec_driver_sql(
+                    f"CREATE INDEX ix_{table}_updated_at ON {table} (updated_at)"
+                )
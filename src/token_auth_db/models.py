@@ -1,16 +1,91 @@
+import enum
 import logging
-
-from typing import Union
-
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, Index, select
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    String,
+    ForeignKey,
+    Table,
+    Index,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship
 
+import storage
 from storage import Base
 
 
 logger = logging.getLogger(__name__)
 
 
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class BindStatus(enum.Enum):
+    """Result of binding a token to an user"""
+
+    # the token is bound to the user now
+    BOUND = "bound"
+    # the token was bound to the same user before
+    ALREADY_BOUND = "already_bound"
+    # there is no such token or it is expired
+    NOT_FOUND = "not_found"
+    # the token belongs to another user
+    FOREIGN = "foreign"
+
+
+# Binds a token in a single statement. The token row is locked first,
+# so concurrent binds of the same token wait and see the winner.
+# The user is created only when the token can be bound to it.
+# An existing user is locked too, the purge skips locked users, otherwise
+# it could delete a user without tokens before the token is bound to it.
+# A user deleted while the lock waited is not found and is created again.
+PG_BIND_TOKEN = text(
+    """
+    WITH token AS (
+        SELECT id, user_id FROM auth_token
+        WHERE id = :token AND (expires_at IS NULL OR expires_at > :now)
+        FOR UPDATE
+    ),
+    existing_user AS (
+        SELECT id FROM auth_user
+        WHERE id = :user_id AND EXISTS (SELECT 1 FROM token WHERE user_id IS NULL)
+        FOR KEY SHARE
+    ),
+    new_user AS (
+        INSERT INTO auth_user (id, name, updated_at)
+        SELECT :user_id, :username, :now FROM token
+        WHERE token.user_id IS NULL AND NOT EXISTS (SELECT 1 FROM existing_user)
+        ON CONFLICT (id) DO NOTHING
+    ),
+    bound AS (
+        UPDATE auth_token SET user_id = :user_id, updated_at = :now
+        FROM token
+        WHERE auth_token.id = token.id AND token.user_id IS NULL
+        RETURNING auth_token.id
+    )
+    SELECT
+        EXISTS (SELECT 1 FROM token) AS found,
+        (SELECT user_id FROM token) AS owner_id,
+        EXISTS (SELECT 1 FROM bound) AS bound
+    """
+)
+
+
+# attempts of `AuthToken.bind` that fail on a user deleted at the same time
+BIND_ATTEMPTS = 3
+
+
 class AuthUser(Base):
     """Defines the `AuthUser` table.
 
@@ -19,16 +94,22 @@ class AuthUser(Base):
 
     __tablename__ = "auth_user"
 
-    id = Column(String, primary_key=True, index=True, unique=True)
+    # telegram user id
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
 
     name = Column(String, nullable=False)
 
+    # time of the last change, used by incremental exports
+    updated_at = Column(
+        DateTime(timezone=True), default=utcnow, onupdate=utcnow, index=True
+    )
+
     tokens = relationship(
         "AuthToken", back_populates="user", cascade="all, delete-orphan"
     )
 
     @staticmethod
-    def create(user_id: str, username: str, session) -> "AuthUser":
+    def create(user_id: int, username: str, session) -> "AuthUser":
         logger.info(f"Create a new user user_id={user_id}, name={username}")
         user = AuthUser(id=user_id, name=username)
         session.add(user)
@@ -36,16 +117,31 @@ class AuthUser(Base):
         return user
 
     @staticmethod
-    def find_by_id(user_id: str, session) -> Union["AuthUser", None]:
+    def find_by_id(user_id: int, session=None) -> Union["AuthUser", None]:
         """Finds a user by user id.
         Returns user or `None` because user id is index
+
+        Without `session` it is read from a replica, relationships of
+        the returned user can not be loaded then.
         """
-        return session.query(AuthUser).filter_by(id=user_id).one_or_none()
+
+        def query(session):
+            return session.query(AuthUser).filter_by(id=user_id).one_or_none()
+
+        return query(session) if session is not None else storage.run_read(query)
 
     @staticmethod
-    def exists(user_id: str, session) -> bool:
-        """Checks whether user with corresponding user id exists or not"""
-        return session.query(select(AuthUser).filter_by(id=user_id).exists()).scalar()
+    def exists(user_id: int, session=None) -> bool:
+        """Checks whether user with corresponding user id exists or not.
+        Without `session` it is checked on a replica.
+        """
+
+        def query(session):
+            return session.query(
+                select(AuthUser).filter_by(id=user_id).exists()
+            ).scalar()
+
+        return query(session) if session is not None else storage.run_read(query)
 
     def revoke_token(self, token: str, session) -> bool:
         """Method revokes (remove) token from a current user"""
@@ -69,6 +165,8 @@ token_action = Table(
     Base.metadata,
     Column("token_hash", String, ForeignKey("auth_token.id"), primary_key=True),
     Column("action_name", String, ForeignKey("auth_action.name"), primary_key=True),
+    # rows are only inserted and deleted, it is the time of the grant
+    Column("updated_at", DateTime(timezone=True), default=utcnow, index=True),
     Index("ix_token_action_token", "token_hash"),
     Index("ix_token_action_action", "action_name"),
 )
@@ -88,7 +186,15 @@ class AuthToken(Base):
     id = Column(String, primary_key=True, index=True, unique=True)
 
     # TODO: Do we really need it?
-    user_id = Column(Integer, ForeignKey("auth_user.id"), index=True)
+    user_id = Column(BigInteger, ForeignKey("auth_user.id"), index=True)
+
+    # the token is not valid after it, `None` means it never expires
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
+
+    # time of the last change, used by incremental exports
+    updated_at = Column(
+        DateTime(timezone=True), default=utcnow, onupdate=utcnow, index=True
+    )
 
     user = relationship("AuthUser", back_populates="tokens")
 
@@ -99,25 +205,153 @@ class AuthToken(Base):
     )
 
     @staticmethod
-    def create(id: str, session) -> "AuthToken":
-        logger.info(f"Create a new token id='{id}'")
-        token = AuthToken(id=id)
+    def create(id: str, session, expires_at: Optional[datetime] = None) -> "AuthToken":
+        logger.info(f"Create a new token id='{id}' expires_at={expires_at}")
+        token = AuthToken(id=id, expires_at=expires_at)
         session.add(token)
         session.commit()
         return token
 
     @staticmethod
-    def exists(token: str, session) -> bool:
-        """Checks whether passed token exists or not.
+    def not_expired(now: Optional[datetime] = None):
+        """Condition that filters out expired tokens"""
+        now = now or utcnow()
+        return or_(AuthToken.expires_at.is_(None), AuthToken.expires_at > now)
+
+    @staticmethod
+    def exists(token: str, session=None) -> bool:
+        """Checks whether passed token exists and is not expired.
+        Without `session` it is checked on a replica.
 
         Can be used for tokens valdation.
         """
-        return session.query(select(AuthToken).filter_by(id=token).exists()).scalar()
+
+        def query(session):
+            exists = (
+                select(AuthToken).filter_by(id=token).where(AuthToken.not_expired())
+            ).exists()
+            return session.query(exists).scalar()
+
+        return query(session) if session is not None else storage.run_read(query)
+
+    @staticmethod
+    def find_by_id(token: str, session=None) -> Union["AuthToken", None]:
+        """Finds a token, expired tokens are not returned.
+        Without `session` it is read from a replica.
+        """
+
+        def query(session):
+            return (
+                session.query(AuthToken)
+                .filter_by(id=token)
+                .filter(AuthToken.not_expired())
+                .one_or_none()
+            )
+
+        return query(session) if session is not None else storage.run_read(query)
+
+    @staticmethod
+    def owner(token: str, session=None) -> Optional[int]:
+        """Id of the user the token is bound to, `None` if the token is not
+        bound, not found or expired. Without `session` it is read from a replica.
+        """
+
+        def query(session):
+            return session.execute(
+                select(AuthToken.user_id).where(
+                    AuthToken.id == token, AuthToken.not_expired()
+                )
+            ).scalar()
+
+        return query(session) if session is not None else storage.run_read(query)
 
     @staticmethod
-    def find_by_id(token: str, session) -> Union["AuthToken", None]:
-        """Finds a token"""
-        return session.query(AuthToken).filter_by(id=token).one_or_none()
+    def bind(token: str, user_id: int, username: str, session) -> BindStatus:
+        """Binds the token to the user, the user is created if it is new.
+
+        Everything is done in one transaction, on postgres it is a single
+        statement, so concurrent binds of the same token are safe.
+        A bind that fails on the foreign key, eg the purge deleted the user
+        at the same time, is tried again.
+        """
+        for attempt in range(1, BIND_ATTEMPTS + 1):
+            try:
+                found, owner_id, bound = AuthToken._bind_once(
+                    token, user_id, username, session
+                )
+                break
+            except IntegrityError as e:
+                session.rollback()
+                if attempt == BIND_ATTEMPTS:
+                    raise
+                logger.warning(
+                    f"Bind token='{token}' to user_id={user_id} failed, "
+                    f"attempt={attempt}: {e.orig}"
+                )
+
+        if bound:
+            status = BindStatus.BOUND
+        elif not found:
+            status = BindStatus.NOT_FOUND
+        elif owner_id == user_id:
+            status = BindStatus.ALREADY_BOUND
+        else:
+            status = BindStatus.FOREIGN
+
+        logger.info(f"Bind token='{token}' to user_id={user_id}: {status.value}")
+        return status
+
+    @staticmethod
+    def _bind_once(token: str, user_id: int, username: str, session) -> tuple:
+        if session.get_bind().dialect.name == "postgresql":
+            row = session.execute(
+                PG_BIND_TOKEN,
+                {
+                    "token": token,
+                    "user_id": user_id,
+                    "username": username,
+                    "now": utcnow(),
+                },
+            ).one()
+            session.commit()
+            return tuple(row)
+        return AuthToken._bind_fallback(token, user_id, username, session)
+
+    @staticmethod
+    def _bind_fallback(token: str, user_id: int, username: str, session) -> tuple:
+        """Same as `PG_BIND_TOKEN` in a transaction of several statements"""
+        owner = session.execute(
+            select(AuthToken.user_id).where(
+                AuthToken.id == token, AuthToken.not_expired()
+            )
+        ).one_or_none()
+        if owner is None:
+            session.rollback()
+            return False, None, False
+        if owner.user_id is not None:
+            session.rollback()
+            return True, owner.user_id, False
+
+        session.execute(
+            sqlite_insert(AuthUser)
+            .values(id=user_id, name=username)
+            .on_conflict_do_nothing(index_elements=["id"])
+        )
+        # the condition keeps the first bind if another one got here before
+        bound = session.execute(
+            update(AuthToken)
+            .where(AuthToken.id == token, AuthToken.user_id.is_(None))
+            .values(user_id=user_id)
+        ).rowcount
+        if not bound:
+            session.rollback()
+            owner_id = session.execute(
+                select(AuthToken.user_id).where(AuthToken.id == token)
+            ).scalar()
+            return True, owner_id, False
+
+        session.commit()
+        return True, None, True
 
 
 class AuthAction(Base):
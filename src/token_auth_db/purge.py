@@ -0,0 +1,125 @@
+"""Removes expired tokens, their actions and users left without tokens.
+
+Rows are deleted in small batches, every batch is a separate short
+transaction, so the purge never holds locks for long.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import delete, exists, select
+
+from token_auth_db.models import AuthToken, AuthUser, token_action
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PurgeResult:
+    """Rows removed by a purge run"""
+
+    tokens: int = 0
+    token_actions: int = 0
+    users: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+
+def _lock_batch(query, engine):
+    # rows locked by other transactions are purged on the next run
+    if engine.dialect.name == "postgresql":
+        return query.with_for_update(skip_locked=True)
+    return query
+
+
+def purge_expired(
+    engine, batch_size: int = 1000, now: Optional[datetime] = None
+) -> PurgeResult:
+    """Deletes tokens expired before `now` and users without tokens"""
+    now = now or datetime.now(timezone.utc)
+    result = PurgeResult()
+    started = time.perf_counter()
+
+    expired = (
+        select(AuthToken.id)
+        .where(AuthToken.expires_at <= now)
+        .order_by(AuthToken.expires_at)
+        .limit(batch_size)
+    )
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(_lock_batch(expired, engine)).scalars().all()
+            if not ids:
+                break
+
+            result.token_actions += conn.execute(
+                delete(token_action).where(token_action.c.token_hash.in_(ids))
+            ).rowcount
+            result.tokens += conn.execute(
+                delete(AuthToken).where(AuthToken.id.in_(ids))
+            ).rowcount
+            result.batches += 1
+
+    no_tokens = ~exists().where(AuthToken.user_id == AuthUser.id)
+    orphans = select(AuthUser.id).where(no_tokens).limit(batch_size)
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(_lock_batch(orphans, engine)).scalars().all()
+            if not ids:
+                break
+
+            # the user could get a token after it was selected
+            result.users += conn.execute(
+                delete(AuthUser).where(AuthUser.id.in_(ids), no_tokens)
+            ).rowcount
+            result.batches += 1
+
+    result.seconds = round(time.perf_counter() - started, 3)
+    return result
+
+
+class PurgeJob:
+    """Runs `purge_expired` every `interval` seconds in the bot event loop.
+
+    The database work is done in a worker thread, so the loop is not blocked.
+    """
+
+    def __init__(self, engine, interval: float = 3600.0, batch_size: int = 1000):
+        self.engine = engine
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last: Optional[PurgeResult] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="PurgeJob")
+        logger.info(
+            f"Token purge started, interval={self.interval}s, batch_size={self.batch_size}"
+        )
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> PurgeResult:
+        self.last = await asyncio.to_thread(purge_expired, self.engine, self.batch_size)
+        logger.info(f"Token purge: {asdict(self.last)}")
+        return self.last
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                # the next run tries again
+                logger.exception("Token purge failed")
+            await asyncio.sleep(self.interval)
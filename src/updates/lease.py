@@ -0,0 +1,72 @@
+"""The lease that lets one instance of the bot get updates at a time.
+
+On a rolling restart the new instance warms up and waits for the lease,
+the old one releases it after it drained updates and persisted state.
+The holder renews the lease every third of `ttl`, the lease of a crashed
+instance expires after `ttl` seconds.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Callable, Optional
+
+from storage import SessionLocal
+from updates.models import BotLease
+
+logger = logging.getLogger(__name__)
+
+
+class Lease:
+    def __init__(self, name: str, ttl: float = 30.0, session_factory=SessionLocal):
+        self.name = name
+        self.ttl = ttl
+        self.session_factory = session_factory
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+
+    def _db(self, method: Callable, *args):
+        with self.session_factory() as session:
+            return method(*args, session)
+
+    async def _try(self) -> bool:
+        return await asyncio.to_thread(
+            self._db, BotLease.acquire, self.name, self.owner, self.ttl
+        )
+
+    async def acquire(self, poll_interval: float = 1.0) -> None:
+        """Waits for the lease and keeps renewing it in the background"""
+        if not await self._try():
+            holder = await asyncio.to_thread(self._db, BotLease.holder, self.name)
+            logger.info(
+                f"Wait for the lease '{self.name}' held by {holder.owner if holder else None}"
+            )
+            while not await self._try():
+                await asyncio.sleep(poll_interval)
+
+        logger.info(f"Lease '{self.name}' is acquired by {self.owner}")
+        self._task = asyncio.create_task(self._renew(), name=f"Lease:{self.name}")
+
+    async def release(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self._db, BotLease.release, self.name, self.owner)
+        logger.info(f"Lease '{self.name}' is released")
+
+    async def _renew(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self._try():
+                    # another instance took the expired lease, eg the loop was blocked
+                    logger.error(f"Lease '{self.name}' is lost")
+            except Exception:
+                # the next renew tries again, the lease lives for `ttl`
+                logger.exception(f"Renew of the lease '{self.name}' failed")
@@ -0,0 +1,122 @@
+"""Schema migrations of the `updates` tables, see `token_auth_db.migrations`"""
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    MetaData,
+    String,
+    Table,
+    Text,
+    inspect,
+    text,
+)
+
+import bots
+import storage
+
+
+@storage.migration(7)
+def update_tables(engine) -> None:
+    """Adds `update_claim`, `persisted_state` and `bot_lease`"""
+    # tables as they are in the version 7, later migrations change them further
+    metadata = MetaData()
+    Table(
+        "update_claim",
+        metadata,
+        Column("update_id", BigInteger, primary_key=True, autoincrement=False),
+        Column("status", String, nullable=False),
+        Column("payload", Text),
+        Column("claimed_at", DateTime(timezone=True)),
+        Column("finished_at", DateTime(timezone=True)),
+        Index("ix_update_claim_status", "status", "claimed_at"),
+    )
+    Table(
+        "persisted_state",
+        metadata,
+        Column("namespace", String(64), primary_key=True),
+        Column("key", String(255), primary_key=True),
+        Column("value", Text, nullable=False),
+        Column("updated_at", DateTime(timezone=True)),
+    )
+    Table(
+        "bot_lease",
+        metadata,
+        Column("name", String(64), primary_key=True),
+        Column("owner", String(255), nullable=False),
+        Column("expires_at", DateTime(timezone=True), nullable=False),
+    )
+    metadata.create_all(engine)
+
+
+def _v8_tables() -> MetaData:
+    metadata = MetaData()
+    Table(
+        "update_claim",
+        metadata,
+        Column("bot_id", BigInteger, primary_key=True, autoincrement=False),
+        Column("update_id", BigInteger, primary_key=True, autoincrement=False),
+        Column("status", String, nullable=False),
+        Column("payload", Text),
+        Column("claimed_at", DateTime(timezone=True)),
+        Column("finished_at", DateTime(timezone=True)),
+        Index("ix_update_claim_status", "status", "claimed_at"),
+    )
+    Table(
+        "persisted_state",
+        metadata,
+        Column("bot_id", BigInteger, primary_key=True, autoincrement=False),
+        Column("namespace", String(64), primary_key=True),
+        Column("key", String(255), primary_key=True),
+        Column("value", Text, nullable=False),
+        Column("updated_at", DateTime(timezone=True)),
+    )
+    return metadata
+
+
+@storage.migration(8)
+def bot_id_columns(engine) -> None:
+    """Adds `bot_id` to the primary keys of `update_claim` and `persisted_state`.
+
+    Rows written before belong to the bot of `TELEGRAM_BOT_TOKEN`. Both tables
+    are small (claims are kept for an hour), so they are changed in one
+    transaction.
+    """
+    bot_id = bots.from_envs().bot_id
+    tables = _v8_tables().tables
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            for name, table in tables.items():
+                pk_name = inspect(conn).get_pk_constraint(name)["name"]
+                columns = ", ".join(column.name for column in table.primary_key)
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {name} ADD COLUMN bot_id BIGINT NOT NULL "
+                        f"DEFAULT {int(bot_id)}"
+                    )
+                )
+                conn.execute(
+                    text(f"ALTER TABLE {name} ALTER COLUMN bot_id DROP DEFAULT")
+                )
+                conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{pk_name}"'))
+                conn.execute(text(f"ALTER TABLE {name} ADD PRIMARY KEY ({columns})"))
+            return
+
+        # sqlite does not change primary keys, the tables are copied
+        conn.execute(text("DROP INDEX IF EXISTS ix_update_claim_status"))
+        for name, table in tables.items():
+            columns = ", ".join(
+                column.name for column in table.columns if column.name != "bot_id"
+            )
+            conn.execute(text(f"ALTER TABLE {name} RENAME TO {name}_v7"))
+            table.create(conn)
+            conn.execute(
+                text(
+                    f"INSERT INTO {name} (bot_id, {columns}) "
+                    f"SELECT :bot_id, {columns} FROM {name}_v7"
+                ),
+                {"bot_id": bot_id},
+            )
+            conn.execute(text(f"DROP TABLE {name}_v7"))
@@ -0,0 +1,264 @@
+import enum
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    String,
+    Text,
+    delete,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from storage import Base
+from token_auth_db.models import utcnow
+
+logger = logging.getLogger(__name__)
+
+
+def _insert(model, session):
+    """`INSERT` that supports `ON CONFLICT` on postgres and sqlite"""
+    if session.get_bind().dialect.name == "postgresql":
+        return pg_insert(model)
+    return sqlite_insert(model)
+
+
+class ClaimStatus(enum.Enum):
+    PROCESSING = "processing"
+    DONE = "done"
+    # the instance stopped before the update was processed
+    INTERRUPTED = "interrupted"
+
+
+class UpdateClaim(Base):
+    """Defines the `UpdateClaim` table.
+
+    An update is claimed before it is processed, so an update delivered
+    twice (a webhook retry, polling after a crash) is processed once.
+    The update itself is kept until it is processed, updates not processed
+    by the previous instance are replayed on start.
+    """
+
+    __tablename__ = "update_claim"
+
+    # update ids are sequences of every bot, see `bots.BotConfig.bot_id`
+    bot_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+
+    status = Column(String, nullable=False, default=ClaimStatus.PROCESSING.value)
+
+    # JSON of the update, removed once it is processed
+    payload = Column(Text)
+
+    claimed_at = Column(DateTime(timezone=True), default=utcnow)
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (Index("ix_update_claim_status", "status", "claimed_at"),)
+
+    @staticmethod
+    def claim(
+        bot_id: int,
+        update_id: int,
+        payload: Optional[str],
+        finished: Iterable[int],
+        session,
+    ) -> bool:
+        """Returns `False` if the update is already claimed.
+
+        Updates processed since the last claim are marked `finished` in the
+        same transaction.
+        """
+        UpdateClaim._finish(bot_id, finished, session)
+        inserted = session.execute(
+            _insert(UpdateClaim, session)
+            .values(
+                bot_id=bot_id,
+                update_id=update_id,
+                status=ClaimStatus.PROCESSING.value,
+                payload=payload,
+                claimed_at=utcnow(),
+            )
+            .on_conflict_do_nothing(index_elements=["bot_id", "update_id"])
+        ).rowcount
+        session.commit()
+        return inserted == 1
+
+    @staticmethod
+    def _finish(bot_id: int, update_ids: Iterable[int], session) -> None:
+        update_ids = list(update_ids)
+        if update_ids:
+            session.execute(
+                update(UpdateClaim)
+                .where(
+                    UpdateClaim.bot_id == bot_id, UpdateClaim.update_id.in_(update_ids)
+                )
+                .values(
+                    status=ClaimStatus.DONE.value, payload=None, finished_at=utcnow()
+                )
+            )
+
+    @staticmethod
+    def finish(bot_id: int, update_ids: Iterable[int], session) -> None:
+        UpdateClaim._finish(bot_id, update_ids, session)
+        session.commit()
+
+    @staticmethod
+    def interrupt(bot_id: int, update_id: int, payload: str, session) -> None:
+        """Keeps the update to process it after the restart"""
+        statement = _insert(UpdateClaim, session).values(
+            bot_id=bot_id,
+            update_id=update_id,
+            status=ClaimStatus.INTERRUPTED.value,
+            payload=payload,
+            claimed_at=utcnow(),
+        )
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["bot_id", "update_id"],
+                set_={"status": ClaimStatus.INTERRUPTED.value, "payload": payload},
+            )
+        )
+        session.commit()
+
+    @staticmethod
+    def take_unfinished(bot_id: int, session) -> List[Tuple[int, str]]:
+        """Updates the previous instance did not finish, in the order they came.
+
+        They are claimed again by the caller. It is safe only while the
+        caller holds the instance lease, see `BotLease`.
+        """
+        unfinished = (
+            ClaimStatus.PROCESSING.value,
+            ClaimStatus.INTERRUPTED.value,
+        )
+        rows = session.execute(
+            select(UpdateClaim.update_id, UpdateClaim.payload)
+            .where(
+                UpdateClaim.bot_id == bot_id,
+                UpdateClaim.status.in_(unfinished),
+                UpdateClaim.payload.is_not(None),
+            )
+            .order_by(UpdateClaim.update_id)
+        ).all()
+        session.execute(
+            update(UpdateClaim)
+            .where(
+                UpdateClaim.bot_id == bot_id,
+                UpdateClaim.update_id.in_([row.update_id for row in rows]),
+            )
+            .values(status=ClaimStatus.PROCESSING.value, claimed_at=utcnow())
+        )
+        session.commit()
+        return [(row.update_id, row.payload) for row in rows]
+
+    @staticmethod
+    def purge(before: datetime, session) -> int:
+        """Deletes processed updates finished before `before`"""
+        deleted = session.execute(
+            delete(UpdateClaim).where(
+                UpdateClaim.status == ClaimStatus.DONE.value,
+                UpdateClaim.finished_at < before,
+            )
+        ).rowcount
+        session.commit()
+        return deleted
+
+
+class PersistedState(Base):
+    """Defines the `PersistedState` table.
+
+    State of the bot that must survive a restart: conversations and user
+    data. `namespace` is eg `user_data` or `conversation:<name>`, values
+    are JSON.
+    """
+
+    __tablename__ = "persisted_state"
+
+    bot_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    namespace = Column(String(64), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    value = Column(Text, nullable=False)
+
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+
+    @staticmethod
+    def load(bot_id: int, namespace: str, session) -> Dict[str, str]:
+        rows = session.execute(
+            select(PersistedState.key, PersistedState.value).where(
+                PersistedState.bot_id == bot_id, PersistedState.namespace == namespace
+            )
+        )
+        return {row.key: row.value for row in rows}
+
+    @staticmethod
+    def save(
+        bot_id: int, namespace: str, key: str, value: Optional[str], session
+    ) -> None:
+        """Stores the value, `None` removes it"""
+        if value is None:
+            session.execute(
+                delete(PersistedState).where(
+                    PersistedState.bot_id == bot_id,
+                    PersistedState.namespace == namespace,
+                    PersistedState.key == key,
+                )
+            )
+        else:
+            session.merge(
+                PersistedState(bot_id=bot_id, namespace=namespace, key=key, value=value)
+            )
+        session.commit()
+
+
+class BotLease(Base):
+    """Defines the `BotLease` table.
+
+    Only the holder of the lease gets updates of the bot. A new instance
+    waits until the previous one released the lease or it expired, so
+    state persisted by the previous instance is complete when it is loaded.
+    """
+
+    __tablename__ = "bot_lease"
+
+    name = Column(String(64), primary_key=True)
+    owner = Column(String(255), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    @staticmethod
+    def acquire(name: str, owner: str, ttl: float, session) -> bool:
+        """Takes or prolongs the lease, returns `False` if another owner holds it"""
+        now = utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        session.execute(
+            _insert(BotLease, session)
+            .values(name=name, owner=owner, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=["name"])
+        )
+        taken = session.execute(
+            update(BotLease)
+            .where(
+                BotLease.name == name,
+                (BotLease.owner == owner) | (BotLease.expires_at <= now),
+            )
+            .values(owner=owner, expires_at=expires_at)
+        ).rowcount
+        session.commit()
+        return taken == 1
+
+    @staticmethod
+    def release(name: str, owner: str, session) -> None:
+        session.execute(
+            delete(BotLease).where(BotLease.name == name, BotLease.owner == owner)
+        )
+        session.commit()
+
+    @staticmethod
+    def holder(name: str, session) -> Optional["BotLease"]:
+        return session.get(BotLease, name)
@@ -0,0 +1,128 @@
+"""PTB persistence in the database of the bot.
+
+Only conversations and user data are stored, bot data keeps live objects
+(jobs, clients) and chat and callback data are not used. Values are
+written as JSON when PTB flushes the persistence: every `update_interval`
+seconds and on stop.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import SessionLocal
+from updates.models import PersistedState
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = "user_data"
+
+
+def _conversation(name: str) -> str:
+    return f"conversation:{name}"
+
+
+class DbPersistence(BasePersistence):
+    def __init__(
+        self, bot_id: int = 0, update_interval: float = 60, session_factory=SessionLocal
+    ):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.bot_id = bot_id
+        self.session_factory = session_factory
+        # last written JSON per namespace and key, unchanged values are not written
+        self._written: Dict[Tuple[str, str], str] = {}
+
+    def _db(self, method: Callable, *args):
+        with self.session_factory() as session:
+            return method(*args, session)
+
+    async def _load(self, namespace: str) -> Dict[str, str]:
+        values = await asyncio.to_thread(
+            self._db, PersistedState.load, self.bot_id, namespace
+        )
+        for key, value in values.items():
+            self._written[(namespace, key)] = value
+        return values
+
+    async def _save(self, namespace: str, key: str, value: Optional[str]) -> None:
+        if self._written.get((namespace, key)) == value:
+            return
+        await asyncio.to_thread(
+            self._db, PersistedState.save, self.bot_id, namespace, key, value
+        )
+        if value is None:
+            self._written.pop((namespace, key), None)
+        else:
+            self._written[(namespace, key)] = value
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        values = await self._load(USER_DATA)
+        logger.info(f"Loaded user data of {len(values)} users")
+        return {int(key): json.loads(value) for key, value in values.items()}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        # users without data are not stored
+        await self._save(USER_DATA, str(user_id), json.dumps(data) if data else None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._save(USER_DATA, str(user_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[int, ...], object]:
+        values = await self._load(_conversation(name))
+        logger.info(f"Loaded {len(values)} '{name}' conversations")
+        return {
+            tuple(json.loads(key)): json.loads(value) for key, value in values.items()
+        }
+
+    async def update_conversation(
+        self, name: str, key: Tuple[int, ...], new_state: Optional[object]
+    ) -> None:
+        await self._save(
+            _conversation(name),
+            json.dumps(list(key)),
+            None if new_state is None else json.dumps(new_state),
+        )
+
+    # not stored, see `store_data`
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # every update is written at once
+        pass
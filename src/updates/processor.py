@@ -0,0 +1,205 @@
+"""Processing of updates that survives restarts.
+
+Every update is claimed in the database before its handlers run, an
+update delivered twice is skipped. Processed updates are marked as done
+together with the next claim or by the background task within
+`finish_interval` seconds, so the hot path has one transaction per update. On stop
+the bot drains in-flight updates, updates still running after the drain
+deadline are cancelled and kept in the database together with updates
+that were not started. The next instance replays them on start.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from storage import SessionLocal
+from token_auth_db.models import utcnow
+from updates.models import UpdateClaim
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProcessorStats:
+    processed: int = 0
+    duplicates: int = 0
+    interrupted: int = 0
+    replayed: int = 0
+
+
+class ClaimingUpdateProcessor(BaseUpdateProcessor):
+    """Claims updates before processing and tracks them until they finish.
+
+    `claims=False` turns the database off, updates are only tracked.
+    Processed claims older than `retention` seconds are purged in the
+    background. Claims of every bot are separate, see `bot_id`.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int = 1,
+        bot_id: int = 0,
+        claims: bool = True,
+        retention: float = 3600.0,
+        finish_interval: float = 1.0,
+        session_factory=SessionLocal,
+    ):
+        super().__init__(max_concurrent_updates)
+        self.bot_id = bot_id
+        self.claims = claims
+        self.retention = retention
+        self.finish_interval = finish_interval
+        self.session_factory = session_factory
+
+        self.stats = ProcessorStats()
+        self.interrupted = False
+        self._in_flight: Dict[int, asyncio.Task] = {}
+        self._cancelled: Set[int] = set()
+        # replayed updates are claimed already
+        self._replayed: Set[int] = set()
+        # processed updates not marked as done yet
+        self._finished: List[int] = []
+        # claims and finishes take turns, they do not share a connection at
+        # the same time on sqlite
+        self._db_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def _db(self, method: Callable, *args):
+        with self.session_factory() as session:
+            return method(*args, session)
+
+    async def call_db(self, method: Callable, *args):
+        async with self._db_lock:
+            return await asyncio.to_thread(self._db, method, *args)
+
+    async def initialize(self) -> None:
+        if self.claims:
+            self._task = asyncio.create_task(self._run(), name="UpdateClaims")
+
+    async def shutdown(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Marks processed updates as done"""
+        if self._finished:
+            finished, self._finished = self._finished, []
+            await self.call_db(UpdateClaim.finish, self.bot_id, finished)
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        if not isinstance(update, Update):
+            await coroutine
+            return
+
+        update_id = update.update_id
+        if self.interrupted:
+            # the drain deadline passed, the next instance processes it
+            coroutine.close()
+            await self._keep(update)
+            return
+
+        if update_id in self._replayed:
+            self._replayed.discard(update_id)
+        elif self.claims and not await self._claim(update):
+            coroutine.close()
+            self.stats.duplicates += 1
+            logger.info(f"Update {update_id} is already processed, skip it")
+            return
+
+        # a task of its own, so the handler can be cancelled alone
+        task = asyncio.ensure_future(coroutine)
+        self._in_flight[update_id] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if update_id not in self._cancelled:
+                raise
+            await self._keep(update)
+            return
+        finally:
+            self._in_flight.pop(update_id, None)
+            self._cancelled.discard(update_id)
+
+        self.stats.processed += 1
+        if self.claims:
+            self._finished.append(update_id)
+
+    async def _claim(self, update: Update) -> bool:
+        finished, self._finished = self._finished, []
+        try:
+            return await self.call_db(
+                UpdateClaim.claim,
+                self.bot_id,
+                update.update_id,
+                update.to_json(),
+                finished,
+            )
+        except BaseException:
+            self._finished = finished + self._finished
+            raise
+
+    async def _keep(self, update: Update) -> None:
+        self.stats.interrupted += 1
+        if self.claims:
+            await self.call_db(
+                UpdateClaim.interrupt, self.bot_id, update.update_id, update.to_json()
+            )
+        logger.warning(f"Update {update.update_id} is interrupted by the stop")
+
+    def interrupt(self) -> List[int]:
+        """Cancels in-flight updates, updates that come later are not started"""
+        self.interrupted = True
+        for update_id, task in self._in_flight.items():
+            self._cancelled.add(update_id)
+            task.cancel()
+        return list(self._cancelled)
+
+    async def replay(self, application: Application) -> List[int]:
+        """Queues updates the previous instance did not finish"""
+        if not self.claims:
+            return []
+        rows = await self.call_db(UpdateClaim.take_unfinished, self.bot_id)
+        for update_id, payload in rows:
+            self._replayed.add(update_id)
+            await application.update_queue.put(
+                Update.de_json(json.loads(payload), application.bot)
+            )
+        self.stats.replayed += len(rows)
+        if rows:
+            logger.info(f"Replay {len(rows)} updates of the previous instance")
+        return [update_id for update_id, _ in rows]
+
+    async def _run(self) -> None:
+        purged_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.finish_interval)
+            try:
+                await self.flush()
+                if self.retention and time.monotonic() - purged_at >= self.retention:
+                    purged_at = time.monotonic()
+                    before = utcnow() - timedelta(seconds=self.retention)
+                    deleted = await self.call_db(UpdateClaim.purge, before)
+                    logger.info(f"Purged {deleted} processed update claims")
+            except Exception:
+                # the next run tries again
+                logger.exception("Update claims housekeeping failed")
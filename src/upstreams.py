@@ -0,0 +1,49 @@
+"""Clients of the upstream services: the agent and the users-groups MCP server.
+
+The agent client is shared by all handlers, so connections to the agent
+are kept in a pool instead of being opened for every message.
+`httpx` and `fastmcp` are imported on first use, `fastmcp` alone takes
+longer to import than the rest of the bot.
+"""
+
+from typing import TYPE_CHECKING, Optional
+
+import envs
+
+if TYPE_CHECKING:
+    import httpx
+    from fastmcp import Client
+
+_agent_client: Optional["httpx.AsyncClient"] = None
+
+
+def agent_client() -> "httpx.AsyncClient":
+    """Returns the shared HTTP client of the agent"""
+    global _agent_client
+
+    if _agent_client is None or _agent_client.is_closed:
+        import httpx
+
+        _agent_client = httpx.AsyncClient(timeout=30.0)
+    return _agent_client
+
+
+def set_agent_client(client: Optional["httpx.AsyncClient"]) -> None:
+    """Replaces the shared agent client, eg by a client with a mocked transport"""
+    global _agent_client
+    _agent_client = client
+
+
+def users_groups_client() -> "Client":
+    """Returns a new client of the users-groups MCP server"""
+    from fastmcp import Client
+
+    return Client(f"{envs.USERS_GROUPS_MCP_ENDPOINT}/mcp")
+
+
+async def close() -> None:
+    global _agent_client
+
+    if _agent_client is not None:
+        await _agent_client.aclose()
+        _agent_client = None
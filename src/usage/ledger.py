@@ -0,0 +1,158 @@
+"""Write-behind buffer of usage records.
+
+Handlers add records to an in-memory buffer, a background task writes
+them in bulk inserts when `flush_size` records are collected or every
+`flush_interval` seconds. When the database falls behind and the buffer
+reaches `max_pending` records, `record` waits for a flush up to
+`backpressure_timeout` seconds and then drops the record.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+from storage import SessionLocal
+from token_auth_db.models import utcnow
+from usage.models import UsageRecord
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LedgerStats:
+    recorded: int = 0
+    flushed: int = 0
+    flushes: int = 0
+    failed_flushes: int = 0
+    dropped: int = 0
+    # records waited for space in the buffer
+    throttled: int = 0
+
+
+class UsageLedger:
+    def __init__(
+        self,
+        flush_size: int = 500,
+        flush_interval: float = 5.0,
+        max_pending: int = 10_000,
+        backpressure_timeout: float = 1.0,
+        session_factory=SessionLocal,
+    ):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.backpressure_timeout = backpressure_timeout
+        self.session_factory = session_factory
+
+        self.stats = LedgerStats()
+        self._pending: List[dict] = []
+        self._flush_needed = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="UsageLedger")
+        logger.info(
+            f"Usage ledger started, flush_size={self.flush_size}, flush_interval={self.flush_interval}s"
+        )
+
+    async def stop(self) -> None:
+        """Stops the background task and writes the rest of the buffer"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+        logger.info(f"Usage ledger stopped: {asdict(self.stats)}")
+
+    async def record(
+        self,
+        user_id: int,
+        latency: float,
+        request_size: int = 0,
+        response_size: int = 0,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Adds a record to the buffer, returns `False` if it was dropped"""
+        if len(self._pending) >= self.max_pending:
+            self.stats.throttled += 1
+            self._flush_needed.set()
+            deadline = time.perf_counter() + self.backpressure_timeout
+            while len(self._pending) >= self.max_pending:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    self.stats.dropped += 1
+                    return False
+                self._flushed.clear()
+                try:
+                    await asyncio.wait_for(self._flushed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+        self._pending.append(
+            {
+                "user_id": user_id,
+                "created_at": utcnow(),
+                "latency_ms": round(latency * 1000, 3),
+                "request_size": request_size,
+                "response_size": response_size,
+                "error": error,
+            }
+        )
+        self.stats.recorded += 1
+        if len(self._pending) >= self.flush_size:
+            self._flush_needed.set()
+        return True
+
+    def _insert(self, rows: List[dict]) -> None:
+        with self.session_factory() as session:
+            UsageRecord.bulk_insert(rows, session)
+
+    async def flush(self) -> int:
+        """Writes buffered records, returns the number of written records"""
+        async with self._flush_lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+
+            try:
+                await asyncio.to_thread(self._insert, rows)
+            except Exception as e:
+                self.stats.failed_flushes += 1
+                # keep records for the next flush, the oldest are dropped first
+                self._pending = rows + self._pending
+                overflow = len(self._pending) - self.max_pending
+                if overflow > 0:
+                    self._pending = self._pending[overflow:]
+                    self.stats.dropped += overflow
+                logger.error(f"Usage ledger flush of {len(rows)} records failed: {e}")
+                return 0
+
+            self.stats.flushes += 1
+            self.stats.flushed += len(rows)
+            self._flushed.set()
+            return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+
+            # a stop waits for the flush in progress instead of losing its records
+            if not await asyncio.shield(self.flush()) and self._pending:
+                # the database is not available, do not retry in a busy loop
+                await asyncio.sleep(self.flush_interval)
@@ -0,0 +1,41 @@
+"""Schema migrations of the `usage_record` table, see `token_auth_db.migrations`"""
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+)
+
+import storage
+
+
+@storage.migration(6)
+def usage_record_table(engine) -> None:
+    """Adds `usage_record`"""
+    # table as it is in the version 6, later migrations change it further
+    metadata = MetaData()
+    Table(
+        "usage_record",
+        metadata,
+        Column(
+            "id",
+            BigInteger().with_variant(Integer, "sqlite"),
+            primary_key=True,
+            autoincrement=True,
+        ),
+        Column("user_id", BigInteger, nullable=False),
+        Column("created_at", DateTime(timezone=True), nullable=False),
+        Column("latency_ms", Float, nullable=False),
+        Column("request_size", Integer, nullable=False),
+        Column("response_size", Integer, nullable=False),
+        Column("error", String),
+        Index("ix_usage_record_user_created", "user_id", "created_at"),
+        Index("ix_usage_record_created", "created_at"),
+    )
+    metadata.create_all(engine)
@@ -0,0 +1,104 @@
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    String,
+    case,
+    func,
+    insert,
+    select,
+)
+
+from storage import Base
+
+logger = logging.getLogger(__name__)
+
+# sqlite autoincrements only INTEGER primary keys
+RecordId = BigInteger().with_variant(Integer, "sqlite")
+
+
+class UsageRecord(Base):
+    """Defines the `UsageRecord` table.
+
+    A row per message processed by the agent. Rows are written in bulk
+    by `usage.ledger.UsageLedger`, not by handlers.
+    """
+
+    __tablename__ = "usage_record"
+
+    id = Column(RecordId, primary_key=True, autoincrement=True)
+
+    # telegram user id
+    user_id = Column(BigInteger, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+    # time of the agent call
+    latency_ms = Column(Float, nullable=False)
+
+    # sizes (characters) of the user message and of the agent response
+    request_size = Column(Integer, nullable=False, default=0)
+    response_size = Column(Integer, nullable=False, default=0)
+
+    # `None` for successful calls, eg `http_502` or the exception name
+    error = Column(String)
+
+    __table_args__ = (
+        Index("ix_usage_record_user_created", "user_id", "created_at"),
+        Index("ix_usage_record_created", "created_at"),
+    )
+
+    @staticmethod
+    def bulk_insert(rows: List[dict], session) -> None:
+        session.execute(insert(UsageRecord), rows)
+        session.commit()
+
+    @staticmethod
+    def _rollup(columns, since: Optional[datetime], until: Optional[datetime]):
+        errors = func.sum(case((UsageRecord.error.is_not(None), 1), else_=0))
+        query = select(
+            *columns,
+            func.count().label("messages"),
+            errors.label("errors"),
+            func.avg(UsageRecord.latency_ms).label("avg_latency_ms"),
+            func.max(UsageRecord.latency_ms).label("max_latency_ms"),
+            func.sum(UsageRecord.response_size).label("response_size"),
+        )
+        if since:
+            query = query.where(UsageRecord.created_at >= since)
+        if until:
+            query = query.where(UsageRecord.created_at < until)
+        return query.group_by(*columns)
+
+    @staticmethod
+    def per_user(
+        session,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> List:
+        """Usage per user, the most active users first"""
+        query = UsageRecord._rollup([UsageRecord.user_id], since, until)
+        query = query.order_by(func.count().desc()).limit(limit)
+        return session.execute(query).all()
+
+    @staticmethod
+    def per_day(
+        session,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        user_id: Optional[int] = None,
+    ) -> List:
+        """Usage per day, of all users or of `user_id`"""
+        day = func.date(UsageRecord.created_at).label("day")
+        query = UsageRecord._rollup([day], since, until).order_by(day)
+        if user_id is not None:
+            query = query.where(UsageRecord.user_id == user_id)
+        return session.execute(query).all()
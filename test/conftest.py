@@ -2,6 +2,8 @@ import sys
 import os
 from pathlib import Path
 
+import pytest
+
 # Add the src directory to the Python path for imports during testing
 src_path = Path(__file__).parent.parent / "src"
 if str(src_path) not in sys.path:
@@ -11,3 +13,11 @@ if str(src_path) not in sys.path:
 os.environ.setdefault("TEACHER_TELEGRAM_ID", "123456789")
 os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test_token")
 os.environ.setdefault("DEBUG_MODE", "0")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    """The schema is not created on import of `storage`, create it once for all tests"""
+    import storage
+
+    storage.init_db(storage.engine)
@@ -0,0 +1,21 @@
+import pytest
+
+from benchmarks.bench_handlers import compare, run_benchmarks
+
+
+@pytest.mark.asyncio
+async def test_benchmarks_smoke():
+    """Benchmarks drive all scenarios through the real application without errors"""
+    results = await run_benchmarks(iterations=3)
+
+    scenarios = results["scenarios"]
+    assert set(scenarios) == {"chat", "token", "registration"}
+
+    for result in scenarios.values():
+        assert result["operations"] == 3
+        assert result["errors"] == 0
+
+    assert scenarios["chat"]["bot_api_calls"]["sendMessage"] == 3
+    assert scenarios["token"]["sql_queries"] > 0
+
+    assert "chat" in compare(results, results)
@@ -0,0 +1,180 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import delete, inspect, text
+from telegram.ext import Application
+
+import bots
+import main
+import storage
+from benchmarks.fakes import FakeBotRequest
+from updates.models import BotLease, PersistedState, UpdateClaim
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("MATH_BOT_TOKEN", "1001:math")
+    path = tmp_path / "bots.json"
+    path.write_text(
+        json.dumps(
+            {
+                "bots": {
+                    "math": {
+                        "token": "${MATH_BOT_TOKEN}",
+                        "teacher_id": "11",
+                        "agent_endpoint": "http://math-agent",
+                    },
+                    "art": {"token": "1002:art", "teacher_id": 12},
+                }
+            }
+        )
+    )
+    return path
+
+
+def test_load(config_file):
+    math, art = bots.load(str(config_file))
+
+    assert math == bots.BotConfig(
+        name="math",
+        token="1001:math",
+        teacher_id=11,
+        agent_endpoint="http://math-agent",
+    )
+    assert math.bot_id == 1001
+    assert math.lease_name == "bot:1001"
+    assert art.agent_endpoint is None
+
+
+@pytest.mark.parametrize(
+    "bots_config, error",
+    [
+        ({"bots": {}}, "No bots"),
+        ({"bots": {"math": {"teacher_id": 1}}}, "has no token"),
+        ({"bots": {"math": {"token": "1:a", "port": 1}}}, "invalid options"),
+        (
+            {"bots": {"math": {"token": "1:a"}, "art": {"token": "1:b"}}},
+            "same bot_id",
+        ),
+    ],
+)
+def test_load_rejects_invalid_config(tmp_path, bots_config, error):
+    path = tmp_path / "bots.json"
+    path.write_text(json.dumps(bots_config))
+
+    with pytest.raises(ValueError, match=error):
+        bots.load(str(path))
+
+
+def test_config_of_the_envs_bot(mocker):
+    mocker.patch("envs.BOTS_CONFIG", None)
+    mocker.patch("envs.TELEGRAM_BOT_TOKEN", "42:token")
+    mocker.patch("envs.AGENT_ENDPOINT", "http://agent")
+
+    (config,) = bots.configured()
+    assert config.bot_id == 42
+    assert config.agent_endpoint == "http://agent"
+
+    context = mocker.Mock(bot_data={})
+    assert bots.config(context) == config
+    context.bot_data["config"] = bots.BotConfig("math", "1001:math")
+    assert bots.config(context).name == "math"
+
+
+@pytest.fixture
+def clean_tables():
+    yield
+    with storage.SessionLocal() as session:
+        for model in (UpdateClaim, PersistedState, BotLease):
+            session.execute(delete(model))
+        session.commit()
+
+
+@pytest.mark.asyncio
+async def test_bots_share_one_process(config_file, mocker, clean_tables):
+    mocker.patch("envs.LOOP_MONITOR_ENABLED", False)
+    mocker.patch("envs.TOKEN_PURGE_INTERVAL", 0)
+    mocker.patch("envs.PROFILE_SIGNAL", "")
+    mocker.patch("envs.COMMUNICATION_MODE", "polling")
+
+    applications = [
+        main.build_application(
+            Application.builder()
+            .token(config.token)
+            .request(FakeBotRequest())
+            .get_updates_request(FakeBotRequest()),
+            config=config,
+        )
+        for config in bots.load(str(config_file))
+    ]
+    math, art = applications
+
+    shared = await main.start_shared(applications)
+    stop = asyncio.Event()
+    serving = asyncio.gather(
+        *(main.serve_bot(application, stop) for application in applications)
+    )
+    try:
+        while not (math.running and art.running):
+            await asyncio.sleep(0.01)
+
+        assert math.bot_data["usage_ledger"] is art.bot_data["usage_ledger"]
+        assert math.bot_data["profiler"] is art.bot_data["profiler"]
+        # limits and state of every bot are separate
+        assert math.bot_data["broadcast"] is not art.bot_data["broadcast"]
+        assert math.bot_data["broadcast"].bot_id == 1001
+        assert math.update_processor.bot_id == 1001
+        assert art.persistence.bot_id == 1002
+        with storage.SessionLocal() as session:
+            assert BotLease.holder("bot:1001", session)
+            assert BotLease.holder("bot:1002", session)
+    finally:
+        stop.set()
+        await serving
+        await main.stop_shared(shared)
+
+    assert not math.running and not art.running
+    with storage.SessionLocal() as session:
+        assert BotLease.holder("bot:1001", session) is None
+
+
+def test_migration_assigns_rows_to_the_bot(mocker):
+    """Rows written before the bot ids belong to the bot of the envs"""
+    mocker.patch("envs.TELEGRAM_BOT_TOKEN", "42:token")
+    engine, Session = storage.get_engine_and_sessionmaker()
+    storage.MIGRATIONS[5](engine)
+    storage.MIGRATIONS[7](engine)
+    storage.set_schema_version(engine, 7)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO update_claim (update_id, status, payload) "
+                "VALUES (1, 'interrupted', '{}')"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO persisted_state (namespace, key, value) "
+                "VALUES ('user_data', '1', '{}')"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO broadcast (text, audience, status, total, sent, failed) "
+                "VALUES ('Hello', 'all', 'running', 1, 0, 0)"
+            )
+        )
+
+    storage.init_db(engine)
+
+    assert storage.get_schema_version(engine) == storage.SCHEMA_VERSION
+    primary_key = inspect(engine).get_pk_constraint("update_claim")
+    assert primary_key["constrained_columns"] == ["bot_id", "update_id"]
+    with engine.connect() as conn:
+        for table in ("update_claim", "persisted_state", "broadcast"):
+            assert conn.execute(text(f"SELECT bot_id FROM {table}")).scalar() == 42
+
+    with Session() as session:
+        assert UpdateClaim.take_unfinished(42, session) == [(1, "{}")]
+        assert PersistedState.load(42, "user_data", session) == {"1": "{}"}
@@ -0,0 +1,249 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+import telegram
+from sqlalchemy import delete
+from sqlalchemy.exc import OperationalError
+from telegram.error import Forbidden, RetryAfter, TimedOut
+from telegram.ext import ContextTypes
+
+from broadcast import recipients
+from broadcast.fanout import BroadcastControl, Fanout, RateLimiter
+from broadcast.models import Broadcast, BroadcastRecipient, DeliveryStatus
+from main import BROADCAST_USAGE, broadcast_command
+from storage import SessionLocal
+
+
+@pytest.fixture(autouse=True)
+def clean_broadcasts():
+    # unfinished broadcasts of other tests would be resumed
+    with SessionLocal() as session:
+        session.execute(delete(BroadcastRecipient))
+        session.execute(delete(Broadcast))
+        session.commit()
+
+
+@pytest.fixture
+def broadcast_id():
+    with SessionLocal() as session:
+        return Broadcast.create("Hello", recipients.ALL, range(1, 101), session).id
+
+
+def statuses(broadcast_id):
+    with SessionLocal() as session:
+        rows = session.query(BroadcastRecipient).filter_by(broadcast_id=broadcast_id)
+        return {row.chat_id: (row.status, row.attempts) for row in rows}
+
+
+class FakeSend:
+    """Blocked users, one flood control answer and a flaky network"""
+
+    def __init__(self, blocked=(), delay=0.0):
+        self.blocked = set(blocked)
+        self.delay = delay
+        self.sent = []
+        self.rate_limited = False
+        self.timed_out = set()
+
+    async def __call__(self, chat_id, text):
+        await asyncio.sleep(self.delay)
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if chat_id == 50 and not self.rate_limited:
+            self.rate_limited = True
+            raise RetryAfter(timedelta(milliseconds=10))
+        if chat_id % 30 == 0 and chat_id not in self.timed_out:
+            self.timed_out.add(chat_id)
+            raise TimedOut()
+        self.sent.append(chat_id)
+
+
+@pytest.mark.asyncio
+async def test_fanout(broadcast_id):
+    send = FakeSend(blocked={7, 8})
+    fanout = Fanout(send, concurrency=8, rate=0, page_size=30, checkpoint_size=10)
+
+    report = await fanout.run(broadcast_id)
+
+    assert sorted(send.sent) == [i for i in range(1, 101) if i not in (7, 8)]
+    assert (report.status, report.sent, report.failed) == ("done", 98, 2)
+    assert report.rate_limited == 1 and report.retries == 3
+    assert report.errors == {"Forbidden: bot was blocked by the user": 2}
+    assert "sent 98, failed 2 of 100" in report.summary()
+
+    rows = statuses(broadcast_id)
+    assert rows[7] == (DeliveryStatus.FAILED.value, 1)
+    assert rows[30] == (DeliveryStatus.SENT.value, 2)
+    assert rows[50] == (DeliveryStatus.SENT.value, 1)
+
+    with SessionLocal() as session:
+        broadcast = Broadcast.find_by_id(broadcast_id, session)
+        assert (broadcast.status, broadcast.sent, broadcast.failed) == ("done", 98, 2)
+
+
+@pytest.mark.asyncio
+async def test_fanout_resumes(broadcast_id):
+    """Recipients reached before a restart do not get the message again"""
+    with SessionLocal() as session:
+        Broadcast.checkpoint(
+            broadcast_id,
+            [(i, DeliveryStatus.SENT, 1, None) for i in range(1, 61)],
+            session,
+        )
+
+    send = FakeSend()
+    control = BroadcastControl(Fanout(send, rate=0), deliver=asyncio.sleep)
+
+    assert broadcast_id in await control.resume()
+    await asyncio.gather(*control.tasks.values())
+
+    assert sorted(send.sent) == list(range(61, 101))
+    with SessionLocal() as session:
+        assert Broadcast.find_by_id(broadcast_id, session).sent == 100
+        assert broadcast_id not in {b.id for b in Broadcast.unfinished(session)}
+
+
+@pytest.mark.asyncio
+async def test_fanout_cancel(broadcast_id):
+    send = FakeSend(delay=0.01)
+    control = BroadcastControl(Fanout(send, concurrency=2, rate=0), asyncio.sleep)
+
+    task = control.start(broadcast_id)
+    await asyncio.sleep(0.05)
+    assert control.cancel() == [broadcast_id]
+    await task
+
+    rows = statuses(broadcast_id)
+    sent = [chat_id for chat_id, (status, _) in rows.items() if status == "sent"]
+    assert 0 < len(sent) < 100
+    assert sorted(sent) == sorted(send.sent)
+
+
+@pytest.mark.asyncio
+async def test_fanout_survives_failed_checkpoint(broadcast_id, mocker):
+    """A failed checkpoint is written with the next one, workers go on"""
+    checkpoint = Broadcast.checkpoint
+    calls = []
+
+    def fail_first(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise OperationalError("UPDATE", {}, Exception("database is locked"))
+        return checkpoint(*args)
+
+    mocker.patch.object(Broadcast, "checkpoint", side_effect=fail_first)
+    send = FakeSend()
+    fanout = Fanout(send, concurrency=4, rate=0, checkpoint_size=10)
+
+    report = await asyncio.wait_for(fanout.run(broadcast_id), timeout=10)
+
+    assert (report.status, report.sent) == ("done", 100)
+    assert len(calls) > 2
+    with SessionLocal() as session:
+        broadcast = Broadcast.find_by_id(broadcast_id, session)
+        assert (broadcast.status, broadcast.sent) == ("done", 100)
+
+
+@pytest.mark.asyncio
+async def test_fanout_does_not_hang_without_database(broadcast_id, mocker):
+    """Checkpoints keep failing: the run fails, the broadcast stays unfinished"""
+    mocker.patch.object(
+        Broadcast,
+        "checkpoint",
+        side_effect=OperationalError("UPDATE", {}, Exception("no database")),
+    )
+    fanout = Fanout(
+        mocker.AsyncMock(), concurrency=2, rate=0, page_size=10, checkpoint_size=5
+    )
+
+    with pytest.raises(OperationalError):
+        await asyncio.wait_for(fanout.run(broadcast_id), timeout=5)
+
+    with SessionLocal() as session:
+        assert broadcast_id in {b.id for b in Broadcast.unfinished(session)}
+
+
+@pytest.mark.asyncio
+async def test_fanout_unexpected_send_error(broadcast_id):
+    async def send(chat_id, text):
+        if chat_id == 3:
+            raise ValueError("unexpected")
+
+    report = await Fanout(send, concurrency=2, rate=0).run(broadcast_id)
+
+    assert (report.status, report.sent, report.failed) == ("done", 99, 1)
+    assert report.errors == {"ValueError": 1}
+    assert statuses(broadcast_id)[3] == (DeliveryStatus.FAILED.value, 1)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter():
+    limiter = RateLimiter(rate=100)
+    loop = asyncio.get_running_loop()
+
+    started = loop.time()
+    await asyncio.gather(*(limiter.wait() for _ in range(11)))
+    assert loop.time() - started >= 0.1
+
+    limiter.pause(0.05)
+    started = loop.time()
+    await limiter.wait()
+    assert loop.time() - started >= 0.05
+
+
+def test_group_members_parsing():
+    assert recipients._telegram_ids([1, "2"]) == [1, 2]
+    assert recipients._telegram_ids(
+        {"users": [{"telegram_id": 3}, {"username": "no id"}]}
+    ) == [3]
+
+
+@pytest.mark.asyncio
+async def test_broadcast_command(mocker):
+    update = mocker.Mock(spec=telegram.Update)
+    update.message = mocker.Mock(spec=telegram.Message)
+    update.message.reply_text = mocker.AsyncMock()
+    update.message.text = "/broadcast group=math Test\nis tomorrow"
+    update.effective_user = mocker.Mock()
+    update.effective_user.id = 5678
+
+    context = mocker.Mock(spec=ContextTypes.DEFAULT_TYPE)
+    context.args = ["group=math", "Test", "is", "tomorrow"]
+    control = mocker.Mock(spec=BroadcastControl)
+    context.bot_data = {"broadcast": control}
+
+    resolve = mocker.patch("broadcast.recipients.resolve", return_value=[11, 12])
+
+    # only the teacher can broadcast
+    await broadcast_command(update, context)
+    control.start.assert_not_called()
+
+    update.effective_user.id = 123456789
+    await broadcast_command(update, context)
+
+    resolve.assert_called_once_with("group:math")
+    broadcast_id = control.start.call_args.args[0]
+    with SessionLocal() as session:
+        broadcast = Broadcast.find_by_id(broadcast_id, session)
+        assert broadcast.text == "Test\nis tomorrow"
+        assert broadcast.total == 2
+
+
+@pytest.mark.asyncio
+async def test_broadcast_cancel_with_invalid_id(mocker):
+    update = mocker.Mock(spec=telegram.Update)
+    update.message = mocker.Mock(spec=telegram.Message)
+    update.message.reply_text = mocker.AsyncMock()
+    update.effective_user = mocker.Mock()
+    update.effective_user.id = 123456789
+
+    context = mocker.Mock(spec=ContextTypes.DEFAULT_TYPE)
+    context.args = ["cancel", "abc"]
+    control = mocker.Mock(spec=BroadcastControl)
+    context.bot_data = {"broadcast": control}
+
+    await broadcast_command(update, context)
+
+    control.cancel.assert_not_called()
+    update.message.reply_text.assert_awaited_once_with(BROADCAST_USAGE)
@@ -0,0 +1,45 @@
+import httpx
+import pytest
+import pytest_asyncio
+
+from benchmarks.fake_bot_api import FakeBotApi, serve
+from benchmarks.fakes import UpdateFactory
+
+
+@pytest_asyncio.fixture
+async def fake_api():
+    api = FakeBotApi(chat_rate=1, chat_burst=1, global_rate=0)
+    server, port = await serve(api)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}/bot1:x") as client:
+        yield api, client
+    server.stop()
+    await api.webhook_client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_polling_and_replies(fake_api):
+    api, client = fake_api
+    factory = UpdateFactory()
+
+    api.push_update(factory.message_data(10, "hello"))
+    api.push_update(factory.message_data(10, "again"))
+
+    response = await client.post("/getUpdates", data={"offset": "0", "timeout": "1"})
+    updates = response.json()["result"]
+    assert [update["update_id"] for update in updates] == [1, 2]
+
+    # offset confirms received updates
+    response = await client.post("/getUpdates", data={"offset": "3", "timeout": "0"})
+    assert response.json()["result"] == []
+
+    response = await client.post("/sendMessage", data={"chat_id": "10", "text": "hi"})
+    assert response.json()["result"]["chat"]["id"] == 10
+    assert len(api.latencies) == 1
+    assert api.unanswered == 1
+
+    # the second message in the same second hits the per chat limit
+    response = await client.post("/sendMessage", data={"chat_id": "10", "text": "hi"})
+    assert response.status_code == 429
+    assert response.json()["parameters"]["retry_after"] >= 1
+    assert api.rate_limited == 1
+    assert api.unanswered == 1
@@ -0,0 +1,139 @@
+import json
+from dataclasses import FrozenInstanceError
+
+import httpx
+import pytest
+import telegram
+from sqlalchemy import delete
+from telegram.ext import ContextTypes
+
+import constants
+import upstreams
+from constants import DEFAULT_LOCALE, LANGUAGE_KEYBOARD, LOCALES, locale
+from languages.cache import UserLanguages
+from languages.models import UserLanguage
+from main import handle_message, language_callback
+from storage import SessionLocal
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    yield
+    with SessionLocal() as session:
+        session.execute(delete(UserLanguage))
+        session.commit()
+
+
+def test_locales_fall_back_to_the_default_language():
+    assert locale("ru")["enter_name"] == "Пожалуйста, введите ваше имя:"
+    assert locale("es-MX").code == "es"
+    assert locale("de") is DEFAULT_LOCALE
+    assert locale(None) is DEFAULT_LOCALE
+    # shared messages are in every locale
+    assert locale("es")["welcome"] == constants.CONSTANTS["messages"]["welcome"]
+
+    for texts in LOCALES.values():
+        assert texts.texts.keys() == DEFAULT_LOCALE.texts.keys()
+
+    with pytest.raises(FrozenInstanceError):
+        DEFAULT_LOCALE.code = "ru"
+    with pytest.raises(TypeError):
+        DEFAULT_LOCALE.texts["welcome"] = "Hi"
+
+
+def test_language_keyboard():
+    (buttons,) = LANGUAGE_KEYBOARD.inline_keyboard
+    assert [button.callback_data for button in buttons] == [
+        f"lang_{code}" for code in LOCALES
+    ]
+
+
+@pytest.mark.asyncio
+async def test_languages_are_cached(mocker):
+    query = mocker.spy(UserLanguage, "get")
+    languages = UserLanguages(bot_id=1, size=2)
+    await languages.set(1, "ru")
+
+    assert await languages.get(1) == "ru"
+    # users without a language are cached too
+    assert await languages.get(2) is None
+    assert await languages.get(2) is None
+    assert query.call_count == 1
+    assert (languages.hits, languages.misses) == (2, 1)
+
+    # the least recently used user is evicted
+    await languages.get(3)
+    assert await languages.get(1) == "ru"
+    assert query.call_count == 3
+
+    # languages are stored per bot
+    assert await UserLanguages(bot_id=1).get(1) == "ru"
+    assert await UserLanguages(bot_id=2).get(1) is None
+
+
+def message_update(mocker, text: str, user_id: int = 1001):
+    update = mocker.Mock(spec=telegram.Update)
+    update.message = mocker.Mock(spec=telegram.Message)
+    update.message.reply_text = mocker.AsyncMock()
+    update.message.text = text
+    update.effective_user = mocker.Mock(spec=telegram.User)
+    update.effective_user.id = user_id
+    update.effective_user.language_code = "es"
+    return update
+
+
+def bot_context(mocker, languages: UserLanguages):
+    context = mocker.Mock(spec=ContextTypes.DEFAULT_TYPE)
+    context.bot_data = {"languages": languages}
+    context.user_data = {}
+    return context
+
+
+@pytest.mark.asyncio
+async def test_chosen_language_is_used_for_replies(mocker):
+    languages = UserLanguages()
+    context = bot_context(mocker, languages)
+
+    update = message_update(mocker, "hello")
+    update.callback_query = mocker.Mock(spec=telegram.CallbackQuery)
+    update.callback_query.data = "lang_ru"
+    update.callback_query.answer = mocker.AsyncMock()
+    update.callback_query.message.reply_text = mocker.AsyncMock()
+    await language_callback(update, context)
+
+    # before the registration is finished
+    await handle_message(update, context)
+    update.message.reply_text.assert_awaited_once_with(
+        LOCALES["ru"]["complete_registration"]
+    )
+
+    requests = []
+
+    def agent(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(502)
+
+    # the language is read from the database after a restart
+    context = bot_context(mocker, UserLanguages())
+    update = message_update(mocker, "hello")
+    upstreams.set_agent_client(httpx.AsyncClient(transport=httpx.MockTransport(agent)))
+    try:
+        await handle_message(update, context)
+    finally:
+        await upstreams.close()
+
+    assert requests[0]["language"] == "ru"
+    update.message.reply_text.assert_awaited_once_with(LOCALES["ru"]["agent_error"])
+
+
+@pytest.mark.asyncio
+async def test_language_of_the_client_before_the_choice(mocker):
+    context = bot_context(mocker, UserLanguages())
+    context.user_data["registration"] = {}
+    update = message_update(mocker, "hello")
+
+    await handle_message(update, context)
+
+    update.message.reply_text.assert_awaited_once_with(
+        LOCALES["es"]["complete_registration"]
+    )
@@ -0,0 +1,101 @@
+import io
+import json
+import logging
+import sys
+
+import pytest
+
+import log_setup
+from log_setup import JsonFormatter, RateLimitFilter, SamplingFilter
+
+
+def make_record(name="test", level=logging.INFO, msg="hello", lineno=1):
+    return logging.LogRecord(name, level, "test.py", lineno, msg, None, None)
+
+
+def test_body():
+    text = "my secret message"
+    assert log_setup.body(text, "drop") == "<17 chars>"
+    assert log_setup.body(text, "truncate", limit=9) == "my secret...<17 chars>"
+    assert log_setup.body(text, "truncate", limit=100) == text
+    assert log_setup.body(text, "full") == text
+    assert log_setup.body(None) == "<none>"
+    # bodies are dropped by default
+    assert "secret" not in log_setup.body(text)
+
+
+def test_sampling(mocker):
+    sampling = SamplingFilter(log_setup.parse_sampling("httpx=0, telegram=0.5"))
+
+    assert not sampling.filter(make_record("httpx._client"))
+    assert sampling.filter(make_record("httpx._client", logging.WARNING))
+    assert sampling.filter(make_record("main"))
+
+    mocker.patch("random.random", return_value=0.7)
+    assert not sampling.filter(make_record("telegram.ext"))
+    mocker.patch("random.random", return_value=0.2)
+    assert sampling.filter(make_record("telegram.ext"))
+
+
+def test_rate_limit(mocker):
+    clock = mocker.patch("time.monotonic", return_value=100.0)
+    limit = RateLimitFilter(burst=3, period=10)
+
+    passed = [limit.filter(make_record()) for _ in range(5)]
+    assert passed == [True, True, True, False, False]
+    # another line of code has its own limit
+    assert limit.filter(make_record(lineno=2))
+
+    clock.return_value = 110.0
+    record = make_record()
+    assert limit.filter(record)
+    assert record.suppressed == 2
+
+
+def test_json_formatter():
+    formatter = JsonFormatter(max_length=10)
+    record = make_record(msg="a long message")
+    record.user_id = 1001
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record.exc_info = sys.exc_info()
+
+    entry = json.loads(formatter.format(record))
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "test"
+    assert entry["message"] == "a long mes...<14 chars>"
+    assert entry["user_id"] == 1001
+    assert "ValueError: boom" in entry["exception"]
+
+
+@pytest.fixture
+def root_handlers():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_setup_logging(root_handlers, mocker):
+    mocker.patch("envs.LOG_SAMPLING", "noisy=0")
+    stream = io.StringIO()
+    listener = log_setup.setup_logging(stream)
+
+    logger = logging.getLogger("test_log_setup")
+    logger.info("user %s", 1001, extra={"update_id": 7})
+    logging.getLogger("noisy").info("dropped")
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("failed")
+    listener.stop()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry["message"] for entry in entries] == ["user 1001", "failed"]
+    assert entries[0]["update_id"] == 7
+    assert "ZeroDivisionError" in entries[1]["exception"]
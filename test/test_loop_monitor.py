@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+import pytest
+
+from loop_monitor import LoopMonitor, percentile
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_stall_is_attributed_to_handler(mocker):
+    """A blocking call inside a handler is detected and attributed
+    to the handler and processed update"""
+    monitor = LoopMonitor(interval=0.01, stall_threshold=0.05, report_interval=0)
+    reported = threading.Event()
+    report_stall = monitor._report_stall
+
+    def report(blocked_for):
+        report_stall(blocked_for)
+        reported.set()
+
+    mocker.patch.object(monitor, "_report_stall", side_effect=report)
+    await monitor.start()
+
+    def blocking_call():
+        # emulates sync DB call in the handler, the loop is blocked until the
+        # watchdog reports it, so the test does not depend on timings
+        assert reported.wait(timeout=10)
+
+    async def blocking_handler(update):
+        blocking_call()
+
+    update = mocker.Mock()
+    update.update_id = 42
+
+    await asyncio.sleep(0.05)
+    await blocking_handler(update)
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert len(monitor.stalls) == 1
+    stall = monitor.stalls[0]
+    assert stall.blocked_for > monitor.stall_threshold
+    assert stall.handler.endswith("blocking_handler")
+    assert stall.update_id == 42
+    assert "blocking_call" in stall.stack
+
+    snapshot = monitor.snapshot()
+    assert snapshot["stalls"] == 1
+    assert snapshot["max_ms"] >= monitor.stall_threshold * 1000
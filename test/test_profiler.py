@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+import profiler
+from bots import BotConfig
+from main import profile_command
+
+
+async def busy_handler(update):
+    deadline = time.perf_counter() + 0.2
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", [profiler.SAMPLE, profiler.CPROFILE])
+async def test_profiling_session(mocker, mode):
+    """Profiling session collects stacks per handler and delivers the result"""
+    deliver = mocker.AsyncMock()
+    control = profiler.ProfilerControl(deliver, handlers=("busy_handler",))
+
+    update = mocker.Mock()
+    update.update_id = 1
+
+    control.start(10, mode)
+    assert control.active
+
+    with pytest.raises(RuntimeError):
+        control.start(10, mode)
+
+    await busy_handler(update)
+    result = await control.stop()
+
+    assert not control.active
+    deliver.assert_awaited_once_with(result)
+    assert any(name.endswith("busy_handler") for name in result.per_handler)
+    assert "busy_handler" in result.collapsed
+
+
+@pytest.mark.asyncio
+async def test_profiling_stops_itself(mocker):
+    deliver = mocker.AsyncMock()
+    control = profiler.ProfilerControl(deliver)
+
+    control.start(0.05)
+    await asyncio.sleep(0.2)
+
+    assert not control.active
+    deliver.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_profile_command_is_teacher_only(mocker):
+    update = mocker.Mock()
+    update.effective_user.id = 1
+    update.message.reply_text = mocker.AsyncMock()
+
+    context = mocker.Mock()
+    context.args = ["1"]
+    context.bot_data = {}  # KeyError if the command tries to get the profiler
+
+    await profile_command(update, context)
+
+    update.message.reply_text.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("seconds", ["nan", "inf", "-1", "0", "abc"])
+async def test_profile_command_rejects_invalid_seconds(mocker, seconds):
+    update = mocker.Mock()
+    update.effective_user.id = 123456789
+    update.message.reply_text = mocker.AsyncMock()
+
+    control = mocker.Mock(spec=profiler.ProfilerControl)
+    context = mocker.Mock()
+    context.args = [seconds]
+    context.bot_data = {"config": BotConfig("math", "1:a", teacher_id=123456789)}
+    context.bot_data["profiler"] = control
+
+    await profile_command(update, context)
+
+    control.start.assert_not_called()
+    assert update.message.reply_text.call_args.args[0].startswith("Usage:")
+
+
+@pytest.mark.asyncio
+async def test_result_goes_to_the_deliver_of_the_session(mocker):
+    deliver = mocker.AsyncMock()
+    session_deliver = mocker.AsyncMock()
+    control = profiler.ProfilerControl(deliver)
+
+    control.start(10, deliver=session_deliver)
+    await control.stop()
+    control.start(10)
+    await control.stop()
+
+    session_deliver.assert_awaited_once()
+    deliver.assert_awaited_once()
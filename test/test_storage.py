@@ -1,4 +1,7 @@
 import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import StaticPool
 
 import storage
 # import src.storage as storage
@@ -32,6 +35,105 @@ def test_storage_endpoint(mocker, storage_kind, expected_url):
     else:
         connect_args = {}
 
+    engine_args = {}
+    if expected_url == "sqlite:///:memory:":
+        engine_args = {"poolclass": StaticPool}
+
     storage.create_engine.assert_called_once_with(
-        expected_url, echo=False, connect_args=connect_args
+        expected_url, echo=False, connect_args=connect_args, **engine_args
+    )
+
+
+def test_unreachable_database_is_not_unversioned(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/missing/dir/bot.db")
+
+    with pytest.raises(OperationalError):
+        storage.get_schema_version(engine)
+    with pytest.raises(OperationalError):
+        storage.init_db(engine)
+
+
+def test_locked_schema_version_is_raised(mocker):
+    engine = storage.get_engine_and_sessionmaker()[0]
+    storage.set_schema_version(engine, 1)
+    connect = engine.connect
+    calls = []
+
+    def locked_once():
+        # the version query fails, the schema itself can be inspected
+        calls.append(1)
+        if len(calls) == 1:
+            raise OperationalError("SELECT", {}, Exception("database is locked"))
+        return connect()
+
+    mocker.patch.object(engine, "connect", side_effect=locked_once)
+
+    with pytest.raises(OperationalError):
+        storage.get_schema_version(engine)
+
+
+def test_init_db_is_idempotent(mocker):
+    """Up to date schema is checked by one query and is not created again"""
+    engine = storage.get_engine_and_sessionmaker()[0]
+
+    assert storage.get_schema_version(engine) is None
+
+    storage.init_db(engine)
+    assert storage.get_schema_version(engine) == storage.SCHEMA_VERSION
+    assert inspect(engine).has_table("auth_user")
+
+    create_all = mocker.patch.object(storage.Base.metadata, "create_all")
+    storage.init_db(engine)
+    create_all.assert_not_called()
+
+
+def test_init_db_migrates(mocker):
+    """Migrations are applied one by one from the current schema version"""
+    engine = storage.get_engine_and_sessionmaker()[0]
+    storage.init_db(engine)
+
+    migrate = mocker.Mock()
+    mocker.patch.object(storage, "SCHEMA_VERSION", storage.SCHEMA_VERSION + 1)
+    mocker.patch.dict(storage.MIGRATIONS, {storage.SCHEMA_VERSION: migrate})
+
+    storage.init_db(engine)
+
+    migrate.assert_called_once_with(engine)
+    assert storage.get_schema_version(engine) == storage.SCHEMA_VERSION
+
+
+def test_replica_router(mocker):
+    """Replicas are used round-robin, a failed one is skipped for a while"""
+    primary = storage.create_engine("sqlite://")
+    first, second = (
+        storage.create_engine("sqlite://"),
+        storage.create_engine("sqlite://"),
     )
+    router = storage.ReplicaRouter(primary, [first, second], cooldown=30)
+
+    assert router.engines() == [first, second, primary]
+    assert router.engines() == [second, first, primary]
+
+    router.mark_down(first)
+    assert router.engines() == [second, primary]
+
+    monotonic = mocker.patch("storage.time.monotonic")
+    monotonic.return_value = 10**9
+    assert router.engines() == [second, first, primary]
+
+
+def test_run_read_fails_over(mocker):
+    """Unavailable replica is marked down and the read goes to the next engine"""
+    broken = storage.create_engine("sqlite:////not/existing/dir/replica.db")
+    router = storage.ReplicaRouter(storage.engine, [broken], cooldown=30)
+    mocker.patch("storage.read_router", router)
+
+    def query(session):
+        return session.execute(storage.text("SELECT 1")).scalar()
+
+    assert storage.run_read(query) == 1
+    assert not router.is_healthy(broken)
+    assert router.engines() == [storage.engine]
+
+    with storage.ReadSessionLocal() as session:
+        assert session.get_bind() is storage.engine
@@ -0,0 +1,231 @@
+import asyncio
+import json
+from datetime import timedelta
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from sqlalchemy import delete
+from telegram import Update
+
+from bots import BotConfig
+from main import drain
+from storage import SessionLocal
+from token_auth_db.models import utcnow
+from updates.lease import Lease
+from updates.models import BotLease, ClaimStatus, PersistedState, UpdateClaim
+from updates.persistence import DbPersistence
+from updates.processor import ClaimingUpdateProcessor
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    yield
+    with SessionLocal() as session:
+        for model in (UpdateClaim, PersistedState, BotLease):
+            session.execute(delete(model))
+        session.commit()
+
+
+def claim_status(update_id: int, bot_id: int = 0):
+    with SessionLocal() as session:
+        claim = session.get(UpdateClaim, (bot_id, update_id))
+        return claim and (ClaimStatus(claim.status), claim.payload)
+
+
+async def handled(calls: list, update_id: int, delay: float = 0.0):
+    await asyncio.sleep(delay)
+    calls.append(update_id)
+
+
+def test_claim_once_and_finish_with_next_claim():
+    with SessionLocal() as session:
+        assert UpdateClaim.claim(0, 1, "{}", [], session)
+        assert not UpdateClaim.claim(0, 1, "{}", [], session)
+        # update ids of another bot
+        assert UpdateClaim.claim(42, 1, "{}", [], session)
+        assert UpdateClaim.claim(0, 2, "{}", [1], session)
+
+    assert claim_status(1) == (ClaimStatus.DONE, None)
+    assert claim_status(2) == (ClaimStatus.PROCESSING, "{}")
+    assert claim_status(1, bot_id=42) == (ClaimStatus.PROCESSING, "{}")
+
+
+def test_take_unfinished_and_purge():
+    with SessionLocal() as session:
+        UpdateClaim.claim(0, 1, '{"update_id": 1}', [], session)
+        UpdateClaim.claim(0, 2, '{"update_id": 2}', [], session)
+        UpdateClaim.interrupt(0, 3, '{"update_id": 3}', session)
+        UpdateClaim.interrupt(42, 4, '{"update_id": 4}', session)
+        UpdateClaim.finish(0, [2], session)
+
+        assert UpdateClaim.take_unfinished(0, session) == [
+            (1, '{"update_id": 1}'),
+            (3, '{"update_id": 3}'),
+        ]
+        assert claim_status(3) == (ClaimStatus.PROCESSING, '{"update_id": 3}')
+
+        assert UpdateClaim.purge(utcnow() - timedelta(hours=1), session) == 0
+        assert UpdateClaim.purge(utcnow() + timedelta(seconds=1), session) == 1
+    assert claim_status(2) is None
+
+
+@pytest.mark.asyncio
+async def test_processor_skips_duplicates():
+    processor = ClaimingUpdateProcessor(finish_interval=0.01)
+    await processor.initialize()
+    calls = []
+    try:
+        await processor.do_process_update(Update(1), handled(calls, 1))
+        await processor.do_process_update(Update(1), handled(calls, 1))
+        await processor.do_process_update(Update(2), handled(calls, 2))
+        await asyncio.sleep(0.05)
+    finally:
+        await processor.shutdown()
+
+    assert calls == [1, 2]
+    assert processor.stats.processed == 2
+    assert processor.stats.duplicates == 1
+    assert claim_status(1) == (ClaimStatus.DONE, None)
+    assert claim_status(2) == (ClaimStatus.DONE, None)
+
+
+@pytest.mark.asyncio
+async def test_processor_without_claims():
+    processor = ClaimingUpdateProcessor(claims=False)
+    calls = []
+    await processor.do_process_update(Update(1), handled(calls, 1))
+    await processor.do_process_update(Update(1), handled(calls, 1))
+
+    assert calls == [1, 1]
+    assert claim_status(1) is None
+
+
+@pytest.mark.asyncio
+async def test_interrupted_updates_are_replayed():
+    processor = ClaimingUpdateProcessor()
+    calls = []
+    running = asyncio.create_task(
+        processor.do_process_update(Update(1), handled(calls, 1, delay=10))
+    )
+    await asyncio.sleep(0.05)
+    assert processor.in_flight == 1
+
+    assert processor.interrupt() == [1]
+    await running
+    # updates that come after the deadline are not started
+    await processor.do_process_update(Update(2), handled(calls, 2))
+    await processor.shutdown()
+
+    assert calls == []
+    assert processor.stats.interrupted == 2
+    assert claim_status(1)[0] == ClaimStatus.INTERRUPTED
+    assert json.loads(claim_status(2)[1])["update_id"] == 2
+
+    # the next instance
+    application = Mock(update_queue=asyncio.Queue(), bot=None)
+    processor = ClaimingUpdateProcessor()
+    assert await processor.replay(application) == [1, 2]
+    while not application.update_queue.empty():
+        update = application.update_queue.get_nowait()
+        await processor.do_process_update(update, handled(calls, update.update_id))
+    await processor.shutdown()
+
+    assert calls == [1, 2]
+    assert processor.stats.duplicates == 0
+    assert claim_status(1) == (ClaimStatus.DONE, None)
+    assert await processor.replay(application) == []
+
+
+@pytest.mark.asyncio
+async def test_drain_interrupts_after_timeout():
+    processor = ClaimingUpdateProcessor()
+    calls = []
+    running = asyncio.create_task(
+        processor.do_process_update(Update(1), handled(calls, 1, delay=10))
+    )
+    await asyncio.sleep(0.05)
+
+    application = Mock(
+        updater=Mock(stop=AsyncMock()),
+        update_processor=processor,
+        post_stop=AsyncMock(),
+    )
+
+    async def stop():
+        # PTB waits for updates in the queue
+        await running
+
+    application.stop = stop
+    await asyncio.wait_for(drain(application, timeout=0.05), timeout=1)
+
+    application.updater.stop.assert_awaited_once()
+    application.post_stop.assert_awaited_once_with(application)
+    assert processor.interrupted
+    assert claim_status(1)[0] == ClaimStatus.INTERRUPTED
+
+
+@pytest.mark.asyncio
+async def test_persistence_round_trip():
+    persistence = DbPersistence()
+    await persistence.update_user_data(1, {"registration": {"language": "en"}})
+    await persistence.update_user_data(2, {})
+    await persistence.update_conversation("registration", (1, 1), 2)
+    await persistence.update_conversation("registration", (3, 3), 1)
+    await persistence.update_conversation("registration", (3, 3), None)
+
+    restored = DbPersistence()
+    assert await restored.get_user_data() == {1: {"registration": {"language": "en"}}}
+    assert await restored.get_conversations("registration") == {(1, 1): 2}
+
+    await restored.drop_user_data(1)
+    assert await DbPersistence().get_user_data() == {}
+
+
+@pytest.mark.asyncio
+async def test_persistence_skips_unchanged_values(mocker):
+    persistence = DbPersistence()
+    await persistence.update_user_data(1, {"a": 1})
+    save = mocker.spy(PersistedState, "save")
+    await persistence.update_user_data(1, {"a": 1})
+    assert save.call_count == 0
+    await persistence.update_user_data(1, {"a": 2})
+    assert save.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_lease_is_held_by_one_instance():
+    name = BotConfig("math", "42:secret").lease_name
+    assert name == "bot:42"
+    old = Lease(name, ttl=30)
+    new = Lease(name, ttl=30)
+    await old.acquire()
+
+    waiting = asyncio.create_task(new.acquire(poll_interval=0.01))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+
+    await old.release()
+    await asyncio.wait_for(waiting, timeout=1)
+    with SessionLocal() as session:
+        assert BotLease.holder(name, session).owner == new.owner
+    await new.release()
+
+
+def test_expired_lease_is_taken():
+    with SessionLocal() as session:
+        assert BotLease.acquire("bot:1", "old", -1, session)
+        assert BotLease.acquire("bot:1", "new", 30, session)
+        assert not BotLease.acquire("bot:1", "old", 30, session)
+        # only the owner releases the lease
+        BotLease.release("bot:1", "old", session)
+        assert BotLease.holder("bot:1", session).owner == "new"
+
+
+@pytest.mark.asyncio
+async def test_persistence_of_bots_is_separate():
+    await DbPersistence(bot_id=1).update_user_data(1, {"a": 1})
+    await DbPersistence(bot_id=2).update_user_data(1, {"a": 2})
+
+    assert await DbPersistence(bot_id=1).get_user_data() == {1: {"a": 1}}
+    assert await DbPersistence(bot_id=2).get_user_data() == {1: {"a": 2}}
+    assert await DbPersistence(bot_id=3).get_user_data() == {}
@@ -0,0 +1,163 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+import pytest_asyncio
+import telegram
+from sqlalchemy import delete
+from telegram.ext import ContextTypes
+
+import upstreams
+from main import handle_message
+from storage import SessionLocal
+from usage.ledger import UsageLedger
+from usage.models import UsageRecord
+
+
+@pytest.fixture(autouse=True)
+def clean_records():
+    yield
+    with SessionLocal() as session:
+        session.execute(delete(UsageRecord))
+        session.commit()
+
+
+def count_records() -> int:
+    with SessionLocal() as session:
+        return session.query(UsageRecord).count()
+
+
+@pytest_asyncio.fixture
+async def ledger():
+    ledger = UsageLedger(flush_size=10, flush_interval=0.05, max_pending=20)
+    await ledger.start()
+    yield ledger
+    await ledger.stop()
+
+
+@pytest.mark.asyncio
+async def test_flush_on_size_and_time(ledger):
+    for i in range(10):
+        await ledger.record(1001, 0.1, request_size=5, response_size=10)
+    # size threshold wakes up the flusher
+    await asyncio.sleep(0.01)
+    assert count_records() == 10
+
+    await ledger.record(1001, 0.2, error="http_502")
+    assert count_records() == 10
+    await asyncio.sleep(0.1)
+    assert count_records() == 11
+    assert ledger.stats.flushed == 11
+
+
+@pytest.mark.asyncio
+async def test_flush_on_stop():
+    ledger = UsageLedger(flush_size=100, flush_interval=60)
+    await ledger.start()
+    await ledger.record(1001, 0.1)
+    await ledger.stop()
+
+    assert count_records() == 1
+
+
+@pytest.mark.asyncio
+async def test_backpressure(mocker):
+    """Records wait for space while the database is down, then are dropped"""
+    ledger = UsageLedger(
+        flush_size=5, flush_interval=0.01, max_pending=5, backpressure_timeout=0.05
+    )
+    insert = mocker.patch.object(ledger, "_insert", side_effect=RuntimeError("down"))
+    await ledger.start()
+
+    for i in range(7):
+        await ledger.record(1001, 0.1)
+
+    assert ledger.pending == 5
+    assert ledger.stats.dropped == 2
+    assert ledger.stats.throttled == 2
+    assert ledger.stats.failed_flushes >= 1
+
+    # the database is back
+    insert.side_effect = None
+    await ledger.stop()
+    assert ledger.pending == 0
+    assert ledger.stats.flushed == 5
+
+
+@pytest.mark.asyncio
+async def test_stop_during_flush(mocker):
+    ledger = UsageLedger(flush_size=1, flush_interval=60)
+    original = ledger._insert
+
+    def slow_insert(rows):
+        time.sleep(0.05)
+        original(rows)
+
+    mocker.patch.object(ledger, "_insert", side_effect=slow_insert)
+    await ledger.start()
+    await ledger.record(1001, 0.1)
+    await asyncio.sleep(0.01)
+    await ledger.stop()
+
+    assert count_records() == 1
+    assert ledger.stats.flushed == 1
+
+
+def test_aggregates():
+    now = datetime.now(timezone.utc)
+    rows = [
+        dict(user_id=1001, created_at=now, latency_ms=100, response_size=10),
+        dict(user_id=1001, created_at=now, latency_ms=300, response_size=30),
+        dict(user_id=1234, created_at=now, latency_ms=50, error="TimeoutError"),
+        dict(user_id=1234, created_at=now - timedelta(days=3), latency_ms=10),
+    ]
+    with SessionLocal() as session:
+        UsageRecord.bulk_insert(
+            [dict(request_size=1, response_size=0, error=None) | row for row in rows],
+            session,
+        )
+
+        users = UsageRecord.per_user(session, since=now - timedelta(days=1))
+        assert [(u.user_id, u.messages, u.errors) for u in users] == [
+            (1001, 2, 0),
+            (1234, 1, 1),
+        ]
+        assert users[0].avg_latency_ms == 200
+        assert users[0].max_latency_ms == 300
+        assert users[0].response_size == 40
+
+        days = UsageRecord.per_day(session, user_id=1234)
+        assert [day.messages for day in days] == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_handle_message_records_usage(mocker, caplog):
+    update = mocker.Mock(spec=telegram.Update)
+    update.message = mocker.Mock(spec=telegram.Message)
+    update.message.reply_text = mocker.AsyncMock()
+    update.message.text = "hello"
+    update.effective_user = mocker.Mock()
+    update.effective_user.id = 1001
+
+    mocker.patch("envs.AGENT_ENDPOINT", "http://agent.local")
+    ledger = mocker.Mock(spec=UsageLedger)
+    context = mocker.Mock(spec=ContextTypes.DEFAULT_TYPE)
+    context.bot_data = {"usage_ledger": ledger}
+    context.user_data = {}
+
+    def agent(request):
+        return httpx.Response(200, json={"message": "hi there"})
+
+    upstreams.set_agent_client(httpx.AsyncClient(transport=httpx.MockTransport(agent)))
+    try:
+        await handle_message(update, context)
+    finally:
+        await upstreams.close()
+
+    ledger.record.assert_called_once_with(
+        1001, mocker.ANY, request_size=5, response_size=8, error=None
+    )
+    # texts are not logged
+    assert "hello" not in caplog.text and "hi there" not in caplog.text
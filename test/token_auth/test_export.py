@@ -0,0 +1,91 @@
+import csv
+import io
+import json
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+
+from storage import Base, SessionLocal, engine, init_db
+from token_auth_db.export import export
+from token_auth_db.models import AuthAction, AuthToken, AuthUser, utcnow
+
+
+@pytest.fixture
+def session():
+    # other tests leave their rows
+    Base.metadata.drop_all(bind=engine)
+    init_db(engine)
+
+    with SessionLocal() as session:
+        read = AuthAction(name="read")
+        write = AuthAction(name="write")
+        for i in range(10):
+            user = AuthUser(id=1000 + i, name=f"user{i}")
+            token = AuthToken(id=f"token{i}", user=user)
+            token.actions.extend([read, write] if i % 2 else [read])
+            session.add(user)
+        session.add(AuthToken(id="free"))
+        session.commit()
+
+        yield session
+
+    Base.metadata.drop_all(bind=engine)
+    init_db(engine)
+
+
+@pytest.fixture
+def queries():
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    yield statements
+    event.remove(engine, "before_cursor_execute", count)
+
+
+def test_export_ndjson(session, queries):
+    """Every user is a line, relationships are loaded by batches"""
+    out = io.StringIO()
+    result = export(out, "ndjson", batch_size=3)
+
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert result.records == len(records) == 11
+    assert records[1]["id"] == 1001
+    assert records[1]["tokens"][0]["id"] == "token1"
+    assert records[1]["tokens"][0]["actions"] == ["read", "write"]
+    assert records[-1]["id"] is None
+    assert records[-1]["tokens"][0]["id"] == "free"
+
+    # users, tokens and actions per batch of 3 users + unbound tokens
+    assert len(queries) <= 4 * 3 + 2
+
+
+def test_export_csv(session):
+    out = io.StringIO()
+    export(out, "csv")
+
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert len(rows) == 5 * 1 + 5 * 2 + 1
+    assert rows[0]["user_id"] == "1000" and rows[0]["action"] == "read"
+    assert rows[-1]["token_id"] == "free" and rows[-1]["action"] == ""
+
+
+def test_export_incremental(session):
+    """Only users with changed rows are exported after the watermark"""
+    since = utcnow() + timedelta(seconds=1)
+
+    out = io.StringIO()
+    assert export(out, "ndjson", since=since).records == 0
+
+    user = AuthUser.find_by_id(1003, session)
+    user.tokens[0].updated_at = since + timedelta(seconds=1)
+    session.commit()
+
+    out = io.StringIO()
+    result = export(out, "ndjson", since=since)
+    assert result.records == 1
+    assert json.loads(out.getvalue())["id"] == 1003
+    assert result.watermark < utcnow()
@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import BigInteger, inspect, text
+
+import storage
+from token_auth_db.migrations import telegram_ids_to_bigint
+from token_auth_db.models import AuthToken, AuthUser
+
+# schema created before the migration to bigint telegram ids
+SCHEMA_V1 = [
+    "CREATE TABLE auth_action (name VARCHAR NOT NULL, description VARCHAR, PRIMARY KEY (name))",
+    "CREATE TABLE auth_user (id VARCHAR NOT NULL, name VARCHAR NOT NULL, PRIMARY KEY (id))",
+    "CREATE UNIQUE INDEX ix_auth_user_id ON auth_user (id)",
+    "CREATE TABLE auth_token (id VARCHAR NOT NULL, user_id INTEGER, PRIMARY KEY (id), "
+    "FOREIGN KEY(user_id) REFERENCES auth_user (id))",
+    "CREATE INDEX ix_auth_token_user_id ON auth_token (user_id)",
+    "CREATE UNIQUE INDEX ix_auth_token_id ON auth_token (id)",
+    "CREATE TABLE token_action (token_hash VARCHAR NOT NULL, action_name VARCHAR NOT NULL, "
+    "PRIMARY KEY (token_hash, action_name), "
+    "FOREIGN KEY(token_hash) REFERENCES auth_token (id), "
+    "FOREIGN KEY(action_name) REFERENCES auth_action (name))",
+]
+
+
+@pytest.fixture
+def engine_v1():
+    engine = storage.get_engine_and_sessionmaker()[0]
+    with engine.begin() as conn:
+        for statement in SCHEMA_V1:
+            conn.exec_driver_sql(statement)
+
+        conn.exec_driver_sql("INSERT INTO auth_action VALUES ('read', 'Read')")
+        for i in range(1, 8):
+            conn.exec_driver_sql(f"INSERT INTO auth_user VALUES ('{i}', 'user{i}')")
+            conn.exec_driver_sql(f"INSERT INTO auth_token VALUES ('token{i}', {i})")
+            conn.exec_driver_sql(
+                f"INSERT INTO token_action VALUES ('token{i}', 'read')"
+            )
+        conn.exec_driver_sql("INSERT INTO auth_token VALUES ('free', NULL)")
+    return engine
+
+
+def test_migration_to_bigint(engine_v1, mocker):
+    """Existing rows are copied in batches into tables with bigint keys"""
+    mocker.patch("token_auth_db.migrations.BATCH_SIZE", 3)
+    storage.init_db(engine_v1)
+
+    assert storage.get_schema_version(engine_v1) == storage.SCHEMA_VERSION
+
+    inspector = inspect(engine_v1)
+    columns = {c["name"]: c["type"] for c in inspector.get_columns("auth_user")}
+    assert isinstance(columns["id"], BigInteger)
+    columns = {c["name"]: c["type"] for c in inspector.get_columns("auth_token")}
+    assert isinstance(columns["user_id"], BigInteger)
+    assert {"expires_at", "updated_at"} <= set(columns)
+    assert not inspector.has_table("auth_user_v1")
+
+    # association table still references the tokens
+    fks = inspector.get_foreign_keys("token_action")
+    assert {fk["referred_table"] for fk in fks} == {"auth_token", "auth_action"}
+
+    session = storage.sessionmaker(bind=engine_v1)()
+    user = AuthUser.find_by_id(3, session)
+    assert user.name == "user3"
+    assert [token.id for token in user.tokens] == ["token3"]
+    assert [action.name for action in user.tokens[0].actions] == ["read"]
+    assert AuthToken.find_by_id("free", session).user is None
+    session.close()
+
+
+def test_migration_rejects_non_numeric_ids(engine_v1):
+    with engine_v1.begin() as conn:
+        conn.execute(text("INSERT INTO auth_user VALUES ('tgabcd', 'Alice')"))
+
+    with pytest.raises(RuntimeError, match="not numeric"):
+        telegram_ids_to_bigint(engine_v1, batch_size=3)
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from storage import Base, SessionLocal, engine, init_db
+from token_auth_db.models import AuthAction, AuthToken, AuthUser, BindStatus
+from token_auth_db.purge import PurgeJob, purge_expired
+
+
+@pytest.fixture
+def session():
+    with SessionLocal() as session:
+        yield session
+
+    Base.metadata.drop_all(bind=engine)
+    init_db(engine)
+
+
+def test_expired_token_lookups(session):
+    """Expired tokens can not be found or bound"""
+    past = datetime.now(timezone.utc) - timedelta(days=1)
+    future = datetime.now(timezone.utc) + timedelta(days=1)
+
+    AuthToken.create("expired", session, expires_at=past)
+    AuthToken.create("active", session, expires_at=future)
+    AuthToken.create("forever", session)
+
+    assert AuthToken.find_by_id("expired", session) is None
+    assert not AuthToken.exists("expired", session)
+    assert AuthToken.bind("expired", 1234, "Alice", session) is BindStatus.NOT_FOUND
+
+    assert AuthToken.exists("active", session)
+    assert AuthToken.find_by_id("forever", session) is not None
+    assert AuthToken.bind("active", 1234, "Alice", session) is BindStatus.BOUND
+
+
+def test_purge_expired(session):
+    """Expired tokens, their actions and users without tokens are removed"""
+    now = datetime.now(timezone.utc)
+    read = AuthAction(name="read")
+
+    alice = AuthUser(id=1001, name="Alice")
+    bob = AuthUser(id=1234, name="Bob")
+    for i in range(5):
+        token = AuthToken(id=f"alice{i}", user=alice, expires_at=now - timedelta(1))
+        token.actions.append(read)
+    AuthToken(id="bob_old", user=bob, expires_at=now - timedelta(1))
+    AuthToken(id="bob_new", user=bob, expires_at=now + timedelta(1))
+    session.add_all([alice, bob, AuthToken(id="free")])
+    session.commit()
+
+    result = purge_expired(engine, batch_size=2, now=now)
+
+    assert (result.tokens, result.token_actions, result.users) == (6, 5, 1)
+    assert result.batches == 4
+
+    session.expire_all()
+    assert not AuthUser.exists(1001, session)
+    assert [token.id for token in AuthUser.find_by_id(1234, session).tokens] == [
+        "bob_new"
+    ]
+    assert AuthToken.exists("free", session)
+    assert session.get(AuthAction, "read") is not None
+
+    # nothing left to purge
+    assert purge_expired(engine, batch_size=2, now=now).tokens == 0
+
+
+@pytest.mark.asyncio
+async def test_purge_job(session):
+    AuthToken.create(
+        "expired", session, expires_at=datetime.now(timezone.utc) - timedelta(1)
+    )
+
+    job = PurgeJob(engine, interval=3600)
+    await job.start()
+    await job.stop()
+
+    result = await job.run_once()
+    assert job.last is result
+    assert not AuthToken.exists("expired", session)
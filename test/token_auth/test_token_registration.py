@@ -2,8 +2,12 @@ import logging
 import pytest
 
 from unittest.mock import ANY
+from sqlalchemy.orm import Session
+
+import storage
 from main import token_command
-from token_auth_db.models import AuthUser, AuthToken
+from storage import SessionLocal
+from token_auth_db.models import AuthUser, AuthToken, BindStatus
 
 import telegram
 from telegram.ext import ContextTypes
@@ -19,7 +23,7 @@ def update(mocker):
     update.message = message
     update.effective_user = mocker.Mock()
     update.effective_user.username = "Alice"
-    update.effective_user.id = "tg1234"
+    update.effective_user.id = 1234
     update.effective_chat = mocker.Mock(spec=telegram.Chat)
     return update
 
@@ -28,6 +32,7 @@ def update(mocker):
 def context(mocker):
     context = mocker.Mock(spec=ContextTypes.DEFAULT_TYPE)
     context.args = list()
+    context.bot_data = {}
     return context
 
 
@@ -59,59 +64,46 @@ async def test_non_existed_token(update, context, mocker, caplog):
 @pytest.mark.asyncio
 async def test_new_user(update, context, mocker):
     """Check case with new token but when user is not registered yet.
-    In that case new user is created"""
-    token = mocker.Mock(spec=AuthToken)
-    token.id = "token1234"
-    token.user = None
-
-    context.args.append(token.id)
+    The token is bound to the user in a single call"""
+    context.args.append("token1234")
 
-    mocker.patch("token_auth_db.models.AuthToken.find_by_id", return_value=token)
-    mocker.patch("token_auth_db.models.AuthUser.find_by_id", return_value=None)
-    mocker.patch("token_auth_db.models.AuthUser.create")
+    mocker.patch("token_auth_db.models.AuthToken.bind", return_value=BindStatus.BOUND)
 
     await token_command(update, context)
 
-    AuthUser.create.assert_called_once_with(
+    AuthToken.bind.assert_called_once_with(
+        "token1234",
         update.effective_user.id,
         update.effective_user.username,
         ANY,  # it's session, we don't have access to check
     )
+    update.message.reply_text.assert_not_called()
 
 
 @pytest.mark.asyncio
-async def test_existing_user(update, context, mocker, caplog):
-    """Check case with new token for exsiting user.
-    In that case new token is appended to other user's tokens"""
+async def test_existing_user(update, context, caplog):
+    """Check case with new token for exsiting user and
+    with token that already registered by the user"""
     caplog.set_level(logging.INFO)
+    update.effective_user.id = 4321
 
-    user = mocker.Mock(spec=AuthUser)
-    user.id = "tg1234"
-    user.name = "Alice"
-    user.tokens = []
-
-    token = mocker.Mock(spec=AuthToken)
-    token.id = "token1234"
-    token.user = None
-
-    context.args.append(token.id)
+    with SessionLocal() as session:
+        AuthUser.create(update.effective_user.id, "Alice", session)
+        AuthToken.create("token_existing", session)
 
-    mocker.patch("token_auth_db.models.AuthToken.find_by_id", return_value=token)
-    mocker.patch("token_auth_db.models.AuthUser.find_by_id", return_value=user)
-    mocker.patch("token_auth_db.models.AuthUser.create")
+    context.args.append("token_existing")
 
     await token_command(update, context)
 
-    assert len(user.tokens) == 1
-    assert user.tokens[0].id == "token1234"
+    with SessionLocal() as session:
+        user = AuthUser.find_by_id(update.effective_user.id, session)
+        assert [token.id for token in user.tokens] == ["token_existing"]
 
     # check case when user already as token
-    user.tokens = [token]
-    mocker.patch("token_auth_db.models.AuthUser.find_by_id", return_value=user)
-
     await token_command(update, context)
 
     assert "Nothing to do, token already registered" in caplog.text
+    update.message.reply_text.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -120,38 +112,52 @@ async def test_assigned_user(update, context, mocker, caplog):
     In that case new we check matching current usser with assigned"""
     caplog.set_level(logging.INFO)
 
-    alice = mocker.Mock(spec=AuthUser)
-    alice.id = "tg1234"
-    alice.name = "Alice"
-    alice.tokens = []
+    context.args.append("token1234")
 
-    bob = mocker.Mock(spec=AuthUser)
-    bob.id = "tg5678"
-    bob.name = "Bob"
-    bob.tokens = []
+    mocker.patch("token_auth_db.models.AuthToken.bind", return_value=BindStatus.FOREIGN)
 
-    token = mocker.Mock(spec=AuthToken)
-    token.id = "token1234"
-    token.user_id = alice.id
-    token.user = alice
+    await token_command(update, context)
 
-    context.args.append(token.id)
+    assert "however token belongs to another user" in caplog.text
+    update.message.reply_text.assert_called_once_with(
+        "Passed token is not valid, please check that it is correct"
+    )
 
-    mocker.patch("token_auth_db.models.AuthToken.find_by_id", return_value=token)
-    mocker.patch("token_auth_db.models.AuthUser.find_by_id", return_value=alice)
-    mocker.patch("token_auth_db.models.AuthUser.create")
 
-    await token_command(update, context)
+@pytest.fixture
+def replica(tmp_path, mocker):
+    """Read replica with its own data, reads without a session go to it"""
+    replica = storage.create_engine(f"sqlite:///{tmp_path}/replica.db")
+    storage.Base.metadata.create_all(replica)
+    mocker.patch(
+        "storage.read_router", storage.ReplicaRouter(storage.engine, [replica])
+    )
+    with Session(replica) as session:
+        AuthUser.create(4321, "Bob", session)
+        token = AuthToken.create("token_replicated", session)
+        token.user_id = 4321
+        session.commit()
+    return replica
 
-    assert "Token belongs to the same user, everything is Ok" in caplog.text
 
-    # change assigned user to Bob
-    token.user_id = bob.id
-    token.user = bob
-    mocker.patch("token_auth_db.models.AuthToken.find_by_id", return_value=token)
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "user_id, status", [(4321, BindStatus.ALREADY_BOUND), (1234, BindStatus.FOREIGN)]
+)
+async def test_bound_token_is_checked_on_replica(
+    update, context, mocker, replica, user_id, status
+):
+    """Bound tokens are answered from the replica, the primary is not used"""
+    update.effective_user.id = user_id
+    context.args.append("token_replicated")
+    bind = mocker.spy(AuthToken, "bind")
 
     await token_command(update, context)
 
-    update.message.reply_text.assert_called_once_with(
-        "Passed token is not valid, please check that it is correct"
-    )
+    bind.assert_not_called()
+    if status is BindStatus.FOREIGN:
+        update.message.reply_text.assert_called_once()
+    else:
+        update.message.reply_text.assert_not_called()
+    with SessionLocal() as session:
+        assert AuthToken.find_by_id("token_replicated", session) is None
@@ -1,9 +1,16 @@
 import pytest
 
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 
 from storage import SessionLocal, init_db, engine, Base
-from token_auth_db.models import AuthUser, AuthToken, AuthAction
+from token_auth_db.models import (
+    BIND_ATTEMPTS,
+    AuthAction,
+    AuthToken,
+    AuthUser,
+    BindStatus,
+)
 
 
 @pytest.fixture
@@ -22,24 +29,28 @@ def session():
 def test_user(session):
     """Check that the User table functioning without errors"""
 
-    AuthUser.create(user_id="tgabcd", username="Alice", session=session)
-    AuthUser.create(user_id="tg1234", username="Bob", session=session)
+    AuthUser.create(user_id=1001, username="Alice", session=session)
+    AuthUser.create(user_id=1234, username="Bob", session=session)
     session.commit()
 
-    user = AuthUser.find_by_id("tgabcd", session)
+    user = AuthUser.find_by_id(1001, session)
     assert user.name == "Alice"
 
-    user = AuthUser.find_by_id("tgxxxx", session)
+    user = AuthUser.find_by_id(9999, session)
     assert user is None
 
-    assert AuthUser.exists("tg1234", session)
-    assert not AuthUser.exists("tg5678", session)
+    assert AuthUser.exists(1234, session)
+    assert not AuthUser.exists(5678, session)
+
+    # without a session it is read on a replica (the primary in tests)
+    assert AuthUser.exists(1234)
+    assert AuthUser.find_by_id(1001).name == "Alice"
 
 
 def test_token(session):
     """Check that the Token table functioning without errors"""
-    user1 = AuthUser(id="tgabcd", name="Alice")
-    user2 = AuthUser(id="tg1234", name="Bob")
+    user1 = AuthUser(id=1001, name="Alice")
+    user2 = AuthUser(id=1234, name="Bob")
 
     AuthToken(id="token123", user=user1)
     AuthToken(id="token345", user=user1)
@@ -48,8 +59,8 @@ def test_token(session):
     session.add_all([user1, user2])
     session.commit()
 
-    alice = AuthUser.find_by_id("tgabcd", session)
-    bob = AuthUser.find_by_id("tg1234", session)
+    alice = AuthUser.find_by_id(1001, session)
+    bob = AuthUser.find_by_id(1234, session)
 
     alice_tokens = {token.id for token in alice.tokens}
     bob_tokens = {token.id for token in bob.tokens}
@@ -63,7 +74,7 @@ def test_token(session):
     assert bob.revoke_token("token567", session)  # returns true in success
     session.commit()
 
-    bob = AuthUser.find_by_id("tg1234", session)
+    bob = AuthUser.find_by_id(1234, session)
     assert len(bob.tokens) == 0
 
     assert not bob.revoke_token("token567", session)  # already revoken
@@ -87,12 +98,62 @@ def test_standalone_token(session):
 
     # check assigning user to a token
     token = AuthToken.find_by_id("token123", session)
-    user = AuthUser(id="tg1234", name="Alice")
+    user = AuthUser(id=1234, name="Alice")
 
     token.user = user
     session.commit()
 
-    assert AuthUser.find_by_id("tg1234", session).tokens[0].id == "token123"
+    assert AuthUser.find_by_id(1234, session).tokens[0].id == "token123"
+
+
+def test_bind(session):
+    """Check binding tokens to new and existing users"""
+    session.add_all([AuthToken(id="token123"), AuthToken(id="token345")])
+    session.commit()
+
+    assert AuthToken.bind("unknown", 1234, "Alice", session) is BindStatus.NOT_FOUND
+    assert not AuthUser.exists(1234, session)
+
+    # new user is created
+    assert AuthToken.bind("token123", 1234, "Alice", session) is BindStatus.BOUND
+    assert AuthToken.bind("token123", 1234, "Alice", session) is (
+        BindStatus.ALREADY_BOUND
+    )
+
+    # another token of the existing user
+    assert AuthToken.bind("token345", 1234, "Alice", session) is BindStatus.BOUND
+
+    assert AuthToken.bind("token123", 5678, "Bob", session) is BindStatus.FOREIGN
+    assert not AuthUser.exists(5678, session)
+
+    user = AuthUser.find_by_id(1234, session)
+    assert user.name == "Alice"
+    assert {"token123", "token345"} == {token.id for token in user.tokens}
+
+
+def test_bind_is_retried_on_integrity_error(session, mocker):
+    """The purge can delete the user while the token is bound to it"""
+    session.add(AuthToken(id="token123"))
+    session.commit()
+
+    deleted = IntegrityError("UPDATE auth_token", {}, Exception("FOREIGN KEY"))
+    real_bind_once = AuthToken._bind_once
+
+    def fail_once(*args):
+        if bind_once.call_count == 1:
+            raise deleted
+        return real_bind_once(*args)
+
+    bind_once = mocker.patch.object(AuthToken, "_bind_once", side_effect=fail_once)
+
+    assert AuthToken.bind("token123", 1234, "Alice", session) is BindStatus.BOUND
+    assert bind_once.call_count == 2
+    assert AuthUser.find_by_id(1234, session).tokens[0].id == "token123"
+
+    bind_once.side_effect = deleted
+    with pytest.raises(IntegrityError):
+        AuthToken.bind("token123", 1234, "Alice", session)
+    assert bind_once.call_count == 2 + BIND_ATTEMPTS
 
 
 def test_action(session):
@@ -101,8 +162,8 @@ def test_action(session):
     - actions cen be removed
     - token revokation also remove corresponding actions from users abilities
     """
-    user1 = AuthUser(id="tgabcd", name="Alice")
-    user2 = AuthUser(id="tg1234", name="Bob")
+    user1 = AuthUser(id=1001, name="Alice")
+    user2 = AuthUser(id=1234, name="Bob")
 
     token1 = AuthToken(id="token123", user=user1)
     token2 = AuthToken(id="token345", user=user1)
@@ -128,7 +189,7 @@ def test_action(session):
         select(AuthToken)
         .join(AuthToken.user)
         .join(AuthToken.actions)
-        .where(AuthUser.id == "tg1234", AuthAction.name == "airflow_read")
+        .where(AuthUser.id == 1234, AuthAction.name == "airflow_read")
         .limit(1)
     )
 
@@ -138,9 +199,7 @@ def test_action(session):
     # Add action for Bob
     ####################
     token = (
-        session.query(AuthToken)
-        .filter_by(user_id="tg1234", id="token567")
-        .one_or_none()
+        session.query(AuthToken).filter_by(user_id=1234, id="token567").one_or_none()
     )
     token.actions.append(action_airflow_read)
     session.commit()
@@ -165,7 +224,7 @@ def test_action(session):
         select(AuthAction)
         .join(AuthToken.actions)
         .join(AuthToken.user)
-        .where(AuthToken.user_id == "tgabcd")
+        .where(AuthToken.user_id == 1001)
         .distinct()
     )
 
@@ -188,7 +247,7 @@ def test_action(session):
         select(AuthAction)
         .join(AuthToken.actions)
         .join(AuthToken.user)
-        .where(AuthToken.user_id == "tg1234")
+        .where(AuthToken.user_id == 1234)
         .distinct()
     )
 